@@ -0,0 +1,198 @@
+# asyncio 服務：I/O 密集的 /api/roof-detect 與 /api/llm_decision
+# 對外呼叫（Static Maps、Gemini）以 aiohttp 非同步進行，等待時不佔用執行緒，
+# 單一行程即可同時保有數百個進行中的 Gemini 呼叫；多邊形前處理、影像處理與本地分割等 CPU 工作交給執行緒池
+# 流程與結果快取和同步版本（run.detect_roof、dsa_backend llm_decision_payload）共用，只有等待方式不同
+# /api/recommend 等 CPU 密集或快速的端點仍由同步的 Flask worker 處理，nginx 只需把上述兩個路徑轉到本服務
+#   python aio_app.py（埠口 AIO_PORT，預設 8090）
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import payload, web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import load_service
+from common.admission import Shed, client_id, shed_body
+from common.aio_http import create_async_http_pool
+from common.deadline import Deadline, DeadlineExceeded, request_deadline
+from common.memory import memory_stats
+from common.metrics import metrics
+from common.warmup import warmup
+from imagery_cache import request_key
+from imagery_planner import stitch_frames
+
+# 執行 CPU 工作的執行緒數；request 本文上限（位元組）
+AIO_CPU_WORKERS = int(os.environ.get("AIO_CPU_WORKERS", str(os.cpu_count() or 4)))
+AIO_MAX_BODY_BYTES = int(os.environ.get("AIO_MAX_BODY_BYTES", str(16 * 1024 * 1024)))
+
+roof = load_service("roof")
+recommend = load_service("recommend")
+
+
+def create_aio_app():
+    http = create_async_http_pool()
+    cpu = ThreadPoolExecutor(max_workers=AIO_CPU_WORKERS, thread_name_prefix="aio-cpu")
+
+    async def run_cpu(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(cpu, fn, *args)
+
+    async def fetch_static_map(params, deadline):
+        key = request_key(params)
+        cached = await run_cpu(roof.imagery_cache.get, key)
+        if cached is not None:
+            return cached
+        resp = await http.get(roof.static_map_url(params), deadline=deadline)
+        if resp.status_code != 200:
+            print("無法取得地圖圖片", resp.status_code, resp.text)
+            return None
+        await run_cpu(roof.imagery_cache.put, key, resp.content)
+        return resp.content
+
+    async def run_roof_detect(prepared, deadline):
+        """run.run_roof_detect 的 asyncio 版本，回傳 (結果 dict, HTTP 狀態碼)"""
+        contents = await asyncio.gather(
+            *(fetch_static_map(params, deadline) for params in prepared.frame_params()), return_exceptions=True
+        )
+        for content in contents:
+            if isinstance(content, DeadlineExceeded):
+                return roof.deadline_exceeded("imagery", content)
+        contents = [None if isinstance(content, BaseException) else content for content in contents]
+        img_content = await run_cpu(stitch_frames, prepared.plan, contents)
+        if img_content is None:
+            return {"error": "無法取得地圖圖片"}, 500
+        if prepared.engine == "local":
+            return await run_cpu(roof.settle_roof_detect, prepared, img_content, None, None)
+
+        url, headers, body = await run_cpu(roof.gemini_vision_request, img_content, prepared.plan, prepared.polygon)
+        # 本文以非同步迭代逐段送出（base64 分段編碼），長度由 headers 的 Content-Length 指定，不使用 chunked
+        body = payload.AsyncIterablePayload(body, content_type=headers["Content-Type"])
+        try:
+            resp = await http.post(url, headers=headers, data=body, deadline=deadline)
+        except DeadlineExceeded as e:
+            result, status = roof.deadline_exceeded("gemini", e)
+            if e.reason == "cancelled":
+                return result, status
+            return await run_cpu(roof.settle_roof_detect, prepared, img_content, result, status, True)
+        except Exception as e:
+            print("Gemini Vision API 連線失敗：", e)
+            result, status = {"error": "Gemini Vision API 失敗", "detail": str(e)}, 500
+        else:
+            result, status = roof.parse_gemini_vision_response(resp)
+        return await run_cpu(roof.settle_roof_detect, prepared, img_content, result, status)
+
+    async def generate_llm_outputs(summary):
+        url, payload = recommend.gemini_llm_request(summary)
+        # 呼叫在請求逾時後仍繼續以回填快取，以單次呼叫的期限限制（同步版本相同）
+        resp = await http.post(url, json=payload, deadline=Deadline(recommend.LLM_CALL_DEADLINE))
+        if resp.status_code != 200:
+            raise RuntimeError(f"Gemini API 失敗 {resp.status_code}: {resp.text}")
+        return recommend.parse_gemini_llm_response(resp.json())
+
+    async def read_json(request):
+        try:
+            data = await request.json()
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    async def admit(admission, request, deadline):
+        """准入控制（預算與同步版本相同），拒絕時回傳 429 回應"""
+        try:
+            await admission.admit_async(client_id(request.headers, request.remote), deadline.remaining())
+        except Shed as e:
+            body, headers = shed_body(e)
+            return web.json_response(body, status=429, headers=headers)
+        return None
+
+    def deadline_for(request, default_seconds):
+        """請求期限；連線已關閉時視為用戶端離開"""
+        return request_deadline(
+            request.headers,
+            default_seconds,
+            lambda: request.transport is None or request.transport.is_closing(),
+        )
+
+    async def roof_detect_view(request):
+        deadline = deadline_for(request, roof.ROOF_DETECT_DEADLINE)
+        data = await read_json(request)
+        if data is None:
+            return web.json_response({"error": "請提供 JSON 內容"}, status=400)
+        prepared = await run_cpu(roof.prepare_roof_detect, data)
+        if not isinstance(prepared, roof.RoofDetectRequest):
+            result, status = prepared
+            return web.json_response(result, status=status)
+        rejected = await admit(roof.roof_admission, request, deadline)
+        if rejected is not None:
+            return rejected
+        result, status = await run_roof_detect(prepared, deadline)
+        return web.json_response(result, status=status)
+
+    async def llm_decision_view(request):
+        deadline = deadline_for(request, recommend.LLM_DECISION_DEADLINE)
+        data = await read_json(request)
+        if data is None:
+            return web.json_response({"error": "請提供 JSON 內容"}, status=400)
+        error = recommend.llm_decision_error(data)
+        if error is not None:
+            return web.json_response(error, status=400)
+        summary = recommend.llm_decision_summary(data)
+        if not recommend.llm_hedge.is_cached(summary):
+            rejected = await admit(recommend.llm_admission, request, deadline)
+            if rejected is not None:
+                return rejected
+        # 本地評分以正規化後的縣市查日照
+        result, source = await recommend.llm_hedge.decide_async(
+            summary,
+            generate_llm_outputs,
+            summary,
+            {**data, "address": recommend.resolve_city(data)},
+            recommend.llm_deadline_seconds(deadline),
+        )
+        result["source"] = source
+        return web.json_response(result)
+
+    async def metrics_view(request):
+        return web.json_response({
+            **metrics.snapshot(),
+            "aio_http": http.stats(),
+            **roof.service_stats(),
+            "llm_decision_admission": recommend.llm_admission.stats(),
+            "memory": memory_stats(),
+        })
+
+    async def health_view(request):
+        return web.json_response({"status": "ok"})
+
+    async def ready_view(request):
+        return web.json_response(warmup.status(), status=200 if warmup.ready else 503)
+
+    async def on_startup(app):
+        await http.start()
+        # 預熱在背景執行緒進行，完成前 /api/ready 回傳 503
+        warmup.start()
+
+    async def on_cleanup(app):
+        await http.close()
+        cpu.shutdown(wait=False)
+
+    app = web.Application(client_max_size=AIO_MAX_BODY_BYTES)
+    app.router.add_post("/api/roof-detect", roof_detect_view)
+    app.router.add_post("/api/llm_decision", llm_decision_view)
+    app.router.add_get("/api/metrics", metrics_view)
+    app.router.add_get("/api/health", health_view)
+    app.router.add_get("/api/ready", ready_view)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(
+        create_aio_app(),
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("AIO_PORT", "8090")),
+        access_log=None,
+        # 用戶端斷線時取消處理中的請求，連帶取消尚未完成的對外呼叫
+        handler_cancellation=True,
+    )
@@ -1,10 +1,73 @@
+import importlib
+import os
+import sys
+
 from flask import Flask
+from flask_cors import CORS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.dirname(BACKEND_DIR)
+DSA_BACKEND_DIR = os.path.join(SRC_DIR, "dsa_backend")
+
+# 可掛載的服務
+# roof：屋頂辨識、面積計算、登入與前端靜態檔（src/backend/run.py）
+# recommend：推薦、LLM 評估、日照/地理/案場查詢（src/dsa_backend/app.py）
+# pages：伺服器端頁面（app/routes.py）
+SERVICES = ("roof", "recommend", "pages")
+
+
+def load_service(name):
+    """載入 roof 或 recommend 服務模組"""
+    # 兩個服務都以檔名直接 import 同目錄的模組，需把各自的目錄加入搜尋路徑
+    for path in (BACKEND_DIR, SRC_DIR, DSA_BACKEND_DIR):
+        if path not in sys.path:
+            sys.path.append(path)
+    # dsa_backend/app.py 與本套件同名，以 dsa_backend.app 載入
+    return importlib.import_module("run" if name == "roof" else "dsa_backend.app")
+
 
-def create_app():
-    app = Flask(__name__)
+def create_app(services=None):
+    """
+    services 為要掛載的服務，未指定時依環境變數 APP_SERVICES（逗號分隔，預設 "roof,recommend"）
+    同一個行程內的服務共用連線池、快取與指標，服務之間直接呼叫函式，不經 HTTP
+    """
+    if services is None:
+        services = os.environ.get("APP_SERVICES", "roof,recommend").split(",")
+    services = [s.strip() for s in services if s.strip()]
+    unknown = set(services) - set(SERVICES)
+    if unknown:
+        raise ValueError(f"未知的服務：{', '.join(sorted(unknown))}（可用：{', '.join(SERVICES)}）")
+
+    # config.Config 位於 src/backend
+    if BACKEND_DIR not in sys.path:
+        sys.path.append(BACKEND_DIR)
+
+    # 前端靜態檔與獨立部署的 run.py 相同
+    app = Flask(__name__, static_folder=os.path.join(BACKEND_DIR, "static") if "roof" in services else "static")
     app.config.from_object('config.Config')
 
-    from . import routes
-    app.register_blueprint(routes.bp)
+    if "pages" in services:
+        from . import routes
+        app.register_blueprint(routes.bp)
+
+    stats_providers = []
+    loaded = {}
+    for name in ("roof", "recommend"):
+        if name in services:
+            module = loaded[name] = load_service(name)
+            module.init_app(app)
+            stats_providers.append(module.service_stats)
+
+    # 兩個服務在同一個行程時，提供不經 HTTP 串接兩者的 /api/pipeline
+    if len(loaded) == 2:
+        import pipeline
+        app.register_blueprint(pipeline.create_blueprint(loaded["roof"], loaded["recommend"]))
+
+    if stats_providers:
+        from common.server import register_metrics_route, register_probe_routes
+
+        CORS(app, resources={r"/*": {"origins": "*"}})
+        register_metrics_route(app, stats_providers)
+        register_probe_routes(app)
 
     return app
@@ -0,0 +1,95 @@
+# 共用准入狀態（SQLite BucketStore）的吞吐量與延遲：多個行程同時對同一個端點預約
+#   python bench_admission.py --processes 4 --threads 8 --seconds 5
+#       每個行程各自建立 AdmissionController，所有執行緒不停呼叫 reserve()，統計每秒決策數與單次延遲
+#   --rate 預設極大（全部放行），量測的是交易本身的成本；--rate 5 等低速率則大多數請求被拒絕，
+#   拒絕同樣需要一次交易；--clients 為輪流使用的用戶端數，--local 改為每個行程各自計算作為對照
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.admission import AdmissionController, BucketStore, Shed
+
+
+class _NullMetrics:
+    def incr(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def gauge_set(self, *args, **kwargs):
+        pass
+
+
+def worker(path, args, worker_id, results):
+    store = None if args.local else BucketStore(path)
+    controller = AdmissionController(
+        "bench", rate=args.rate, burst=args.rate, client_rate=args.rate, client_burst=args.rate,
+        max_queue=0, max_wait=0, metrics=_NullMetrics(), store=store,
+    )
+    stop = time.monotonic() + args.seconds
+    latencies, admitted = [], [0]
+
+    def run(thread_id):
+        local, count, i = [], 0, 0
+        while time.monotonic() < stop:
+            client = f"10.0.{worker_id}.{(thread_id + i) % args.clients}"
+            start = time.perf_counter()
+            try:
+                controller.reserve(client)
+                count += 1
+            except Shed:
+                pass
+            local.append(time.perf_counter() - start)
+            i += 1
+        latencies.extend(local)
+        admitted[0] += count
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((len(latencies), admitted[0], np.percentile(latencies, [50, 99]).tolist() if latencies else [0, 0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共用准入狀態基準測試")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=1e9)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--local", action="store_true")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "admission.sqlite3")
+    BucketStore(path)
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, args, w, results)) for w in range(args.processes)]
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    decisions = sum(s[0] for s in stats)
+    admitted = sum(s[1] for s in stats)
+    p50 = max(s[2][0] for s in stats) * 1000
+    p99 = max(s[2][1] for s in stats) * 1000
+    mode = "各行程各自計算" if args.local else "共用 SQLite"
+    print(f"{mode}：{args.processes} 行程 × {args.threads} 執行緒，{args.seconds:g} 秒")
+    print(f"  決策 {decisions / args.seconds:.0f} 次/秒（放行 {admitted / args.seconds:.0f} 次/秒）")
+    print(f"  單次延遲 p50 {p50:.2f} ms、p99 {p99:.2f} ms（各行程中最大值）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# asyncio 與同步 worker 的並行度比較（本機替身 Gemini，不呼叫外部 API）
+#   python bench_aio.py standin --port 9999 --delay 1.0
+#       啟動替身 Gemini：每個請求固定延遲後回傳合法的 generateContent 回應
+#   GEMINI_API_BASE=http://127.0.0.1:9999 python ../dsa_backend/app.py      （同步，:5001）
+#   GEMINI_API_BASE=http://127.0.0.1:9999 python aio_app.py                 （asyncio，:8090）
+#   python bench_aio.py load --url http://127.0.0.1:8090/api/llm_decision --concurrency 200
+#       同時送出 concurrency 個（內容各不相同、不會命中快取）的 llm_decision 請求，
+#       統計延遲與結果來源（llm = 期限內拿到 Gemini 結果，rule_based = 逾時改用本地評分）
+# 兩個服務都需放寬 llm_decision 的准入（所有請求來自同一位址，預設 CLIENT_BURST=10 會擋下大部分請求）：
+#   LLM_ADMISSION_RATE / _BURST / _CLIENT_RATE / _CLIENT_BURST / _MAX_QUEUE 設為 ≥ concurrency，LLM_ADMISSION_MAX_WAIT=1
+#   ADMISSION_STORE_PATH=            （空字串：各行程自行計算，不寫共用的 SQLite）
+# 同步服務另需：
+#   SERVER_MODE=production WEB_WORKERS=1 WEB_THREADS=32
+#   LLM_MAX_WORKERS=32               （Gemini 呼叫池與執行緒數相同；預設 8 時並行度受限於呼叫池而非 worker）
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+
+def standin_app(delay):
+    body = {
+        "candidates": [{"content": {"parts": [{"text": json.dumps({
+            "final_recommendation": "推薦安裝",
+            "score": 0.8,
+            "explanation_text": "替身服務回應",
+        }, ensure_ascii=False)}]}}],
+    }
+    in_flight = {"now": 0, "max": 0}
+
+    async def generate(request):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            await asyncio.sleep(delay)
+            return web.json_response(body)
+        finally:
+            in_flight["now"] -= 1
+
+    async def stats(request):
+        return web.json_response(in_flight)
+
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{model}", generate)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def llm_request(i):
+    return {
+        "module_name": "DBK420HFA",
+        "efficiency_percent": 21.51,
+        "efficiency_level": "高效",
+        # 每個請求的容量不同，避免命中 LLM 結果快取
+        "capacity_kw": 10 + i * 0.01,
+        "address": "台南市",
+        "annual_generation_kwh": 10641,
+        "install_cost_ntd": 794062,
+        "annual_revenue_ntd": 70717,
+        "payback_years": 11.2,
+    }
+
+
+async def run_load(url, concurrency, offset):
+    latencies, sources = [], Counter()
+
+    async def one(session, i):
+        start = time.perf_counter()
+        try:
+            async with session.post(url, json=llm_request(offset + i)) as resp:
+                data = await resp.json()
+                sources[data.get("source", f"http_{resp.status}")] += 1
+        except aiohttp.ClientError as e:
+            sources[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    print(f"{concurrency} 個請求，總時間 {elapsed:.2f} s，{concurrency / elapsed:.1f} req/s")
+    print(f"延遲 p50 {pct(0.5):.0f} ms  p95 {pct(0.95):.0f} ms  max {latencies[-1] * 1000:.0f} ms")
+    print("結果來源：", dict(sources))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="mode", required=True)
+    standin = sub.add_parser("standin")
+    standin.add_argument("--port", type=int, default=9999)
+    standin.add_argument("--delay", type=float, default=1.0)
+    load = sub.add_parser("load")
+    load.add_argument("--url", required=True)
+    load.add_argument("--concurrency", type=int, default=200)
+    load.add_argument("--offset", type=int, default=int(time.time()) % 100000 * 1000)
+    args = parser.parse_args()
+
+    if args.mode == "standin":
+        web.run_app(standin_app(args.delay), host="127.0.0.1", port=args.port, access_log=None)
+    else:
+        asyncio.run(run_load(args.url, args.concurrency, args.offset))
+
+
+if __name__ == "__main__":
+    main()
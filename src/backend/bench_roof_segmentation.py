@@ -0,0 +1,181 @@
+# 本地屋頂分割的準確度與延遲基準測試
+#   python bench_roof_segmentation.py synthetic --count 200
+#       合成衛星圖（已知真實輪廓）：面積誤差、IoU 與延遲
+#   python bench_roof_segmentation.py gemini --limit 500
+#       與結果快取中的 Gemini Vision 結果比對（只使用已快取的衛星圖，不呼叫外部 API）
+import argparse
+import io
+import math
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from imagery_cache import latlng_to_world_px, world_px_to_latlng
+from roof_area import latlng_dicts_to_array, polygon_area
+from roof_segmentation import SegmentationError, meters_per_pixel, segment_roof
+
+BENCH_LAT, BENCH_LNG, BENCH_ZOOM = 25.03, 121.56, 20
+MASK_PX = 512
+
+
+def polygon_iou(a, b):
+    """兩個 [{lat, lng}, ...] 多邊形在共同外接矩形上點陣化後的 IoU"""
+    lats = [p["lat"] for p in a + b]
+    lngs = [p["lng"] for p in a + b]
+    south, north, west, east = min(lats), max(lats), min(lngs), max(lngs)
+    span = max(north - south, (east - west) * math.cos(math.radians((south + north) / 2)), 1e-12)
+
+    def rasterize(polygon):
+        image = Image.new("1", (MASK_PX, MASK_PX))
+        points = [
+            ((p["lng"] - west) * math.cos(math.radians((south + north) / 2)) / span * (MASK_PX - 1),
+             (north - p["lat"]) / span * (MASK_PX - 1))
+            for p in polygon
+        ]
+        ImageDraw.Draw(image).polygon(points, fill=1)
+        return np.asarray(image, dtype=bool)
+
+    mask_a, mask_b = rasterize(a), rasterize(b)
+    union = (mask_a | mask_b).sum()
+    return float((mask_a & mask_b).sum() / union) if union else 0.0
+
+
+def synthetic_scene(rng, size=640):
+    """隨機產生一張含旋轉矩形或 L 形屋頂、道路、樹木與雜訊的衛星圖，回傳 (PNG bytes, 真實輪廓)"""
+    ground = tuple(int(v) for v in rng.integers(60, 120, 3))
+    image = Image.new("RGB", (size, size), ground)
+    draw = ImageDraw.Draw(image)
+    # 道路與鄰近的樹冠
+    road_y = int(rng.integers(size * 0.7, size * 0.85))
+    draw.rectangle([0, road_y, size, road_y + 40], fill=(70, 70, 72))
+    for _ in range(int(rng.integers(3, 8))):
+        x, y, r = rng.integers(0, size), rng.integers(0, size), rng.integers(15, 40)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(40, int(rng.integers(80, 110)), 40))
+
+    # 以圖片中心為基準的屋頂輪廓（像素）
+    half_w, half_h = rng.integers(40, 180), rng.integers(40, 140)
+    shape = [(-half_w, -half_h), (half_w, -half_h), (half_w, half_h), (-half_w, half_h)]
+    if rng.random() < 0.4:
+        notch_w, notch_h = half_w, half_h
+        shape = [(-half_w, -half_h), (half_w, -half_h), (half_w, half_h - notch_h * 0.8),
+                 (half_w - notch_w * 0.8, half_h - notch_h * 0.8), (half_w - notch_w * 0.8, half_h), (-half_w, half_h)]
+    angle = math.radians(rng.uniform(0, 90))
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    outline = [(size / 2 + x * cos_a - y * sin_a, size / 2 + x * sin_a + y * cos_a) for x, y in shape]
+    roof = tuple(int(v) for v in rng.integers(140, 230, 3))
+    draw.polygon(outline, fill=roof)
+    # 屋脊線
+    ridge = tuple(max(0, v - 35) for v in roof)
+    draw.line([(size / 2 - half_w * cos_a, size / 2 - half_w * sin_a),
+               (size / 2 + half_w * cos_a, size / 2 + half_w * sin_a)], fill=ridge, width=3)
+
+    pixels = np.asarray(image, dtype=float) + rng.normal(0, 6, (size, size, 3))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+
+    cx, cy = latlng_to_world_px(BENCH_LAT, BENCH_LNG, BENCH_ZOOM)
+    truth = []
+    for x, y in outline:
+        lat, lng = world_px_to_latlng(cx + x - size / 2, cy + y - size / 2, BENCH_ZOOM)
+        truth.append({"lat": lat, "lng": lng})
+    return out.getvalue(), truth
+
+
+def summarize(name, latencies, area_errors, ious, failures, total):
+    latencies = np.array(latencies) * 1000
+    print(f"[{name}] 成功 {total - failures}/{total}")
+    if len(latencies):
+        print(f"  延遲 p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms")
+    if area_errors:
+        errors = np.abs(area_errors) * 100
+        print(f"  面積誤差 中位數 {np.median(errors):.1f}%, p90 {np.percentile(errors, 90):.1f}%")
+    if ious:
+        print(f"  IoU 中位數 {np.median(ious):.3f}, p10 {np.percentile(ious, 10):.3f}")
+
+
+def bench_synthetic(count, seed, work_px):
+    rng = np.random.default_rng(seed)
+    latencies, area_errors, ious, failures = [], [], [], 0
+    for _ in range(count):
+        content, truth = synthetic_scene(rng)
+        truth_area = polygon_area(latlng_dicts_to_array(truth))
+        start = time.perf_counter()
+        try:
+            result = segment_roof(content, BENCH_LAT, BENCH_LNG, BENCH_ZOOM, work_px=work_px)
+        except SegmentationError:
+            failures += 1
+            continue
+        finally:
+            latencies.append(time.perf_counter() - start)
+        area_errors.append(result["area"] / truth_area - 1)
+        ious.append(polygon_iou(result["polygon"], truth))
+    summarize("synthetic", latencies, area_errors, ious, failures, count)
+    print(f"  解析度 {meters_per_pixel(BENCH_LAT, BENCH_ZOOM):.3f} m/px，工作影像長邊 {work_px} px")
+
+
+def bench_gemini(limit, work_px):
+    """以快取中的 Gemini 結果（僅自動辨識的點位）為參考答案"""
+    from run import (
+        IMAGERY_MAX_ZOOM, ROOF_MODEL_VERSION, imagery_cache, roof_result_cache, static_map_params,
+    )
+    from imagery_cache import request_key
+
+    entries = roof_result_cache.query_bbox(-90, -180, 90, 180, version=ROOF_MODEL_VERSION, limit=limit)
+    latencies, area_errors, ious, failures, total = [], [], [], 0, 0
+    for entry in entries:
+        reference = entry["result"]
+        if ":point:" not in entry["key"] or not isinstance(reference, dict) or "area" not in reference:
+            continue
+        params = static_map_params(entry["lat"], entry["lng"], zoom=IMAGERY_MAX_ZOOM)
+        # 快取內容以 mmap 對應，只在辨識期間有效
+        with imagery_cache.mapped(request_key(params)) as content:
+            if content is None:
+                continue
+            total += 1
+            center_lat, center_lng = (float(v) for v in params["center"].split(","))
+            start = time.perf_counter()
+            try:
+                result = segment_roof(
+                    content, center_lat, center_lng, IMAGERY_MAX_ZOOM, entry["lat"], entry["lng"], work_px=work_px
+                )
+            except SegmentationError:
+                failures += 1
+                continue
+            finally:
+                latencies.append(time.perf_counter() - start)
+        try:
+            area_errors.append(result["area"] / float(reference["area"]) - 1)
+        except (TypeError, ValueError, ZeroDivisionError):
+            pass
+        if isinstance(reference.get("polygon"), list) and len(reference["polygon"]) >= 3:
+            try:
+                ious.append(polygon_iou(result["polygon"], reference["polygon"]))
+            except (KeyError, TypeError):
+                pass
+    if total == 0:
+        print("結果快取中沒有可比對的 Gemini 結果（需同時有快取的衛星圖）")
+        return
+    summarize("gemini", latencies, area_errors, ious, failures, total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地屋頂分割基準測試")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    synthetic = sub.add_parser("synthetic")
+    synthetic.add_argument("--count", type=int, default=200)
+    synthetic.add_argument("--seed", type=int, default=0)
+    gemini = sub.add_parser("gemini")
+    gemini.add_argument("--limit", type=int, default=1000)
+    for p in (synthetic, gemini):
+        p.add_argument("--work-px", type=int, default=256)
+    args = parser.parse_args()
+    if args.mode == "synthetic":
+        bench_synthetic(args.count, args.seed, args.work_px)
+    else:
+        bench_gemini(args.limit, args.work_px)
+
+
+if __name__ == "__main__":
+    main()
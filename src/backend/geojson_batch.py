@@ -0,0 +1,66 @@
+# GeoJSON FeatureCollection 批次屋頂面積計算
+# 將所有 Polygon / MultiPolygon 的環攤平成單一頂點陣列，一次向量化計算所有環的面積
+import numpy as np
+
+from roof_area import signed_ring_areas_batch
+
+
+def _feature_polygons(geometry):
+    """回傳 geometry 內的多邊形列表，每個多邊形為 [外環, 孔洞...]"""
+    if not isinstance(geometry, dict):
+        raise ValueError("缺少 geometry")
+    geom_type = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if geom_type == "Polygon":
+        return [coordinates]
+    if geom_type == "MultiPolygon":
+        return coordinates
+    raise ValueError(f"不支援的 geometry 類型: {geom_type}")
+
+
+def feature_areas(features):
+    """
+    計算每個 Feature 的面積（平方米）
+    回傳與 features 等長的結果列表：{"id": ..., "area": ...} 或 {"id": ..., "error": ...}
+    """
+    chunks = []        # 各環頂點（[lat, lng]）
+    ring_feature = []  # 每個環所屬的 feature 索引
+    ring_sign = []     # 外環 +1、孔洞 -1
+    errors = {}
+
+    for index, feature in enumerate(features):
+        try:
+            rings = []
+            for polygon in _feature_polygons(feature.get("geometry")):
+                for ring_index, ring in enumerate(polygon):
+                    # GeoJSON 座標順序為 [lng, lat]
+                    ring = np.asarray(ring, dtype=float)
+                    if ring.ndim != 2 or ring.shape[1] < 2:
+                        raise ValueError("座標格式錯誤")
+                    if len(ring) >= 3:
+                        rings.append((ring[:, 1::-1], 1 if ring_index == 0 else -1))
+        except (ValueError, TypeError, AttributeError) as e:
+            errors[index] = str(e)
+            continue
+        for ring, sign in rings:
+            chunks.append(ring)
+            ring_feature.append(index)
+            ring_sign.append(sign)
+
+    areas = np.zeros(len(features))
+    if chunks:
+        counts = np.array([len(c) for c in chunks])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        ring_areas = np.abs(signed_ring_areas_batch(np.concatenate(chunks), starts))
+        areas = np.bincount(ring_feature, weights=ring_areas * np.array(ring_sign), minlength=len(features))
+
+    results = []
+    for index, feature in enumerate(features):
+        feature_id = feature.get("id") if isinstance(feature, dict) else None
+        if feature_id is None and isinstance(feature, dict):
+            feature_id = (feature.get("properties") or {}).get("id")
+        if index in errors:
+            results.append({"id": feature_id, "error": errors[index]})
+        else:
+            results.append({"id": feature_id, "area": round(max(float(areas[index]), 0.0), 2)})
+    return results
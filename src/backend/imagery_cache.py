@@ -0,0 +1,263 @@
+# Google Static Maps 衛星圖快取
+# 以正規化後的請求參數雜湊為 key，圖片內容以自身 SHA-256 命名存放（content-addressed）；
+# LRU 索引與總容量記在同目錄的 SQLite（index.sqlite3），多個 worker 行程共用同一份索引與容量上限，
+# 寫檔、建立索引與淘汰刪檔都在同一個寫入交易內進行，不會刪掉其他行程剛建立索引的檔案
+# 命中時以 mmap 唯讀對應檔案，對應在 with 區塊結束時關閉
+import contextlib
+import hashlib
+import math
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+TILE_SIZE = 256
+
+
+def latlng_to_world_px(lat, lng, zoom):
+    """經緯度轉 Web Mercator 世界像素座標"""
+    scale = TILE_SIZE * (2 ** zoom)
+    siny = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    x = scale * (0.5 + lng / 360)
+    y = scale * (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi))
+    return x, y
+
+
+def world_px_to_latlng(x, y, zoom):
+    scale = TILE_SIZE * (2 ** zoom)
+    lng = (x / scale - 0.5) * 360
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lng
+
+
+def snap_center(lat, lng, zoom, grid_px):
+    """將中心點對齊到 zoom 層級下每 grid_px 像素的格點，讓相近請求共用同一張圖"""
+    x, y = latlng_to_world_px(lat, lng, zoom)
+    x = round(x / grid_px) * grid_px
+    y = round(y / grid_px) * grid_px
+    lat, lng = world_px_to_latlng(x, y, zoom)
+    return round(lat, 7), round(lng, 7)
+
+
+def request_key(params):
+    """正規化參數的雜湊值；params 為已正規化的 dict"""
+    canonical = "&".join(f"{k}={params[k]}" for k in sorted(params) if params[k] is not None)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ImageryCache:
+    # 命中時更新最近使用時間的最短間隔（秒）；間隔內重複命中只讀不寫，避免每次命中都取得寫入鎖
+    TOUCH_INTERVAL = 60.0
+    # 啟動時清除超過此秒數、未建立索引的暫存檔與圖檔（寫入中途結束的行程留下的）
+    ORPHAN_AGE = 3600.0
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.path = os.path.join(root, "index.sqlite3")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS imagery_entries ("
+            " key TEXT PRIMARY KEY, digest TEXT NOT NULL, used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS imagery_entries_used ON imagery_entries (used)")
+        conn.execute("CREATE INDEX IF NOT EXISTS imagery_entries_digest ON imagery_entries (digest)")
+        conn.execute("CREATE TABLE IF NOT EXISTS imagery_blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        conn.commit()
+        conn.close()
+        self._transaction(self._import_key_files)
+        self._remove_orphans()
+
+    def _conn(self):
+        # sqlite 連線不可跨執行緒或跨 fork 共用，每個執行緒（行程）各自開啟；交易由 _transaction 自行控制
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, fn, *args):
+        """在 BEGIN IMMEDIATE 交易內執行 fn(conn, *args)，同一時間只有一個行程能寫入索引或檔案"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+            conn.execute("COMMIT")
+            return result
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _import_key_files(self, conn):
+        """舊版以 keys/ 目錄存放索引：匯入 SQLite 後刪除，保留原本的 LRU 順序（key 檔修改時間）"""
+        key_dir = os.path.join(self.root, "keys")
+        if not os.path.isdir(key_dir):
+            return
+        for name in os.listdir(key_dir):
+            path = os.path.join(key_dir, name)
+            try:
+                if not name.endswith(".tmp"):
+                    with open(path, encoding="utf-8") as f:
+                        digest = f.read().strip()
+                    size = os.path.getsize(self._blob_path(digest))
+                    conn.execute(
+                        "INSERT OR IGNORE INTO imagery_entries (key, digest, used) VALUES (?, ?, ?)",
+                        (name, digest, os.path.getmtime(path)),
+                    )
+                    conn.execute("INSERT OR IGNORE INTO imagery_blobs (digest, size) VALUES (?, ?)", (digest, size))
+            except OSError:
+                pass
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        with contextlib.suppress(OSError):
+            os.rmdir(key_dir)
+        self._evict(conn)
+
+    def _remove_orphans(self):
+        indexed = {row[0] for row in self._conn().execute("SELECT digest FROM imagery_blobs")}
+        cutoff = time.time() - self.ORPHAN_AGE
+        for dirpath, _, names in os.walk(self.blob_dir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                with contextlib.suppress(OSError):
+                    if name not in indexed and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+
+    def _remove_entry(self, conn, key):
+        """刪除一個 key；其圖檔不再被任何 key 參照時一併刪除"""
+        row = conn.execute("SELECT digest FROM imagery_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM imagery_entries WHERE key = ?", (key,))
+        if conn.execute("SELECT 1 FROM imagery_entries WHERE digest = ? LIMIT 1", (row[0],)).fetchone() is None:
+            conn.execute("DELETE FROM imagery_blobs WHERE digest = ?", (row[0],))
+            with contextlib.suppress(OSError):
+                os.remove(self._blob_path(row[0]))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM imagery_blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = conn.execute("SELECT key FROM imagery_entries ORDER BY used LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._remove_entry(conn, row[0])
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM imagery_blobs").fetchone()[0]
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _map(self, key):
+        """命中時回傳 (mmap, memoryview)，否則回傳 None"""
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT digest, used FROM imagery_entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(False)
+                return None
+            digest, used = row
+            now = time.time()
+            if now - used >= self.TOUCH_INTERVAL:
+                conn.execute("UPDATE imagery_entries SET used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print("衛星圖快取索引讀取失敗：", e)
+            self._count(False)
+            return None
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                # 空檔無法對應（ValueError），與檔案遺失同樣視為未命中；關閉檔案後對應仍有效
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            with contextlib.suppress(sqlite3.Error):
+                self._transaction(self._remove_entry, key)
+            self._count(False)
+            return None
+        self._count(True)
+        return mapped, memoryview(mapped)
+
+    @contextlib.contextmanager
+    def mapped(self, key):
+        """
+        with cache.mapped(key) as view：命中時 view 為圖片內容的唯讀 memoryview（mmap），否則為 None
+        view 與其切片只在 with 區塊內有效，離開區塊時關閉對應；需要在區塊外使用內容時請用 get()
+        """
+        opened = self._map(key)
+        if opened is None:
+            yield None
+            return
+        mapped, view = opened
+        try:
+            yield view
+        finally:
+            view.release()
+            mapped.close()
+
+    def get(self, key):
+        """命中時回傳圖片內容（bytes，由 mmap 複製），否則回傳 None"""
+        with self.mapped(key) as view:
+            return None if view is None else bytes(view)
+
+    def _write_blob(self, path, content):
+        # 每個寫入者使用各自的暫存檔（mkstemp），寫完再以 os.replace 原子地換上
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def _put(self, conn, key, digest, content):
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            self._write_blob(blob_path, content)
+        conn.execute("INSERT OR IGNORE INTO imagery_blobs (digest, size) VALUES (?, ?)", (digest, len(content)))
+        previous = conn.execute("SELECT digest FROM imagery_entries WHERE key = ?", (key,)).fetchone()
+        if previous is not None and previous[0] != digest:
+            self._remove_entry(conn, key)
+        conn.execute(
+            "INSERT OR REPLACE INTO imagery_entries (key, digest, used) VALUES (?, ?, ?)", (key, digest, time.time())
+        )
+        self._evict(conn)
+
+    def put(self, key, content):
+        digest = hashlib.sha256(content).hexdigest()
+        try:
+            self._transaction(self._put, key, digest, content)
+        except (sqlite3.Error, OSError) as e:
+            print("衛星圖快取寫入失敗：", e)
+
+    def stats(self):
+        conn = self._conn()
+        entries = conn.execute("SELECT COUNT(*) FROM imagery_entries").fetchone()[0]
+        blobs, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM imagery_blobs").fetchone()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "entries": entries,
+            "blobs": blobs,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+        }
@@ -0,0 +1,128 @@
+# 衛星圖取圖規劃：依多邊形範圍自動選擇 zoom，
+# 單張 640x640 放不下時，以同一 zoom 平行下載多張圖並在記憶體中拼接
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from imagery_cache import latlng_to_world_px, world_px_to_latlng
+
+FRAME_PX = 640
+# 多圖拼接時每張圖四周裁掉的像素（底部的 Google 標誌與版權文字）
+LOGO_CROP_PX = 24
+TILE_STEP_PX = FRAME_PX - 2 * LOGO_CROP_PX
+
+
+class ImageryPlan:
+    def __init__(self, center_lat, center_lng, zoom, cols=1, rows=1):
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.zoom = zoom
+        self.cols = cols
+        self.rows = rows
+
+    @property
+    def tiled(self):
+        return self.cols * self.rows > 1
+
+    @property
+    def width(self):
+        return self.cols * TILE_STEP_PX if self.tiled else FRAME_PX
+
+    @property
+    def height(self):
+        return self.rows * TILE_STEP_PX if self.tiled else FRAME_PX
+
+    def frames(self):
+        """每張圖的 (中心 lat, 中心 lng, 在拼接圖中的左上角 x, y)"""
+        if not self.tiled:
+            return [(self.center_lat, self.center_lng, 0, 0)]
+        cx, cy = latlng_to_world_px(self.center_lat, self.center_lng, self.zoom)
+        left, top = cx - self.width / 2, cy - self.height / 2
+        frames = []
+        for row in range(self.rows):
+            for col in range(self.cols):
+                x = left + (col + 0.5) * TILE_STEP_PX
+                y = top + (row + 0.5) * TILE_STEP_PX
+                lat, lng = world_px_to_latlng(x, y, self.zoom)
+                frames.append((lat, lng, col * TILE_STEP_PX, row * TILE_STEP_PX))
+        return frames
+
+    def to_dict(self):
+        return {
+            "center": [self.center_lat, self.center_lng],
+            "zoom": self.zoom,
+            "cols": self.cols,
+            "rows": self.rows,
+            "width": self.width,
+            "height": self.height,
+        }
+
+
+def _extent_px(polygon, zoom):
+    xs, ys = [], []
+    for p in polygon:
+        x, y = latlng_to_world_px(p["lat"], p["lng"], zoom)
+        xs.append(x)
+        ys.append(y)
+    return max(xs) - min(xs), max(ys) - min(ys)
+
+
+def plan_imagery(center_lat, center_lng, polygon=None, max_zoom=20, min_detail_zoom=19,
+                 margin_px=32, max_tiles=16):
+    """
+    選擇能完整涵蓋多邊形（含 margin_px 邊界）的最高 zoom；
+    若單張圖需降到 min_detail_zoom 以下，改在 min_detail_zoom 用多張圖拼接，
+    拼接張數超過 max_tiles 時再逐級降低 zoom
+    """
+    if not polygon:
+        return ImageryPlan(center_lat, center_lng, max_zoom)
+
+    for zoom in range(max_zoom, min_detail_zoom - 1, -1):
+        w, h = _extent_px(polygon, zoom)
+        if w + 2 * margin_px <= FRAME_PX and h + 2 * margin_px <= FRAME_PX:
+            return ImageryPlan(center_lat, center_lng, zoom)
+
+    zoom = min_detail_zoom
+    while True:
+        w, h = _extent_px(polygon, zoom)
+        cols = max(1, math.ceil((w + 2 * margin_px) / TILE_STEP_PX))
+        rows = max(1, math.ceil((h + 2 * margin_px) / TILE_STEP_PX))
+        if cols * rows <= max_tiles or zoom <= 1:
+            break
+        zoom -= 1
+    if cols * rows == 1:
+        return ImageryPlan(center_lat, center_lng, zoom)
+    return ImageryPlan(center_lat, center_lng, zoom, cols, rows)
+
+
+def fetch_imagery(plan, fetch_frame, workers=8):
+    """
+    依規劃取圖；fetch_frame(lat, lng, zoom) 回傳單張圖內容（bytes-like）或 None
+    單張圖時回傳原始內容，多張時回傳拼接後的 PIL Image；任一張失敗回傳 None
+    """
+    frames = plan.frames()
+    if not plan.tiled:
+        lat, lng, _, _ = frames[0]
+        return fetch_frame(lat, lng, plan.zoom)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(frames))) as executor:
+        contents = list(executor.map(lambda f: fetch_frame(f[0], f[1], plan.zoom), frames))
+    return stitch_frames(plan, contents)
+
+
+def stitch_frames(plan, contents):
+    """contents 為 plan.frames() 各張圖的內容；單張圖時原樣回傳，任一張為 None 時回傳 None"""
+    if any(content is None for content in contents):
+        return None
+    if not plan.tiled:
+        return contents[0]
+
+    frames = plan.frames()
+    mosaic = Image.new("RGB", (plan.width, plan.height))
+    crop_box = (LOGO_CROP_PX, LOGO_CROP_PX, FRAME_PX - LOGO_CROP_PX, FRAME_PX - LOGO_CROP_PX)
+    for (_, _, x, y), content in zip(frames, contents):
+        with Image.open(io.BytesIO(content)) as frame:
+            mosaic.paste(frame.convert("RGB").crop(crop_box), (x, y))
+    return mosaic
@@ -0,0 +1,188 @@
+# 屋頂 → 推薦 → LLM 評估的合併流程，合併部署（app.create_app 同時掛載 roof 與 recommend）時提供
+# POST /api/pipeline 以 NDJSON 串流回傳各階段結果，每行一個物件：
+#   {"stage": "location", "city", "solar"}        有座標時與屋頂辨識同時進行
+#   {"stage": "roof", "area", ...}                同 /api/roof-detect
+#   {"stage": "recommend", "city", "recommendations"}
+#   {"stage": "llm_decision", "rank", "module_name", ...}   前 top_n 個模組同時評估，依完成順序回傳
+#   {"stage": "done", "elapsed_ms"}
+# 任一階段失敗（含例外、屋頂辨識未回傳有效面積）時回傳 {"stage": "error", "failed_stage", "error", "status"} 並結束
+# 屋頂辨識與 LLM 評估同樣受各自端點的准入預算限制，被拒絕時 status 為 429 並附 retry_after
+# 整個流程共用一個請求期限（PIPELINE_DEADLINE，可用 X-Request-Timeout-Ms 縮短），各階段的對外呼叫以剩餘時間為逾時
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from common.admission import Shed, client_id, shed_body
+from common.deadline import client_gone, request_deadline
+from common.metrics import metrics
+
+# 預設評估的模組數（依回本年限排序取前幾名）與同時執行的階段數上限
+PIPELINE_TOP_MODULES = int(os.environ.get("PIPELINE_TOP_MODULES", "3"))
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "16"))
+PIPELINE_DEADLINE = float(os.environ.get("PIPELINE_DEADLINE", "60"))
+DEFAULT_COVERAGE_RATE = 0.75
+
+
+def _line(stage, body):
+    return json.dumps({"stage": stage, **body}, ensure_ascii=False) + "\n"
+
+
+def _center(data):
+    """座標：優先使用 lat/lng，否則取多邊形頂點平均"""
+    if data.get("lat") is not None and data.get("lng") is not None:
+        return float(data["lat"]), float(data["lng"])
+    polygon = data["polygon"]
+    return sum(p["lat"] for p in polygon) / len(polygon), sum(p["lng"] for p in polygon) / len(polygon)
+
+
+def _roof_area(roof_result):
+    """屋頂辨識結果的面積（平方米）；缺少、不是數字、非有限值或不為正時回傳 None"""
+    area = roof_result.get("area") if isinstance(roof_result, dict) else None
+    if isinstance(area, bool):
+        return None
+    try:
+        area = float(area)
+    except (TypeError, ValueError):
+        return None
+    return area if math.isfinite(area) and area > 0 else None
+
+
+def _top_modules(recommendations, top_n):
+    ranked = sorted(recommendations, key=lambda r: (r["payback_years"], -r["annual_revenue_ntd"]))
+    return ranked[:top_n]
+
+
+def create_blueprint(roof, recommend):
+    """roof、recommend 為已載入的服務模組（run 與 dsa_backend.app）"""
+    bp = Blueprint("pipeline", __name__)
+    # 執行緒在第一次使用時才建立，多行程模式下不會在 fork 前啟動
+    executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            metrics.observe("pipeline_stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def admitted(admission, client, deadline):
+        """准入控制，拒絕時回傳 (結果 dict, 429)"""
+        try:
+            admission.admit(client, deadline.remaining())
+        except Shed as e:
+            body, _ = shed_body(e)
+            return body, 429
+        return None
+
+    def detect_roof(data, client, deadline):
+        prepared = roof.prepare_roof_detect(data)
+        if not isinstance(prepared, roof.RoofDetectRequest):
+            return prepared
+        return admitted(roof.roof_admission, client, deadline) or roof.run_roof_detect(prepared, deadline)
+
+    def llm_decision(llm_input, client, deadline):
+        if recommend.llm_decision_error(llm_input) is None and not recommend.llm_hedge.is_cached(
+            recommend.llm_decision_summary(llm_input)
+        ):
+            rejected = admitted(recommend.llm_admission, client, deadline)
+            if rejected is not None:
+                return rejected
+        return recommend.llm_decision_payload(llm_input, deadline)
+
+    def run(data, top_n, coverage_rate, client, deadline):
+        start = time.perf_counter()
+        lat, lng = _center(data)
+
+        # 屋頂辨識可能需下載影像與呼叫 Gemini，先送出，等待期間判定縣市與日照
+        roof_future = executor.submit(timed, "roof", detect_roof, data, client, deadline)
+        city = recommend.resolve_city({"lat": lat, "lng": lng, "address": data.get("address")})
+        sample = recommend.solar_raster.sample(lat, lng)
+        kwh, temperature = float(sample["kwh_per_kw_day"][0]), float(sample["temperature"][0])
+        solar = None if math.isnan(kwh) else recommend.solar_data_payload(lat, lng, kwh, temperature)
+        yield _line("location", {"city": city, "solar": solar})
+
+        try:
+            roof_result, status = roof_future.result()
+        except Exception as e:
+            roof_result, status = {"error": "屋頂辨識失敗", "detail": str(e)}, 500
+        if status == 200:
+            area = _roof_area(roof_result)
+            if area is None:
+                roof_result, status = {"error": "屋頂辨識未回傳有效面積"}, 502
+        if status != 200:
+            metrics.incr("pipeline_errors_total", stage="roof")
+            yield _line("error", {"failed_stage": "roof", "status": status, **roof_result})
+            return
+        yield _line("roof", roof_result)
+
+        recommend_input = {
+            **data,
+            "roof_area_m2": area,
+            "coverage_rate": coverage_rate,
+            "lat": lat,
+            "lng": lng,
+        }
+        recommend_input.pop("polygon", None)
+        recommend_input.pop("holes", None)
+        result, status = timed("recommend", recommend.recommend_payload, recommend_input)
+        if status != 200:
+            metrics.incr("pipeline_errors_total", stage="recommend")
+            yield _line("error", {"failed_stage": "recommend", "status": status, **result})
+            return
+        yield _line("recommend", result)
+        if deadline.cancelled:
+            # 用戶端已離開，不再送出 LLM 評估
+            metrics.incr("pipeline_errors_total", stage="cancelled")
+            return
+
+        # 各模組的 LLM 評估彼此獨立，同時送出，先完成的先回傳
+        futures = {}
+        for rank, module in enumerate(_top_modules(result["recommendations"], top_n), start=1):
+            llm_input = {**module, "address": result["city"]}
+            futures[executor.submit(timed, "llm_decision", llm_decision, llm_input, client, deadline)] = (rank, module)
+        for future in as_completed(futures):
+            rank, module = futures[future]
+            try:
+                decision, status = future.result()
+            except Exception as e:
+                decision, status = {"error": str(e)}, 500
+            body = {"rank": rank, "module_name": module["module_name"], "status": status, **decision}
+            yield _line("llm_decision", body)
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("pipeline_seconds", elapsed)
+        yield _line("done", {"elapsed_ms": round(elapsed * 1000, 1)})
+
+    @bp.route("/api/pipeline", methods=["POST"])
+    def pipeline():
+        """
+        請求：polygon（[{lat, lng}, ...]，可帶 holes）或 lat/lng，
+        選填 coverage_rate（預設 0.75）、top_n（預設 PIPELINE_TOP_MODULES）、address、engine，
+        其餘欄位（orientation、house_type 等）一併傳給推薦流程
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "請提供 JSON 內容"}), 400
+        polygon = data.get("polygon")
+        has_polygon = isinstance(polygon, list) and len(polygon) >= 3
+        if not has_polygon and (data.get("lat") is None or data.get("lng") is None):
+            return jsonify({"error": "請提供 polygon 或 lat/lng"}), 400
+        try:
+            top_n = max(0, int(data.pop("top_n", PIPELINE_TOP_MODULES)))
+            coverage_rate = float(data.pop("coverage_rate", DEFAULT_COVERAGE_RATE))
+            _center(data)
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "top_n、coverage_rate 或座標格式錯誤"}), 400
+        metrics.incr("pipeline_requests_total")
+        client = client_id(request.headers, request.remote_addr)
+        environ = request.environ
+        deadline = request_deadline(request.headers, PIPELINE_DEADLINE, lambda: client_gone(environ))
+        return Response(
+            stream_with_context(run(data, top_n, coverage_rate, client, deadline)), mimetype="application/x-ndjson"
+        )
+
+    return bp
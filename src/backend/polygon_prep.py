@@ -0,0 +1,247 @@
+# 多邊形前處理：去除重複點、處理封閉點、統一方向、偵測自相交、Douglas–Peucker 簡化
+# 面積計算與 Static Maps path= 網址都使用處理後的最少頂點集合
+# 自相交以輸入的環檢查（自相交的多邊形面積沒有明確定義，拒絕而不猜測使用者的意圖）；
+# 簡化不改變拓撲：簡化後自相交時逐步縮小容許誤差，必要時不簡化
+import math
+
+import numpy as np
+
+from roof_area import project_equal_area, ring_center, shoelace
+
+# 重複點判定距離（公尺）
+DUPLICATE_TOLERANCE_M = 0.01
+# simplify_to_fit 放寬容許誤差的次數上限
+SIMPLIFY_TO_FIT_ATTEMPTS = 40
+
+
+class PolygonError(ValueError):
+    pass
+
+
+def _orient(a, b, c):
+    """c 在有向線段 ab 的左側為 1、右側為 -1、共線為 0"""
+    v = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (v > 0) - (v < 0)
+
+
+def _segments_intersect(p1, p2, q1, q2):
+    """線段 p1p2 與 q1q2 是否相交（含端點接觸與共線重疊）"""
+    def on_segment(a, b, c):
+        return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0])
+                and min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+    d1, d2 = _orient(q1, q2, p1), _orient(q1, q2, p2)
+    d3, d4 = _orient(p1, p2, q1), _orient(p1, p2, q2)
+    if d1 != d2 and d3 != d4:
+        return True
+    return ((d1 == 0 and on_segment(q1, q2, p1)) or (d2 == 0 and on_segment(q1, q2, p2))
+            or (d3 == 0 and on_segment(p1, p2, q1)) or (d4 == 0 and on_segment(p1, p2, q2)))
+
+
+def _folds_back(prev, p, nxt):
+    """相鄰兩條邊 prev→p、p→nxt 是否共線且往回折（重疊超過共用的頂點）"""
+    if _orient(prev, p, nxt) != 0:
+        return False
+    return (prev[0] - p[0]) * (nxt[0] - p[0]) + (prev[1] - p[1]) * (nxt[1] - p[1]) > 0
+
+
+def find_self_intersection(xy):
+    """
+    Shamos–Hoey 掃描線演算法：檢查封閉環是否自相交
+    xy 為 (N, 2) 平面座標（不含重複的封閉點）
+    非相鄰的邊有任何接觸（交叉、頂點碰到另一條邊、共線重疊）或相鄰的邊共線重疊都算相交；
+    有相交時回傳相交的兩條邊索引 (i, j)，否則回傳 None
+    掃描線依頂點 (x, y) 順序前進，每個頂點一次處理以它為端點的邊；
+    點與邊的上下關係以方向判定（不計算交點 y 值），頂點落在邊上時直接判定為相交。
+    比較次數為 O(n log n)；活動邊以 list 維護，插入與刪除另需搬移 O(k) 個元素，
+    k 為任一鉛直線穿過的邊數（屋頂輪廓通常只有數條到數十條），最差情況（k 與 n 同級）為 O(n·k)
+    """
+    n = len(xy)
+    if n < 3:
+        return None
+    pts = [tuple(p) for p in xy.tolist()]
+    # 相鄰的邊往回折（尖刺）
+    for k in range(n):
+        if _folds_back(pts[k - 1], pts[k], pts[(k + 1) % n]):
+            prev = (k - 1) % n
+            return (min(prev, k), max(prev, k))
+    if n < 4:
+        return None
+    # 非相鄰的重複頂點（多邊形在某點自我接觸）：以這兩個頂點為起點的邊相交
+    seen = {}
+    for i, p in enumerate(pts):
+        if p in seen:
+            return (seen[p], i)
+        seen[p] = i
+    # 每條邊 i 連接頂點 i 與 i+1，端點依 (x, y) 排序為左、右
+    segs = []
+    for i in range(n):
+        a, b = pts[i], pts[(i + 1) % n]
+        segs.append((a, b) if a <= b else (b, a))
+
+    def adjacent(i, j):
+        return abs(i - j) == 1 or abs(i - j) == n - 1
+
+    def check(i, j):
+        return not adjacent(i, j) and _segments_intersect(segs[i][0], segs[i][1], segs[j][0], segs[j][1])
+
+    def side(j, p):
+        """活動邊 j 在點 p 的下方 -1、經過 p 為 0、上方 1"""
+        a, b = segs[j]
+        if a[0] == b[0]:
+            # 垂直邊：掃描到 p 時仍在活動中，代表 b 不低於 p
+            return 0 if a[1] <= p[1] <= b[1] else (-1 if b[1] < p[1] else 1)
+        return -_orient(a, b, p)
+
+    active = []  # 依掃描線位置由下而上排序
+    for k in sorted(range(n), key=pts.__getitem__):
+        p = pts[k]
+        incident = ((k - 1) % n, k)
+        # 活動邊中經過 p 的為連續的一段 [lo, hi)
+        lo, hi = 0, len(active)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if side(active[mid], p) < 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        hi = lo
+        while hi < len(active) and side(active[hi], p) == 0:
+            hi += 1
+        # 經過 p 的邊只能是以 p 為右端點的兩條鄰邊，其他邊代表頂點 p 碰到了該邊
+        for j in active[lo:hi]:
+            if j not in incident:
+                other = incident[0] if not adjacent(j, incident[0]) else incident[1]
+                return (min(j, other), max(j, other))
+        del active[lo:hi]
+        # 以 p 為左端點的邊依方向由下而上插入
+        starting = [i for i in incident if segs[i][0] == p]
+        if len(starting) == 2 and _orient(p, segs[starting[0]][1], segs[starting[1]][1]) < 0:
+            starting.reverse()
+        active[lo:lo] = starting
+        below, above = lo - 1, lo + len(starting)
+        if starting:
+            pairs = ((below, lo), (above - 1, above))
+        else:
+            pairs = ((below, lo),)
+        for i, j in pairs:
+            if 0 <= i and j < len(active) and check(active[i], active[j]):
+                return (min(active[i], active[j]), max(active[i], active[j]))
+    return None
+
+
+def _douglas_peucker(xy, tolerance):
+    """開放折線的 Douglas–Peucker 簡化，回傳保留的索引遮罩"""
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(xy) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        seg = b - a
+        pts = xy[start + 1:end] - a
+        seg_len = np.hypot(seg[0], seg[1])
+        if seg_len == 0:
+            dist = np.hypot(pts[:, 0], pts[:, 1])
+        else:
+            dist = np.abs(seg[0] * pts[:, 1] - seg[1] * pts[:, 0]) / seg_len
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = start + 1 + k
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return keep
+
+
+def simplify_ring(xy, tolerance):
+    """封閉環的 Douglas–Peucker 簡化：以頂點 0 與離它最遠的頂點切成兩段折線"""
+    n = len(xy)
+    if n <= 3 or tolerance <= 0:
+        return np.arange(n)
+    far = int(np.argmax(np.hypot(*(xy - xy[0]).T)))
+    if far == 0:
+        return np.arange(n)
+    closed = np.vstack([xy, xy[:1]])
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[:far + 1] |= _douglas_peucker(closed[:far + 1], tolerance)
+    keep[far:] |= _douglas_peucker(closed[far:], tolerance)
+    indices = np.flatnonzero(keep[:n])
+    if len(indices) < 3:
+        return np.arange(n)
+    return indices
+
+
+def _simplify_valid(xy, tolerance):
+    """簡化後仍不自相交的頂點索引；容許誤差逐次減半，小於重複點判定距離時不簡化"""
+    while tolerance >= DUPLICATE_TOLERANCE_M:
+        indices = simplify_ring(xy, tolerance)
+        if len(indices) == len(xy) or find_self_intersection(xy[indices]) is None:
+            return indices
+        tolerance /= 2
+    return np.arange(len(xy))
+
+
+def prepare_polygon(polygon, tolerance_m=0.0):
+    """
+    前處理 [{lat, lng}, ...] 多邊形，回傳 (處理後的多邊形, 統計資訊)
+    處理後為逆時針、不重複封閉點的頂點列表；格式錯誤、容許誤差不是非負數或自相交時拋出 PolygonError
+    """
+    if not (isinstance(tolerance_m, (int, float)) and math.isfinite(tolerance_m) and tolerance_m >= 0):
+        raise PolygonError("簡化容許誤差需為非負數")
+    if not isinstance(polygon, list):
+        raise PolygonError("多邊形座標格式錯誤")
+    try:
+        coords = np.array([(float(p["lat"]), float(p["lng"])) for p in polygon], dtype=float).reshape(-1, 2)
+    except (KeyError, TypeError, ValueError):
+        raise PolygonError("多邊形座標格式錯誤")
+    if not np.all(np.isfinite(coords)):
+        raise PolygonError("多邊形座標格式錯誤")
+    original = len(coords)
+
+    center = ring_center(coords[:, 0], coords[:, 1]) if original else (0.0, 0.0)
+    x, y = project_equal_area(coords[:, 0], coords[:, 1], center[0], center[1])
+    xy = np.column_stack([x, y])
+
+    # 去除連續重複點（含頭尾相同的封閉點）
+    if len(xy) > 1:
+        step = np.hypot(*(xy - np.roll(xy, 1, axis=0)).T)
+        keep = step > DUPLICATE_TOLERANCE_M
+        if not keep.any():
+            keep[0] = True
+        coords, xy = coords[keep], xy[keep]
+    if len(xy) < 3:
+        raise PolygonError("多邊形至少需要 3 個不重複的頂點")
+
+    hit = find_self_intersection(xy)
+    if hit is not None:
+        raise PolygonError(f"多邊形自相交（第 {hit[0]} 與第 {hit[1]} 條邊）")
+
+    indices = _simplify_valid(xy, tolerance_m)
+    coords, xy = coords[indices], xy[indices]
+
+    # 統一為逆時針
+    if shoelace(xy[:, 0], xy[:, 1]) < 0:
+        coords, xy = coords[::-1], xy[::-1]
+
+    cleaned = [{"lat": float(lat), "lng": float(lng)} for lat, lng in coords]
+    return cleaned, {"original_vertices": original, "vertices": len(cleaned)}
+
+
+def simplify_to_fit(polygon, max_vertices, tolerance_m=0.1):
+    """
+    逐步放寬簡化容許誤差，直到頂點數不超過 max_vertices（供 Static Maps 網址使用）
+    無法在不自相交的前提下簡化到上限時，回傳過程中頂點最少的結果
+    """
+    cleaned, _ = prepare_polygon(polygon, tolerance_m)
+    best = cleaned
+    for _ in range(SIMPLIFY_TO_FIT_ATTEMPTS):
+        if len(best) <= max_vertices:
+            break
+        tolerance_m *= 2
+        cleaned, _ = prepare_polygon(cleaned, tolerance_m)
+        if len(cleaned) < len(best):
+            best = cleaned
+    return best
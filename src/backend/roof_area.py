@@ -0,0 +1,136 @@
+# 屋頂多邊形面積引擎
+# 以 WGS84 橢球的「等積（authalic）緯度」將經緯度投影到以多邊形中心為原點的
+# Lambert 等積方位投影平面，再以鞋帶公式（shoelace）計算有號面積。
+# 投影本身為等積投影，因此平面面積即為橢球面積，可正確處理凹多邊形與內部孔洞。
+import numpy as np
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+WGS84_E = np.sqrt(WGS84_E2)
+
+
+def _authalic_q(sin_phi):
+    e_sin = WGS84_E * sin_phi
+    return (1 - WGS84_E2) * (
+        sin_phi / (1 - e_sin * e_sin)
+        - np.log((1 - e_sin) / (1 + e_sin)) / (2 * WGS84_E)
+    )
+
+
+_QP = float(_authalic_q(1.0))
+# 與 WGS84 橢球表面積相同的等積球半徑
+AUTHALIC_RADIUS = WGS84_A * np.sqrt(_QP / 2)
+
+
+def authalic_latitude(lat_deg):
+    """大地緯度（度）轉等積緯度（弧度）"""
+    return np.arcsin(_sin_authalic(lat_deg))
+
+
+def _sin_authalic(lat_deg):
+    sin_phi = np.sin(np.radians(lat_deg))
+    return np.clip(_authalic_q(sin_phi) / _QP, -1.0, 1.0)
+
+
+def project_equal_area(lats, lngs, lat0, lng0):
+    """
+    將經緯度陣列投影到以 (lat0, lng0) 為中心的 Lambert 等積方位平面
+    lat0、lng0 可為純量，或與 lats 等長的陣列（每個頂點各自的投影中心）
+    回傳 (x, y)，單位公尺
+    """
+    sin_b = _sin_authalic(np.asarray(lats, dtype=float))
+    cos_b = np.sqrt(1 - sin_b * sin_b)
+    sin_b0 = _sin_authalic(lat0)
+    cos_b0 = np.sqrt(1 - sin_b0 * sin_b0)
+    dlng = np.radians(np.asarray(lngs, dtype=float) - lng0)
+    # 經度差正規化到 [-pi, pi)，避免跨越換日線時出錯
+    dlng = (dlng + np.pi) % (2 * np.pi) - np.pi
+
+    cos_dlng = np.cos(dlng)
+    k = AUTHALIC_RADIUS * np.sqrt(2 / (1 + sin_b0 * sin_b + cos_b0 * cos_b * cos_dlng))
+    x = k * cos_b * np.sin(dlng)
+    y = k * (cos_b0 * sin_b - sin_b0 * cos_b * cos_dlng)
+    return x, y
+
+
+def shoelace(x, y):
+    """平面多邊形有號面積，逆時針為正"""
+    # 先平移到重心附近，降低大數相減造成的浮點誤差
+    x = x - x.mean()
+    y = y - y.mean()
+    cross = np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])
+    return 0.5 * float(cross + x[-1] * y[0] - x[0] * y[-1])
+
+
+def ring_center(lats, lngs):
+    """投影中心：取頂點外接矩形中心"""
+    return (
+        (float(np.min(lats)) + float(np.max(lats))) / 2,
+        (float(np.min(lngs)) + float(np.max(lngs))) / 2,
+    )
+
+
+def signed_ring_area(lats, lngs, center=None):
+    """
+    單一環（ring）的有號面積（平方米），逆時針為正
+    頭尾重複的封閉點不影響結果
+    """
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    if len(lats) < 3:
+        return 0.0
+    if center is None:
+        center = ring_center(lats, lngs)
+    x, y = project_equal_area(lats, lngs, center[0], center[1])
+    return shoelace(x, y)
+
+
+def polygon_area(exterior, holes=()):
+    """
+    多邊形面積（平方米）：外環面積減去各孔洞面積
+    exterior 與 holes 皆為 (N, 2) 的 [lat, lng] 陣列，環的方向不拘
+    """
+    exterior = np.asarray(exterior, dtype=float).reshape(-1, 2)
+    if len(exterior) < 3:
+        return 0.0
+    # 外環與孔洞共用同一投影中心
+    center = ring_center(exterior[:, 0], exterior[:, 1])
+    area = abs(signed_ring_area(exterior[:, 0], exterior[:, 1], center))
+    for hole in holes:
+        hole = np.asarray(hole, dtype=float).reshape(-1, 2)
+        area -= abs(signed_ring_area(hole[:, 0], hole[:, 1], center))
+    return max(area, 0.0)
+
+
+def signed_ring_areas_batch(coords, ring_starts):
+    """
+    一次計算多個環的有號面積（平方米），逆時針為正
+    coords 為所有環頂點串接成的 (N, 2) [lat, lng] 陣列，
+    ring_starts 為每個環在 coords 中的起始索引（遞增），每個環至少 3 點
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    starts = np.asarray(ring_starts, dtype=np.intp)
+    if len(starts) == 0:
+        return np.zeros(0)
+    lats, lngs = coords[:, 0], coords[:, 1]
+    counts = np.diff(np.append(starts, len(coords)))
+    ring_of_vertex = np.repeat(np.arange(len(starts)), counts)
+
+    # 每個環以自己的外接矩形中心為投影中心
+    lat0 = (np.minimum.reduceat(lats, starts) + np.maximum.reduceat(lats, starts)) / 2
+    lng0 = (np.minimum.reduceat(lngs, starts) + np.maximum.reduceat(lngs, starts)) / 2
+    x, y = project_equal_area(lats, lngs, lat0[ring_of_vertex], lng0[ring_of_vertex])
+    x = x - (np.add.reduceat(x, starts) / counts)[ring_of_vertex]
+    y = y - (np.add.reduceat(y, starts) / counts)[ring_of_vertex]
+
+    # 下一個頂點的索引；每個環的最後一點接回該環起點
+    nxt = np.arange(1, len(coords) + 1)
+    nxt[starts + counts - 1] = starts
+    cross = x * y[nxt] - x[nxt] * y
+    return 0.5 * np.add.reduceat(cross, starts)
+
+
+def latlng_dicts_to_array(points):
+    """[{lat, lng}, ...] 轉為 (N, 2) 陣列"""
+    return np.array([(p["lat"], p["lng"]) for p in points], dtype=float).reshape(-1, 2)
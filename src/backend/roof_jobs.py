@@ -0,0 +1,283 @@
+# 屋頂辨識背景工作佇列
+# 有上限的優先佇列 + 固定數量的工作執行緒；相同請求共用同一個工作，
+# 佇列滿時拒絕新工作（backpressure），完成的工作保留一段時間供查詢
+# 多個 worker 行程時，工作狀態另寫入共用的 SQLite（JobStore），任一行程都能查詢
+import hashlib
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, key, data, priority):
+        self.id = job_id
+        self.key = key
+        self.data = data
+        self.priority = priority
+        self.status = "queued"
+        self.result = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+        # 由其他 worker 行程執行、從 JobStore 讀回的工作為 False
+        self.local = True
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.done.is_set():
+            info["result"] = self.result
+            info["status_code"] = self.status_code
+        return info
+
+
+class JobStore:
+    """跨行程共用的工作狀態（SQLite），只存查詢需要的欄位，不存請求內容"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS roof_jobs ("
+            " id TEXT PRIMARY KEY, priority INTEGER NOT NULL, status TEXT NOT NULL, result TEXT,"
+            " status_code INTEGER, created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        conn.commit()
+        conn.close()
+
+    def _conn(self):
+        # sqlite 連線不可跨執行緒或跨 fork 共用，每個執行緒（行程）各自開啟
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def save(self, job):
+        conn = self._conn()
+        result = json.dumps(job.result, ensure_ascii=False) if job.done.is_set() else None
+        conn.execute(
+            "INSERT OR REPLACE INTO roof_jobs"
+            " (id, priority, status, result, status_code, created_at, started_at, finished_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.priority, job.status, result, job.status_code,
+             job.created_at, job.started_at, job.finished_at),
+        )
+        conn.commit()
+
+    def load(self, job_id):
+        row = self._conn().execute(
+            "SELECT priority, status, result, status_code, created_at, started_at, finished_at"
+            " FROM roof_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        priority, status, result, status_code, created_at, started_at, finished_at = row
+        job = Job(job_id, None, None, priority)
+        job.local = False
+        job.status = status
+        job.created_at, job.started_at, job.finished_at = created_at, started_at, finished_at
+        if finished_at is not None:
+            job.result = json.loads(result) if result is not None else None
+            job.status_code = status_code
+            job.done.set()
+        return job
+
+    def purge(self, older_than):
+        conn = self._conn()
+        conn.execute("DELETE FROM roof_jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (older_than,))
+        conn.commit()
+
+
+def request_fingerprint(data):
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RoofJobQueue:
+    def __init__(self, handler, workers=4, max_queue=100, job_ttl=600, metrics=None, store=None):
+        """
+        handler(data) -> (結果 dict, HTTP 狀態碼)
+        store 為選用的 JobStore，多個 worker 行程時讓工作可在任一行程查詢
+        """
+        self.handler = handler
+        self.job_ttl = job_ttl
+        self.metrics = metrics
+        self.store = store
+        self._accepting = True
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._order = itertools.count()
+        self._jobs = {}      # job id -> Job
+        self._by_key = {}    # 請求指紋 -> 尚未過期的 Job
+        self._lock = threading.Lock()
+        self._running = 0
+        self.workers = workers
+        self._workers = []
+
+    def _ensure_workers(self):
+        # 第一次送出工作時才啟動執行緒，避免在 fork 前的父行程中建立
+        if not self._workers:
+            self._workers = [
+                threading.Thread(target=self._worker, name=f"roof-job-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for worker in self._workers:
+                worker.start()
+
+    def submit(self, data, priority=5):
+        """
+        送出工作，回傳 (Job, 是否為新工作)
+        相同請求若已有排隊中、執行中或尚未過期的結果，直接回傳該工作
+        priority 數字越小越優先
+        """
+        key = request_fingerprint(data)
+        with self._lock:
+            if not self._accepting:
+                raise QueueFull("服務重新啟動中，請稍後再試")
+            self._ensure_workers()
+            self._purge_expired()
+            existing = self._by_key.get(key)
+            if existing is not None and existing.status != "failed":
+                return existing, False
+            job = Job(uuid.uuid4().hex, key, data, priority)
+            try:
+                self._queue.put_nowait((priority, next(self._order), job))
+            except queue.Full:
+                self._incr("roof_jobs_rejected_total")
+                raise QueueFull("工作佇列已滿，請稍後再試")
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+        self._save(job)
+        self._incr("roof_jobs_submitted_total")
+        self._update_gauges()
+        return job, True
+
+    def get(self, job_id):
+        """本行程的工作優先，找不到時再查 JobStore（其他 worker 行程送出的工作）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def wait(self, job, timeout, poll_interval=0.5):
+        """等待工作完成，回傳是否已完成；其他行程的工作以輪詢 JobStore 更新狀態"""
+        if job.local or self.store is None:
+            return job.done.wait(timeout)
+        deadline = time.monotonic() + timeout
+        while True:
+            latest = self.store.load(job.id)
+            if latest is not None:
+                job.status, job.started_at = latest.status, latest.started_at
+                if latest.done.is_set():
+                    job.result, job.status_code, job.finished_at = latest.result, latest.status_code, latest.finished_at
+                    job.done.set()
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll_interval, remaining))
+
+    def shutdown(self, timeout=30):
+        """停止接受新工作，等待已排隊與執行中的工作完成（worker 行程結束前呼叫）"""
+        with self._lock:
+            self._accepting = False
+            pending = [job for job in self._jobs.values() if not job.done.is_set()]
+        deadline = time.monotonic() + timeout
+        for job in pending:
+            if not job.done.wait(max(0.0, deadline - time.monotonic())):
+                break
+        return sum(1 for job in pending if not job.done.is_set())
+
+    def _save(self, job):
+        if self.store is None:
+            return
+        try:
+            self.store.save(job)
+        except sqlite3.Error as e:
+            print("工作狀態寫入失敗：", e)
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                self._running += 1
+            job.status = "running"
+            job.started_at = time.time()
+            self._save(job)
+            self._update_gauges()
+            try:
+                result, status_code = self.handler(job.data)
+                job.status = "done" if status_code < 400 else "failed"
+            except Exception as e:
+                print("屋頂辨識工作失敗：", e)
+                result, status_code = {"error": "屋頂辨識工作失敗", "detail": str(e)}, 500
+                job.status = "failed"
+            job.result = result
+            job.status_code = status_code
+            job.finished_at = time.time()
+            job.done.set()
+            self._save(job)
+            with self._lock:
+                self._running -= 1
+            self._incr(f"roof_jobs_{job.status}_total")
+            self._update_gauges()
+            self._queue.task_done()
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job for job in self._jobs.values()
+            if job.finished_at is not None and now - job.finished_at > self.job_ttl
+        ]
+        for job in expired:
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+        if expired and self.store is not None:
+            try:
+                self.store.purge(now - self.job_ttl)
+            except sqlite3.Error as e:
+                print("工作狀態清理失敗：", e)
+
+    def _incr(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def _update_gauges(self):
+        if self.metrics is not None:
+            stats = self.stats()
+            self.metrics.gauge_set("roof_jobs_queue_depth", stats["queued"])
+            self.metrics.gauge_set("roof_jobs_running", stats["running"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "running": self._running,
+                "max_queue": self._queue.maxsize,
+                "workers": self.workers,
+                "tracked_jobs": len(self._jobs),
+            }
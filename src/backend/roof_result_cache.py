@@ -0,0 +1,157 @@
+# 屋頂辨識結果快取（SQLite）
+# key = 中心點 geohash + 量化後的多邊形指紋（形狀與位置）+ prompt/模型版本，
+# 重畫或微調過的相同屋頂會落在同一個 key，相鄰的同形屋頂（如連棟透天厝）則各自一個 key；
+# 可依經緯度範圍查詢以預熱整個社區
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from polygon_prep import simplify_ring
+from roof_area import project_equal_area
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# 每度緯度的公尺數（近似值，只用於將位置量化到格點）
+METERS_PER_DEGREE = 111320.0
+
+
+def geohash_encode(lat, lng, precision=8):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def polygon_fingerprint(polygon, grid_m=1.0):
+    """
+    多邊形的量化指紋：以質心為原點投影到公尺座標，簡化後對齊 grid_m 格點，
+    並從最小的頂點開始排列，與起點選擇與微小抖動無關；
+    簡化後頂點的質心也對齊 grid_m 格點一併納入，平移過的同形多邊形會得到不同指紋
+    polygon 需為已前處理（逆時針、無重複點）的 [{lat, lng}, ...]
+    回傳 (質心 lat, 質心 lng, 指紋字串)
+    """
+    coords = np.array([(p["lat"], p["lng"]) for p in polygon], dtype=float)
+    lat0, lng0 = float(coords[:, 0].mean()), float(coords[:, 1].mean())
+    x, y = project_equal_area(coords[:, 0], coords[:, 1], lat0, lng0)
+    xy = np.column_stack([x, y])
+    xy = xy[simplify_ring(xy, grid_m / 2)]
+    quantized = [tuple(p) for p in np.round(xy / grid_m).astype(int).tolist()]
+    # 去除量化後相鄰重複的點
+    ring = [p for i, p in enumerate(quantized) if p != quantized[i - 1]] or quantized[:1]
+    start = ring.index(min(ring))
+    ring = ring[start:] + ring[:start]
+    digest = hashlib.sha1(
+        json.dumps({"position": position_cell(lat0, lng0, xy.mean(axis=0), grid_m), "ring": ring}).encode("utf-8")
+    ).hexdigest()[:16]
+    return lat0, lng0, digest
+
+
+def position_cell(lat0, lng0, offset, grid_m=1.0):
+    """
+    (lat0, lng0) 加上公尺偏移 offset = (x, y) 後的位置，量化到 grid_m 公尺的全域格點
+    東西向以 lat0 的緯度圈長度換算，回傳 [格點 x, 格點 y]
+    """
+    y = lat0 * METERS_PER_DEGREE + float(offset[1])
+    x = lng0 * METERS_PER_DEGREE * np.cos(np.radians(lat0)) + float(offset[0])
+    return [int(round(x / grid_m)), int(round(y / grid_m))]
+
+
+class RoofResultCache:
+    def __init__(self, path, geohash_precision=8, fingerprint_grid_m=1.0):
+        self.path = path
+        self.geohash_precision = geohash_precision
+        self.fingerprint_grid_m = fingerprint_grid_m
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS roof_results ("
+            " key TEXT PRIMARY KEY, geohash TEXT NOT NULL, lat REAL NOT NULL, lng REAL NOT NULL,"
+            " version TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS roof_results_latlng ON roof_results (lat, lng)")
+        conn.execute("CREATE INDEX IF NOT EXISTS roof_results_geohash ON roof_results (geohash)")
+        conn.commit()
+        conn.close()
+
+    def _conn(self):
+        # sqlite 連線不可跨執行緒或跨 fork 共用，每個執行緒（行程）各自開啟
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def make_key(self, version, polygon=None, lat=None, lng=None):
+        """回傳 (key, geohash, lat, lng)"""
+        if polygon:
+            lat, lng, fingerprint = polygon_fingerprint(polygon, self.fingerprint_grid_m)
+            geohash = geohash_encode(lat, lng, self.geohash_precision)
+        else:
+            lat, lng = float(lat), float(lng)
+            # 沒有多邊形時以更細的 geohash 代表該點
+            geohash = geohash_encode(lat, lng, self.geohash_precision + 1)
+            fingerprint = "point"
+        return f"{geohash}:{fingerprint}:{version}", geohash, lat, lng
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT result FROM roof_results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE roof_results SET hits = hits + 1 WHERE key = ?", (key,))
+        conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, geohash, lat, lng, version, result):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO roof_results (key, geohash, lat, lng, version, result, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, geohash, lat, lng, version, json.dumps(result, ensure_ascii=False), time.time()),
+        )
+        conn.commit()
+
+    def query_bbox(self, south, west, north, east, version=None, limit=1000):
+        sql = (
+            "SELECT key, geohash, lat, lng, version, result, created_at, hits FROM roof_results"
+            " WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?"
+        )
+        args = [south, north, west, east]
+        if version is not None:
+            sql += " AND version = ?"
+            args.append(version)
+        sql += " LIMIT ?"
+        args.append(limit)
+        rows = self._conn().execute(sql, args).fetchall()
+        return [
+            {
+                "key": key, "geohash": geohash, "lat": lat, "lng": lng, "version": ver,
+                "result": json.loads(result), "created_at": created_at, "hits": hits,
+            }
+            for key, geohash, lat, lng, ver, result, created_at, hits in rows
+        ]
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM roof_results").fetchone()[0]
+        return {"entries": count, "path": self.path}
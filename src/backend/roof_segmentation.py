@@ -0,0 +1,230 @@
+# 離線屋頂分割（傳統影像處理，只用 NumPy/Pillow）
+# 從衛星圖中心點附近的屋頂顏色出發：邊緣偵測 + 顏色門檻 → 連通區域 → 補洞平滑 →
+# 輪廓追蹤 → Douglas-Peucker 簡化，數十毫秒內提出屋頂輪廓與面積，
+# 作為 Gemini Vision 的快速路徑或故障備援
+import contextlib
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from imagery_cache import latlng_to_world_px, world_px_to_latlng
+from polygon_prep import simplify_ring
+from roof_area import latlng_dicts_to_array, polygon_area
+
+# 演算法參數有變動時遞增，結果快取以此區分版本
+SEGMENTER_VERSION = "local-cv-1"
+# Web Mercator 赤道上 zoom 0 每像素的公尺數
+EQUATOR_M_PER_PX = 156543.03392804097
+# Moore 鄰域（順時針，影像座標 y 向下）
+_NEIGHBORS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+class SegmentationError(ValueError):
+    pass
+
+
+def meters_per_pixel(lat, zoom, scale=1):
+    return EQUATOR_M_PER_PX * math.cos(math.radians(lat)) / (2 ** zoom) / scale
+
+
+def _dilate(mask):
+    out = mask.copy()
+    out[1:] |= mask[:-1]
+    out[:-1] |= mask[1:]
+    out[:, 1:] |= mask[:, :-1]
+    out[:, :-1] |= mask[:, 1:]
+    return out
+
+
+def _erode(mask):
+    return ~_dilate(~mask)
+
+
+def _open(mask, iterations=1):
+    for _ in range(iterations):
+        mask = _erode(mask)
+    for _ in range(iterations):
+        mask = _dilate(mask)
+    return mask
+
+
+def _close(mask, iterations=1):
+    for _ in range(iterations):
+        mask = _dilate(mask)
+    for _ in range(iterations):
+        mask = _erode(mask)
+    return mask
+
+
+def _flood(allowed, seeds):
+    """從 seeds 在 allowed 範圍內以 4 連通反覆膨脹，回傳可到達的區域"""
+    region = seeds & allowed
+    while True:
+        grown = _dilate(region) & allowed
+        if np.array_equal(grown, region):
+            return region
+        region = grown
+
+
+def _fill_holes(region):
+    """補上區域內部的孔洞（從影像邊界無法到達的非區域像素）"""
+    outside = ~region
+    border = np.zeros_like(region)
+    border[0, :] = border[-1, :] = border[:, 0] = border[:, -1] = True
+    reachable = _flood(outside, border)
+    return region | (outside & ~reachable)
+
+
+def _box_blur(gray):
+    padded = np.pad(gray, 1, mode="edge")
+    h, w = gray.shape
+    total = np.zeros_like(gray)
+    for dy in range(3):
+        for dx in range(3):
+            total += padded[dy:dy + h, dx:dx + w]
+    return total / 9.0
+
+
+def _thin_edges(gray, threshold_percentile, min_magnitude):
+    """Sobel 梯度 + 沿主要梯度方向的非極大值抑制，回傳一像素寬的邊緣"""
+    p = np.pad(gray, 1, mode="edge")
+    gx = (p[:-2, 2:] + 2 * p[1:-1, 2:] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[1:-1, :-2] + p[2:, :-2])
+    gy = (p[2:, :-2] + 2 * p[2:, 1:-1] + p[2:, 2:]) - (p[:-2, :-2] + 2 * p[:-2, 1:-1] + p[:-2, 2:])
+    magnitude = np.hypot(gx, gy)
+    m = np.pad(magnitude, 1)
+    peak_x = (magnitude >= m[1:-1, :-2]) & (magnitude >= m[1:-1, 2:])
+    peak_y = (magnitude >= m[:-2, 1:-1]) & (magnitude >= m[2:, 1:-1])
+    peak = np.where(np.abs(gx) >= np.abs(gy), peak_x, peak_y)
+    threshold = max(np.percentile(magnitude, threshold_percentile), min_magnitude)
+    return peak & (magnitude > threshold)
+
+
+def trace_boundary(region):
+    """
+    Moore 鄰域輪廓追蹤，回傳區域外圈像素的 (x, y) 陣列（依追蹤順序）
+    region 需為單一連通區域
+    """
+    padded = np.pad(region, 1)
+    ys, xs = np.nonzero(padded)
+    if len(ys) == 0:
+        return np.empty((0, 2))
+    # 最上方、最左邊的像素作為起點，回溯方向為其左側（必為背景）
+    first = np.lexsort((xs, ys))[0]
+    start = (int(ys[first]), int(xs[first]))
+    contour = [start]
+    current, backtrack_dir = start, 6
+    max_steps = 4 * padded.size
+    for _ in range(max_steps):
+        for k in range(8):
+            d = (backtrack_dir + 1 + k) % 8
+            ny, nx = current[0] + _NEIGHBORS[d][0], current[1] + _NEIGHBORS[d][1]
+            if padded[ny, nx]:
+                # 下一個回溯方向：從新像素看回前一個檢查過的背景像素
+                backtrack_dir = (d + 4) % 8
+                current = (ny, nx)
+                break
+        else:
+            break  # 孤立單一像素
+        if current == start:
+            break
+        contour.append(current)
+    pts = np.array(contour, dtype=float)
+    # 去掉 padding 的位移，回傳 (x, y)
+    return np.column_stack([pts[:, 1] - 1, pts[:, 0] - 1])
+
+
+def segment_roof(content, center_lat, center_lng, zoom, target_lat=None, target_lng=None,
+                 scale=1, work_px=256, color_tolerance=None, edge_percentile=85.0,
+                 simplify_px=1.0, min_area_m2=8.0, max_fill_ratio=0.6):
+    """
+    以 target（預設為圖片中心）所在的屋頂為目標進行分割
+    content 可為圖片 bytes 或 PIL Image；center/zoom 為整張圖中心點與 zoom
+    回傳 {"area", "polygon", "pixels", "touches_border", "m_per_px"}，
+    area 為簡化後輪廓的等面積投影面積；找不到合理屋頂時拋出 SegmentationError
+    """
+    if isinstance(content, Image.Image):
+        opened = contextlib.nullcontext(content)
+    else:
+        opened = Image.open(io.BytesIO(content))
+    with opened as image:
+        orig_w, orig_h = image.size
+        work = image.convert("RGB")
+        if max(work.size) > work_px:
+            work = work.resize(
+                (max(1, round(orig_w * work_px / max(work.size))), max(1, round(orig_h * work_px / max(work.size)))),
+                Image.BILINEAR,
+            )
+        rgb = np.asarray(work, dtype=np.float32)
+    h, w = rgb.shape[:2]
+    factor = w / orig_w
+
+    # 目標點在工作影像中的位置
+    cx, cy = latlng_to_world_px(center_lat, center_lng, zoom)
+    if target_lat is None:
+        sx, sy = w // 2, h // 2
+    else:
+        tx, ty = latlng_to_world_px(target_lat, target_lng, zoom)
+        sx = int(((tx - cx) * scale + orig_w / 2) * factor)
+        sy = int(((ty - cy) * scale + orig_h / 2) * factor)
+    if not (0 <= sx < w and 0 <= sy < h):
+        raise SegmentationError("目標點不在圖片範圍內")
+
+    gray = _box_blur(rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32))
+    edges = _thin_edges(gray, edge_percentile, 24.0)
+
+    # 屋頂顏色取目標點附近 5x5 的中位數，容許差距依附近顏色的變異自動調整
+    window = rgb[max(sy - 2, 0):sy + 3, max(sx - 2, 0):sx + 3].reshape(-1, 3)
+    seed_color = np.median(window, axis=0)
+    if color_tolerance is None:
+        color_tolerance = float(np.clip(3.0 * window.std(axis=0).mean() + 18.0, 18.0, 60.0))
+    distance = np.sqrt(((rgb - seed_color) ** 2).sum(axis=2))
+    # 閉運算橋接屋脊、排水溝等細線，開運算去除雜訊造成的細小連結
+    candidate = _open(_close((distance < color_tolerance) & ~edges, 2))
+
+    # 目標點剛好落在邊緣或雜訊上時，改用附近最近的候選像素
+    if not candidate[sy, sx]:
+        radius = max(3, w // 40)
+        ys, xs = np.nonzero(candidate[max(sy - radius, 0):sy + radius + 1, max(sx - radius, 0):sx + radius + 1])
+        if len(ys) == 0:
+            raise SegmentationError("目標點附近找不到屋頂區域")
+        nearest = np.argmin((ys + max(sy - radius, 0) - sy) ** 2 + (xs + max(sx - radius, 0) - sx) ** 2)
+        sy, sx = int(ys[nearest] + max(sy - radius, 0)), int(xs[nearest] + max(sx - radius, 0))
+
+    seeds = np.zeros_like(candidate)
+    seeds[sy, sx] = True
+    # 補洞後膨脹一次，把被當成邊緣排除的輪廓像素併回
+    region = _dilate(_fill_holes(_flood(candidate, seeds)))
+
+    pixels = int(region.sum())
+    if pixels > max_fill_ratio * w * h:
+        raise SegmentationError("分割區域過大，可能溢出到道路或空地")
+
+    m_per_px = meters_per_pixel(center_lat, zoom, scale) / factor
+    if pixels * m_per_px ** 2 < min_area_m2:
+        raise SegmentationError("分割出的屋頂面積過小")
+
+    contour = trace_boundary(region)
+    if len(contour) >= 3:
+        contour = contour[simplify_ring(contour, simplify_px)]
+    if len(contour) < 3:
+        raise SegmentationError("無法擷取屋頂輪廓")
+
+    # 工作影像像素 → 原圖像素 → 經緯度（取像素中心）
+    polygon = []
+    for x, y in contour.tolist():
+        wx = cx + ((x + 0.5) / factor - orig_w / 2) / scale
+        wy = cy + ((y + 0.5) / factor - orig_h / 2) / scale
+        lat, lng = world_px_to_latlng(wx, wy, zoom)
+        polygon.append({"lat": lat, "lng": lng})
+
+    area = polygon_area(latlng_dicts_to_array(polygon))
+    touches_border = bool(region[0, :].any() or region[-1, :].any() or region[:, 0].any() or region[:, -1].any())
+    return {
+        "area": round(area, 2),
+        "polygon": polygon,
+        "pixels": pixels,
+        "touches_border": touches_border,
+        "m_per_px": m_per_px,
+    }
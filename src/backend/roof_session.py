@@ -0,0 +1,126 @@
+# 屋頂輪廓編輯工作階段：維護多邊形頂點，並以鞋帶公式的邊貢獻增量更新面積
+# 每次插入、移動、刪除頂點只需重算受影響的兩條邊，與頂點數無關
+from roof_area import project_equal_area, ring_center
+
+# 每隔多少次編輯全量重算一次，消除浮點累積誤差
+RESYNC_EVERY = 10000
+
+
+def _cross(p, q):
+    return p[0] * q[1] - q[0] * p[1]
+
+
+class RoofOutlineSession:
+    def __init__(self, polygon=None):
+        self.center = None
+        self.points = []     # [{lat, lng}, ...]
+        self.projected = []  # 對應的 (x, y)，單位公尺
+        self.twice_area = 0.0
+        self.edits = 0
+        if polygon:
+            self.reset(polygon)
+
+    def _project(self, lat, lng):
+        if self.center is None:
+            # 投影中心在第一次取得頂點時固定，之後所有編輯共用
+            self.center = (lat, lng)
+        x, y = project_equal_area(lat, lng, self.center[0], self.center[1])
+        return (float(x), float(y))
+
+    def _neighbors(self, index):
+        n = len(self.projected)
+        return self.projected[(index - 1) % n], self.projected[(index + 1) % n]
+
+    def _recompute(self):
+        n = len(self.projected)
+        self.twice_area = sum(_cross(self.projected[i], self.projected[(i + 1) % n]) for i in range(n))
+
+    def _after_edit(self):
+        self.edits += 1
+        if self.edits % RESYNC_EVERY == 0:
+            self._recompute()
+
+    def reset(self, polygon):
+        lats = [float(p["lat"]) for p in polygon]
+        lngs = [float(p["lng"]) for p in polygon]
+        self.center = ring_center(lats, lngs) if polygon else None
+        self.points = [{"lat": lat, "lng": lng} for lat, lng in zip(lats, lngs)]
+        self.projected = [self._project(lat, lng) for lat, lng in zip(lats, lngs)]
+        self._recompute()
+
+    def insert(self, index, lat, lng):
+        """在 index 位置插入頂點（原本 index 的頂點往後移）"""
+        n = len(self.projected)
+        if not 0 <= index <= n:
+            raise IndexError("頂點索引超出範圍")
+        new = self._project(float(lat), float(lng))
+        if n:
+            prev = self.projected[(index - 1) % n]
+            nxt = self.projected[index % n]
+            self.twice_area += _cross(prev, new) + _cross(new, nxt) - _cross(prev, nxt)
+        self.points.insert(index, {"lat": float(lat), "lng": float(lng)})
+        self.projected.insert(index, new)
+        self._after_edit()
+
+    def move(self, index, lat, lng):
+        if not 0 <= index < len(self.projected):
+            raise IndexError("頂點索引超出範圍")
+        old = self.projected[index]
+        new = self._project(float(lat), float(lng))
+        prev, nxt = self._neighbors(index)
+        self.twice_area += (
+            _cross(prev, new) + _cross(new, nxt) - _cross(prev, old) - _cross(old, nxt)
+        )
+        self.points[index] = {"lat": float(lat), "lng": float(lng)}
+        self.projected[index] = new
+        self._after_edit()
+
+    def delete(self, index):
+        if not 0 <= index < len(self.projected):
+            raise IndexError("頂點索引超出範圍")
+        old = self.projected[index]
+        prev, nxt = self._neighbors(index)
+        self.twice_area += _cross(prev, nxt) - _cross(prev, old) - _cross(old, nxt)
+        del self.points[index]
+        del self.projected[index]
+        self._after_edit()
+
+    def apply(self, message):
+        """
+        套用一筆編輯訊息：
+        {"op": "reset", "polygon": [{lat, lng}, ...]}
+        {"op": "insert" | "move", "index": i, "lat": ..., "lng": ...}
+        {"op": "delete", "index": i}
+        格式不符時拋出 ValueError、KeyError、IndexError 或 TypeError
+        """
+        if not isinstance(message, dict):
+            raise TypeError("訊息需為 JSON 物件")
+        op = message.get("op")
+        if op == "reset":
+            self.reset(message.get("polygon") or [])
+        elif op == "insert":
+            self.insert(int(message["index"]), message["lat"], message["lng"])
+        elif op == "move":
+            self.move(int(message["index"]), message["lat"], message["lng"])
+        elif op == "delete":
+            self.delete(int(message["index"]))
+        else:
+            raise ValueError(f"未知的操作: {op}")
+
+    @property
+    def signed_area(self):
+        """有號面積（平方米），逆時針為正"""
+        if len(self.projected) < 3:
+            return 0.0
+        return self.twice_area / 2
+
+    @property
+    def area(self):
+        return round(abs(self.signed_area), 2)
+
+    def state(self):
+        return {
+            "area": self.area,
+            "signed_area": round(self.signed_area, 2),
+            "vertices": len(self.points),
+        }
@@ -1,25 +1,47 @@
-from flask import Flask, jsonify, request, send_from_directory, redirect, session, url_for
+from flask import Blueprint, Flask, Response, jsonify, request, send_from_directory, redirect, session, url_for, stream_with_context
+import json
 import os
 import random
+import sys
 from flask_cors import CORS
 from dotenv import load_dotenv
 from flask_jwt_extended import create_access_token
 from datetime import timedelta
 from authlib.integrations.flask_client import OAuth
 from flask_jwt_extended import JWTManager
-import requests
-from geopy.distance import geodesic
+from flask_sock import Sock
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.admission import Shed, admission_from_env, client_id, shed_body
+from common.deadline import DeadlineExceeded, client_gone, request_deadline
+from common.http_pool import get_http_pool
+from common.metrics import metrics
+from common.server import on_worker_exit, register_metrics_route, register_probe_routes, serve
+from roof_area import polygon_area, latlng_dicts_to_array
+from geojson_batch import feature_areas
+from roof_session import RoofOutlineSession
+from polygon_prep import PolygonError, prepare_polygon, simplify_to_fit
+from imagery_cache import ImageryCache, request_key, snap_center
+from imagery_planner import fetch_imagery, plan_imagery
+from roof_jobs import JobStore, QueueFull, RoofJobQueue
+from vision_image import StreamingVisionBody, prepare_vision_image
+from roof_result_cache import RoofResultCache
+from roof_segmentation import SEGMENTER_VERSION, SegmentationError, segment_roof
+import hashlib
+import io
+import math
+import time
+from PIL import Image
 
 load_dotenv()
 
-app = Flask(__name__, static_folder="static")
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", "your-secret-key")
-app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "dev-secret")
-jwt = JWTManager(app)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# 屋頂辨識、面積計算與登入的路由都在 bp 上；獨立執行時掛到本檔的 app，
+# 合併部署時由 app.create_app 與推薦服務掛到同一個 Flask app
+bp = Blueprint("roof", __name__)
+sock = Sock()
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
-# Google OAuth 設定（✅ 改用 OpenID Connect 標準方式）
-oauth = OAuth(app)
+# Google OAuth 設定（✅ 改用 OpenID Connect 標準方式），於 init_app 綁定 app
+oauth = OAuth()
 oauth.register(
     name='google',
     client_id=os.environ.get("GOOGLE_CLIENT_ID"),
@@ -31,16 +53,16 @@ oauth.register(
 )
 
 
-@app.route("/login/google")
+@bp.route("/login/google")
 def login_google():
     # 1. 觸發 Google OAuth 流程，使用者授權後會回到 /login/google/authorize
     # 請確保下列兩個 redirect_uri 都有加到 Google Cloud Console 的 OAuth 2.0 設定中：
     # http://34.81.110.126:8080/login/google/authorize
     # http://127.0.0.1:8080/login/google/authorize
-    redirect_uri = url_for("authorize_google", _external=True)
+    redirect_uri = url_for(".authorize_google", _external=True)
     return oauth.google.authorize_redirect(redirect_uri)
 
-@app.route("/login/google/authorize")
+@bp.route("/login/google/authorize")
 def authorize_google():
     try:
         token = oauth.google.authorize_access_token()
@@ -56,142 +78,674 @@ def authorize_google():
         print("Google OAuth Error:", e)
         return "Google OAuth 登入失敗：" + str(e), 500
 
-@app.route("/api/user")
+@bp.route("/api/user")
 def get_user():
     user = session.get("user")
     if user:
         return jsonify(user)
     return jsonify({"error": "未登入"}), 401
 
-def polygon_area_geodesic(polygon):
+def polygon_area_geodesic(polygon, holes=None):
     """
-    計算多邊形（經緯度座標陣列）在地球表面的近似面積（平方米）
-    使用三角剖分與 geopy 計算邊長，再用海龍公式計算面積
+    計算多邊形（經緯度座標陣列）在地球表面的面積（平方米）
+    以等積投影加鞋帶公式計算有號面積，支援凹多邊形與孔洞（holes）
     """
     if len(polygon) < 3:
         return 0
-    # 以第一點為基準，將多邊形分割為多個三角形
-    area = 0
-    p0 = (polygon[0]['lat'], polygon[0]['lng'])
-    for i in range(1, len(polygon) - 1):
-        p1 = (polygon[i]['lat'], polygon[i]['lng'])
-        p2 = (polygon[i + 1]['lat'], polygon[i + 1]['lng'])
-        # 三邊長
-        a = geodesic(p0, p1).meters
-        b = geodesic(p1, p2).meters
-        c = geodesic(p2, p0).meters
-        s = (a + b + c) / 2
-        # 海龍公式
-        try:
-            tri_area = (s * (s - a) * (s - b) * (s - c)) ** 0.5
-            area += tri_area
-        except Exception:
-            pass
-    return round(area, 2)
+    exterior = latlng_dicts_to_array(polygon)
+    hole_arrays = [latlng_dicts_to_array(h) for h in (holes or []) if len(h) >= 3]
+    return round(polygon_area(exterior, hole_arrays), 2)
+
+# 多邊形簡化容許誤差（公尺）與 Static Maps path= 最多頂點數
+POLYGON_SIMPLIFY_TOLERANCE_M = float(os.environ.get("POLYGON_SIMPLIFY_TOLERANCE_M", "0.05"))
+STATIC_MAP_MAX_PATH_VERTICES = int(os.environ.get("STATIC_MAP_MAX_PATH_VERTICES", "300"))
+
+# 衛星圖快取：目錄、容量上限與中心點對齊格距（像素）
+IMAGERY_CACHE_DIR = os.environ.get(
+    "IMAGERY_CACHE_DIR", os.path.join(os.path.dirname(__file__), "cache", "imagery")
+)
+IMAGERY_CACHE_MAX_BYTES = int(os.environ.get("IMAGERY_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGERY_GRID_PX = int(os.environ.get("IMAGERY_GRID_PX", "8"))
+imagery_cache = ImageryCache(IMAGERY_CACHE_DIR, IMAGERY_CACHE_MAX_BYTES)
+
+def static_map_params(center_lat, center_lng, polygon=None, zoom=20, size="640x640"):
+    """正規化後的 Static Maps 參數；中心點對齊格點，相近請求共用同一張圖"""
+    center_lat, center_lng = snap_center(float(center_lat), float(center_lng), zoom, IMAGERY_GRID_PX)
+    params = {
+        "center": f"{center_lat},{center_lng}",
+        "zoom": zoom,
+        "size": size,
+        "maptype": "satellite",
+        "path": None,
+    }
+    if polygon:
+        # path 格式: path=color:0xff0000ff|weight:2|lat1,lng1|lat2,lng2|...
+        # Static Maps 網址有長度限制，頂點過多時進一步簡化
+        path_points = simplify_to_fit(polygon, STATIC_MAP_MAX_PATH_VERTICES)
+        path_str = "|".join([f"{p['lat']:.6f},{p['lng']:.6f}" for p in path_points])
+        params["path"] = f"color:0xff0000ff|weight:2|{path_str}"
+    return params
+
+def static_map_url(params):
+    query = "&".join(f"{k}={v}" for k, v in params.items() if v is not None)
+    return f"https://maps.googleapis.com/maps/api/staticmap?{query}&key={os.environ.get('GOOGLE_MAPS_API_KEY')}"
+
+def fetch_static_map(params, deadline=None):
+    """取得衛星圖內容（bytes-like），失敗時回傳 None；超過 deadline 時拋出 DeadlineExceeded"""
+    key = request_key(params)
+    cached = imagery_cache.get(key)
+    if cached is not None:
+        return cached
+
+    img_resp = get_http_pool().get(static_map_url(params), deadline=deadline)
+    if img_resp.status_code != 200:
+        print("無法取得地圖圖片", img_resp.status_code, img_resp.text)
+        return None
+    imagery_cache.put(key, img_resp.content)
+    return img_resp.content
+
+# 取圖規劃：最高 zoom、需維持的最低細節 zoom、拼接張數上限與平行下載數
+IMAGERY_MAX_ZOOM = int(os.environ.get("IMAGERY_MAX_ZOOM", "20"))
+IMAGERY_MIN_DETAIL_ZOOM = int(os.environ.get("IMAGERY_MIN_DETAIL_ZOOM", "19"))
+IMAGERY_MAX_TILES = int(os.environ.get("IMAGERY_MAX_TILES", "16"))
+IMAGERY_FETCH_WORKERS = int(os.environ.get("IMAGERY_FETCH_WORKERS", "8"))
 
-@app.route("/api/roof-detect", methods=["POST"])
+# 送進 Gemini Vision 的圖片：長邊上限、格式（JPEG/WEBP/PNG）、品質與裁切邊界（像素）
+VISION_MAX_PX = int(os.environ.get("VISION_MAX_PX", "512"))
+VISION_IMAGE_FORMAT = os.environ.get("VISION_IMAGE_FORMAT", "JPEG").upper()
+VISION_IMAGE_QUALITY = int(os.environ.get("VISION_IMAGE_QUALITY", "85"))
+VISION_CROP_MARGIN_PX = int(os.environ.get("VISION_CROP_MARGIN_PX", "32"))
+
+# Gemini Vision 模型與 prompt；版本字串納入結果快取 key，更換後舊結果自動失效
+# Gemini 1.0 Pro Vision 已停用，改用 gemini-1.5-flash
+GEMINI_VISION_MODEL = "gemini-1.5-flash"
+# GEMINI_API_BASE 可指向本機替身服務（測試與負載測試用，同 dsa_backend/app.py）
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+ROOF_PROMPT_POLYGON = (
+    "請根據這張衛星圖像與紅色多邊形標示區域，"
+    "辨識該多邊形區域內的屋頂面積（平方米），"
+    "並回傳一個 JSON 格式：{\"area\": 面積數字, \"polygon\": [多邊形座標陣列]}，"
+    "polygon 為屋頂輪廓的經緯度陣列。"
+)
+ROOF_PROMPT_AUTO = (
+    "請自動辨識這張衛星圖像中最大屋頂的面積（平方米），"
+    "並回傳一個 JSON 格式：{\"area\": 面積數字, \"polygon\": [多邊形座標陣列]}，"
+    "polygon 為屋頂輪廓的經緯度陣列。"
+)
+ROOF_MODEL_VERSION = hashlib.sha1(
+    f"{GEMINI_VISION_MODEL}|{ROOF_PROMPT_POLYGON}|{ROOF_PROMPT_AUTO}".encode("utf-8")
+).hexdigest()[:12]
+
+# 屋頂辨識引擎：gemini（僅 Gemini Vision）、local（本地影像分割）、
+# auto（Gemini 失敗時改用本地分割）；可由請求的 engine 欄位覆寫
+ROOF_DETECT_ENGINES = ("gemini", "local", "auto")
+ROOF_DETECT_ENGINE = os.environ.get("ROOF_DETECT_ENGINE", "auto")
+LOCAL_SEGMENT_WORK_PX = int(os.environ.get("LOCAL_SEGMENT_WORK_PX", "256"))
+LOCAL_MODEL_VERSION = f"{SEGMENTER_VERSION}-{LOCAL_SEGMENT_WORK_PX}"
+
+# 屋頂辨識結果快取（SQLite）
+roof_result_cache = RoofResultCache(
+    os.environ.get(
+        "ROOF_RESULT_CACHE_PATH", os.path.join(os.path.dirname(__file__), "cache", "roof_results.sqlite3")
+    ),
+    geohash_precision=int(os.environ.get("ROOF_CACHE_GEOHASH_PRECISION", "8")),
+    fingerprint_grid_m=float(os.environ.get("ROOF_CACHE_GRID_M", "1.0")),
+)
+
+# /api/roof-detect 的准入預算：只有需要取圖辨識（快取未命中）的請求消耗 token，
+# 已知多邊形面積與快取命中照常快速回應；環境變數見 common.admission.admission_from_env
+roof_admission = admission_from_env(
+    "roof_detect", "ROOF_ADMISSION",
+    rate=5, burst=10, client_rate=1, client_burst=5, max_queue=20, max_wait=5,
+)
+
+# /api/roof-detect 的請求期限（秒），用戶端可用 X-Request-Timeout-Ms 縮短
+ROOF_DETECT_DEADLINE = float(os.environ.get("ROOF_DETECT_DEADLINE", "25"))
+
+@bp.route("/api/roof-detect", methods=["POST"])
 def roof_detect():
-    data = request.get_json()
+    environ = request.environ
+    deadline = request_deadline(request.headers, ROOF_DETECT_DEADLINE, lambda: client_gone(environ))
+    prepared = prepare_roof_detect(request.get_json())
+    if not isinstance(prepared, RoofDetectRequest):
+        result, status = prepared
+        return jsonify(result), status
+    try:
+        # 預估排隊時間超過剩餘期限的請求直接拒絕
+        roof_admission.admit(client_id(request.headers, request.remote_addr), deadline.remaining())
+    except Shed as e:
+        body, headers = shed_body(e)
+        return jsonify(body), 429, headers
+    result, status = run_roof_detect(prepared, deadline)
+    return jsonify(result), status
+
+class RoofDetectRequest:
+    """通過驗證、快取未命中，需要取圖辨識的屋頂辨識請求"""
+
+    def __init__(self, polygon, lat, lng, engine, version, cache_key, geohash, key_lat, key_lng, plan,
+                 center_lat, center_lng):
+        self.polygon = polygon
+        self.lat, self.lng = lat, lng
+        self.engine = engine
+        self.version = version
+        self.cache_key, self.geohash, self.key_lat, self.key_lng = cache_key, geohash, key_lat, key_lng
+        self.plan = plan
+        self.center_lat, self.center_lng = center_lat, center_lng
+
+    def frame_params(self):
+        """各張圖的 Static Maps 參數，順序同 plan.frames()"""
+        return [
+            static_map_params(frame_lat, frame_lng, self.polygon, zoom=self.plan.zoom)
+            for frame_lat, frame_lng, _, _ in self.plan.frames()
+        ]
+
+def detect_roof(data):
+    """
+    背景工作的屋頂辨識流程，回傳 (結果 dict, HTTP 狀態碼)
+    不依賴 request context；需要取圖辨識時與 /api/roof-detect 共用全域准入預算，
+    只在有剩餘 token 時執行，排隊中的即時請求優先（用戶端預算在送出工作時扣除）
+    """
+    prepared = prepare_roof_detect(data)
+    if not isinstance(prepared, RoofDetectRequest):
+        return prepared
+    roof_admission.admit_background()
+    return run_roof_detect(prepared)
+
+def run_roof_detect(prepared, deadline=None):
+    """
+    取圖並辨識，回傳 (結果 dict, HTTP 狀態碼)
+    deadline：所有對外呼叫以剩餘時間為逾時；取圖未完成即到期回傳 504，
+    已取得影像但等不到 Gemini 時改用本地分割；用戶端已離開時不再繼續
+    """
+
+    def fetch_frame(frame_lat, frame_lng, zoom):
+        return fetch_static_map(static_map_params(frame_lat, frame_lng, prepared.polygon, zoom=zoom), deadline)
+
+    # 下載圖片（優先使用快取，多張圖時平行下載）
+    try:
+        img_content = fetch_imagery(prepared.plan, fetch_frame, workers=IMAGERY_FETCH_WORKERS)
+    except DeadlineExceeded as e:
+        return deadline_exceeded("imagery", e)
+    if img_content is None:
+        return {"error": "無法取得地圖圖片"}, 500
+    if prepared.engine == "local":
+        return settle_roof_detect(prepared, img_content, None, None)
+
+    try:
+        result, status = detect_roof_gemini(img_content, prepared.plan, prepared.polygon, deadline)
+    except DeadlineExceeded as e:
+        result, status = deadline_exceeded("gemini", e)
+        if e.reason == "cancelled":
+            return result, status
+        return settle_roof_detect(prepared, img_content, result, status, fallback=True)
+    return settle_roof_detect(prepared, img_content, result, status)
+
+def deadline_exceeded(stage, e):
+    """期限到或用戶端離開時的回應 (結果 dict, 504)"""
+    metrics.incr("roof_detect_deadline_total", stage=stage, reason=e.reason)
+    return {"error": "超過請求期限", "stage": stage, "reason": e.reason}, 504
+
+def prepare_roof_detect(data):
+    """
+    驗證請求、多邊形前處理與結果快取查詢
+    可直接回應時（錯誤、已知多邊形面積、快取命中）回傳 (結果 dict, HTTP 狀態碼)，否則回傳 RoofDetectRequest
+    有多邊形時預設只計算面積，帶 detect: true 或 engine 才取圖辨識
+    """
     lat = data.get("lat")
     lng = data.get("lng")
     polygon = data.get("polygon")  # 前端傳來的 [{lat, lng}, ...] 陣列
+    holes = data.get("holes")  # 選填：孔洞 [[{lat, lng}, ...], ...]
 
-    # 若有多邊形，直接用 geopy 計算面積
+    # 多邊形前處理：去重複點、統一方向、檢查自相交並簡化
     if polygon and isinstance(polygon, list) and len(polygon) >= 3:
-        area = polygon_area_geodesic(polygon)
-        print(f"geopy 計算多邊形面積: {area} 平方米")  # 新增這行
-        return jsonify({"area": area})
+        try:
+            tolerance = float(data.get("simplify_tolerance", POLYGON_SIMPLIFY_TOLERANCE_M))
+        except (TypeError, ValueError):
+            return {"error": "simplify_tolerance 需為數字"}, 400
+        if holes is not None and not (isinstance(holes, list) and all(isinstance(h, list) for h in holes)):
+            return {"error": "holes 需為多邊形陣列"}, 400
+        try:
+            polygon, prep_info = prepare_polygon(polygon, tolerance)
+            holes = [prepare_polygon(h, tolerance)[0] for h in (holes or []) if len(h) >= 3]
+        except PolygonError as e:
+            return {"error": str(e)}, 400
+        print(f"多邊形前處理: {prep_info['original_vertices']} -> {prep_info['vertices']} 個頂點")
 
-    # 取得 Google Maps 靜態圖像 URL，若有 polygon 則用 path 標示
-    if polygon and isinstance(polygon, list) and len(polygon) >= 3:
-        # path 格式: path=color:0xff0000ff|weight:2|lat1,lng1|lat2,lng2|...
-        path_str = "|".join([f"{p['lat']},{p['lng']}" for p in polygon])
-        static_map_url = (
-            f"https://maps.googleapis.com/maps/api/staticmap"
-            f"?size=640x640&maptype=satellite"
-            f"&path=color:0xff0000ff|weight:2|{path_str}"
-            f"&key={os.environ.get('GOOGLE_MAPS_API_KEY')}"
-        )
+    # 有多邊形而未要求辨識時，直接計算面積（前端已畫好輪廓的一般情況）；
+    # 帶 detect: true 或指定 engine 時取圖辨識，多邊形用於選擇 zoom、拼接與裁切，並作為快取 key
+    has_polygon = bool(polygon and isinstance(polygon, list) and len(polygon) >= 3)
+    if has_polygon and not wants_detection(data):
+        area = polygon_area_geodesic(polygon, holes)
+        print(f"多邊形面積: {area} 平方米")
+        return {"area": area}, 200
+
+    # 相同屋頂（同一 geohash 與量化多邊形、同一 prompt/模型版本）直接回傳快取結果
+    if not has_polygon and (lat is None or lng is None):
+        return {"error": "請提供 polygon 或 lat/lng"}, 400
+    engine = data.get("engine") or ROOF_DETECT_ENGINE
+    if engine not in ROOF_DETECT_ENGINES:
+        return {"error": f"engine 需為 {', '.join(ROOF_DETECT_ENGINES)} 其中之一"}, 400
+    version = result_version(engine)
+    cache_key, geohash, key_lat, key_lng = roof_result_cache.make_key(
+        version, polygon if has_polygon else None, lat, lng
+    )
+    cached = roof_result_cache.get(cache_key)
+    if cached is not None:
+        metrics.incr("roof_result_cache_hits_total")
+        return cached, 200
+    metrics.incr("roof_result_cache_misses_total")
+
+    # 依多邊形範圍選擇 zoom；大型屋頂以多張靜態圖拼接，若有 polygon 則用 path 標示
+    if has_polygon:
         # 取中心點作為地圖中心
         center_lat = sum(p['lat'] for p in polygon) / len(polygon)
         center_lng = sum(p['lng'] for p in polygon) / len(polygon)
-        static_map_url += f"&center={center_lat},{center_lng}&zoom=20"
     else:
-        static_map_url = (
-            f"https://maps.googleapis.com/maps/api/staticmap"
-            f"?center={lat},{lng}&zoom=20&size=640x640&maptype=satellite"
-            f"&key={os.environ.get('GOOGLE_MAPS_API_KEY')}"
+        center_lat, center_lng = float(lat), float(lng)
+    plan = plan_imagery(
+        center_lat,
+        center_lng,
+        polygon if has_polygon else None,
+        max_zoom=IMAGERY_MAX_ZOOM,
+        min_detail_zoom=IMAGERY_MIN_DETAIL_ZOOM,
+        margin_px=VISION_CROP_MARGIN_PX,
+        max_tiles=IMAGERY_MAX_TILES,
+    )
+    plan.center_lat, plan.center_lng = snap_center(center_lat, center_lng, plan.zoom, IMAGERY_GRID_PX)
+    if plan.tiled:
+        print(f"大型屋頂：zoom {plan.zoom}，拼接 {plan.cols}x{plan.rows} 張圖")
+    return RoofDetectRequest(
+        polygon if has_polygon else None, lat, lng, engine, version, cache_key, geohash, key_lat, key_lng, plan,
+        center_lat, center_lng,
+    )
+
+def result_version(engine):
+    """辨識結果快取使用的版本：本地分割與 Gemini（含 auto）分開快取"""
+    return LOCAL_MODEL_VERSION if engine == "local" else ROOF_MODEL_VERSION
+
+
+def wants_detection(data):
+    """有多邊形的請求是否要取圖辨識（而非只計算面積）"""
+    return bool(data.get("detect")) or data.get("engine") is not None
+
+def settle_roof_detect(prepared, img_content, result, status, fallback=False):
+    """
+    取得影像（與 Gemini 結果）後的收尾：local 引擎執行本地分割，成功結果存入快取；
+    auto 模式（或 fallback=True，例如期限內等不到 Gemini）Gemini 失敗時改用本地分割，
+    結果存在本地引擎的版本下，不會遮蔽之後的 Gemini 結果
+    """
+    if prepared.engine == "local":
+        result, status = detect_roof_local(img_content, prepared.plan, prepared.center_lat, prepared.center_lng)
+    if status == 200:
+        roof_result_cache.put(
+            prepared.cache_key, prepared.geohash, prepared.key_lat, prepared.key_lng, prepared.version, result
+        )
+        return result, status
+    if prepared.engine == "auto" or fallback:
+        metrics.incr("roof_detect_fallback_total")
+        local_result, local_status = detect_roof_local(
+            img_content, prepared.plan, prepared.center_lat, prepared.center_lng
         )
+        if local_status == 200:
+            local_key = roof_result_cache.make_key(LOCAL_MODEL_VERSION, prepared.polygon, prepared.lat, prepared.lng)[0]
+            roof_result_cache.put(
+                local_key, prepared.geohash, prepared.key_lat, prepared.key_lng, LOCAL_MODEL_VERSION, local_result
+            )
+            return local_result, 200
+    return result, status
 
-    # 下載圖片
-    img_resp = requests.get(static_map_url)
-    if img_resp.status_code != 200:
-        print("無法取得地圖圖片", img_resp.status_code, img_resp.text)
-        return jsonify({"error": "無法取得地圖圖片"}), 500
+def detect_roof_local(img_content, plan, target_lat, target_lng):
+    """本地影像分割，回傳 (結果 dict, HTTP 狀態碼)"""
+    start = time.perf_counter()
+    try:
+        segmented = segment_roof(
+            img_content,
+            plan.center_lat,
+            plan.center_lng,
+            plan.zoom,
+            target_lat,
+            target_lng,
+            work_px=LOCAL_SEGMENT_WORK_PX,
+        )
+    except (OSError, SegmentationError) as e:
+        metrics.incr("roof_local_segment_failures_total")
+        return {"error": "本地屋頂分割失敗", "detail": str(e)}, 422
+    finally:
+        metrics.observe("roof_local_segment_seconds", time.perf_counter() - start)
+    return {
+        "area": segmented["area"],
+        "polygon": segmented["polygon"],
+        "source": "local",
+        "touches_border": segmented["touches_border"],
+    }, 200
+
+def detect_roof_gemini(img_content, plan, polygon=None, deadline=None):
+    """Gemini Vision 辨識，回傳 (結果 dict, HTTP 狀態碼)；超過 deadline 時拋出 DeadlineExceeded"""
+    gemini_full_url, headers, body = gemini_vision_request(img_content, plan, polygon)
+    try:
+        gemini_resp = get_http_pool().post(gemini_full_url, headers=headers, data=body, deadline=deadline)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print("Gemini Vision API 連線失敗：", e)
+        return {"error": "Gemini Vision API 失敗", "detail": str(e)}, 500
+    return parse_gemini_vision_response(gemini_resp)
 
-    # 呼叫 Gemini Vision API
-    # Gemini 1.0 Pro Vision 已停用，改用 gemini-1.5-flash
+def gemini_vision_request(img_content, plan, polygon=None):
+    """Gemini Vision API 請求的 (url, headers, 本文)，同步與 asyncio 路徑共用"""
     gemini_api_key = os.environ.get("GOOGLE_API_KEY")
-    gemini_url = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-flash:generateContent"
+    gemini_url = f"{GEMINI_API_BASE}/v1/models/{GEMINI_VISION_MODEL}:generateContent"
     headers = {"Content-Type": "application/json"}
-    import base64
-    img_base64 = base64.b64encode(img_resp.content).decode("utf-8")
 
-    if polygon and isinstance(polygon, list) and len(polygon) >= 3:
-        prompt = (
-            "請根據這張衛星圖像與紅色多邊形標示區域，"
-            "辨識該多邊形區域內的屋頂面積（平方米），"
-            "並回傳一個 JSON 格式：{\"area\": 面積數字, \"polygon\": [多邊形座標陣列]}，"
-            "polygon 為屋頂輪廓的經緯度陣列。"
-        )
-    else:
-        prompt = (
-            "請自動辨識這張衛星圖像中最大屋頂的面積（平方米），"
-            "並回傳一個 JSON 格式：{\"area\": 面積數字, \"polygon\": [多邊形座標陣列]}，"
-            "polygon 為屋頂輪廓的經緯度陣列。"
+    # 裁切到多邊形範圍並縮小、重新編碼，減少上傳量與 vision token
+    try:
+        vision_image, mime_type = prepare_vision_image(
+            img_content,
+            plan.center_lat,
+            plan.center_lng,
+            plan.zoom,
+            polygon,
+            max_px=VISION_MAX_PX,
+            image_format=VISION_IMAGE_FORMAT,
+            quality=VISION_IMAGE_QUALITY,
+            margin_px=VISION_CROP_MARGIN_PX,
         )
+        # 有多邊形（detect: true 或指定 engine）才會裁切；計數可確認實際送出的圖片是否經過裁切
+        metrics.incr("roof_vision_images_total", crop="polygon" if polygon else "none")
+        metrics.incr("roof_vision_image_bytes_total", len(vision_image))
+    except (OSError, ValueError) as e:
+        print("圖片前處理失敗，改用原圖：", e)
+        metrics.incr("roof_vision_images_total", crop="failed")
+        if isinstance(img_content, Image.Image):
+            # 拼接圖沒有原始檔案，重新編碼為 PNG
+            out = io.BytesIO()
+            img_content.save(out, format="PNG")
+            img_content = out.getbuffer()
+        vision_image, mime_type = img_content, "image/png"
 
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt},
-                    {
-                        "inlineData": {
-                            "mimeType": "image/png",
-                            "data": img_base64
-                        }
-                    }
-                ]
-            }
-        ]
-    }
-    gemini_full_url = f"{gemini_url}?key={gemini_api_key}"
-    gemini_resp = requests.post(gemini_full_url, headers=headers, json=payload)
+    prompt = ROOF_PROMPT_POLYGON if polygon else ROOF_PROMPT_AUTO
+
+    body = StreamingVisionBody(prompt, vision_image, mime_type)
+    headers["Content-Length"] = str(len(body))
+    return f"{gemini_url}?key={gemini_api_key}", headers, body
+
+def parse_gemini_vision_response(gemini_resp):
+    """解析 Gemini Vision 回應（需有 status_code、text、json()），回傳 (結果 dict, HTTP 狀態碼)"""
     if gemini_resp.status_code != 200:
         print("Gemini Vision API 失敗", gemini_resp.status_code, gemini_resp.text)
-        return jsonify({"error": "Gemini Vision API 失敗"}), 500
+        return {"error": "Gemini Vision API 失敗"}, 500
 
     try:
         gemini_data = gemini_resp.json()
-        import json
         result_json = gemini_data["candidates"][0]["content"]["parts"][0]["text"]
         print("Gemini 回傳內容：", result_json)
         result = json.loads(result_json)
         print("Gemini 解析後結果：", result)
-        return jsonify(result)
+        result["source"] = "gemini"
+        return result, 200
     except Exception as e:
         print("Gemini 回傳解析失敗：", e)
         print("Gemini 原始回傳：", gemini_resp.text)
-        return jsonify({"error": "Gemini 回傳解析失敗", "detail": str(e)}), 500
+        return {"error": "Gemini 回傳解析失敗", "detail": str(e)}, 500
+
+# 屋頂辨識背景工作：工作執行緒數、佇列上限與完成結果保留秒數
+# 工作狀態寫入共用的 SQLite，多個 worker 行程時可由任一行程查詢
+roof_jobs = RoofJobQueue(
+    detect_roof,
+    workers=int(os.environ.get("ROOF_JOB_WORKERS", "4")),
+    max_queue=int(os.environ.get("ROOF_JOB_MAX_QUEUE", "100")),
+    job_ttl=int(os.environ.get("ROOF_JOB_TTL_SECONDS", "600")),
+    metrics=metrics,
+    store=JobStore(
+        os.environ.get("ROOF_JOB_STORE_PATH", os.path.join(os.path.dirname(__file__), "cache", "roof_jobs.sqlite3"))
+    ),
+)
+# worker 回收或重啟前，等待已接受的工作完成
+on_worker_exit(lambda: roof_jobs.shutdown(
+    timeout=int(os.environ.get("BACKEND_WEB_GRACEFUL_TIMEOUT") or os.environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+))
+# SSE 心跳間隔（秒）
+ROOF_JOB_SSE_HEARTBEAT = 15
+# 用戶端可指定的優先權範圍（數字越小越優先）；超出範圍時取最接近的值，
+# ROOF_JOB_WARM_PRIORITY 保留給快取預熱，排在所有用戶端工作之後
+ROOF_JOB_MIN_PRIORITY, ROOF_JOB_MAX_PRIORITY = 1, 8
+ROOF_JOB_DEFAULT_PRIORITY = 5
+ROOF_JOB_WARM_PRIORITY = 9
+
+@bp.route("/api/roof-detect/jobs", methods=["POST"])
+def submit_roof_job():
+    """
+    以背景工作執行屋頂辨識，立即回傳 job_id
+    請求內容同 /api/roof-detect，另可帶 priority（整數 1–8，數字越小越優先，預設 5；超出範圍時取最接近的值）
+    送出時扣用戶端准入預算，超量時回傳 429
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "請提供 JSON 內容"}), 400
+    priority = data.pop("priority", ROOF_JOB_DEFAULT_PRIORITY)
+    if isinstance(priority, float) and priority.is_integer():
+        priority = int(priority)
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        return jsonify({"error": "priority 需為整數"}), 400
+    priority = min(max(int(priority), ROOF_JOB_MIN_PRIORITY), ROOF_JOB_MAX_PRIORITY)
+    try:
+        roof_admission.admit_client(client_id(request.headers, request.remote_addr))
+    except Shed as e:
+        body, headers = shed_body(e)
+        return jsonify(body), 429, headers
+    try:
+        job, created = roof_jobs.submit(data, priority)
+    except QueueFull as e:
+        return jsonify({"error": str(e), **roof_jobs.stats()}), 503, {"Retry-After": "5"}
+    body = {**job.to_dict(), "deduplicated": not created, "queue": roof_jobs.stats()}
+    return jsonify(body), 202, {"Location": url_for(".get_roof_job", job_id=job.id)}
+
+@bp.route("/api/roof-detect/jobs/<job_id>")
+def get_roof_job(job_id):
+    job = roof_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到此工作"}), 404
+    return jsonify(job.to_dict())
+
+@bp.route("/api/roof-detect/jobs/<job_id>/events")
+def roof_job_events(job_id):
+    """以 Server-Sent Events 推送工作完成通知"""
+    job = roof_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "找不到此工作"}), 404
+
+    def generate():
+        while not roof_jobs.wait(job, ROOF_JOB_SSE_HEARTBEAT):
+            yield ": heartbeat\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _parse_bbox(value):
+    south, west, north, east = (float(v) for v in value.split(","))
+    return south, west, north, east
+
+@bp.route("/api/roof-detect/cache")
+def query_roof_cache():
+    """
+    依範圍查詢快取的屋頂辨識結果：?bbox=south,west,north,east
+    預設只回傳目前設定引擎的版本；?engine=local|gemini|auto 或 ?version=... 指定其他版本，?all_versions=1 不篩選
+    """
+    try:
+        bbox = _parse_bbox(request.args.get("bbox", ""))
+    except ValueError:
+        return jsonify({"error": "bbox 格式為 south,west,north,east"}), 400
+    try:
+        limit = min(int(request.args.get("limit", 1000)), 10000)
+    except ValueError:
+        return jsonify({"error": "limit 需為整數"}), 400
+    if limit <= 0:
+        return jsonify({"error": "limit 需為正整數"}), 400
+    engine = request.args.get("engine") or ROOF_DETECT_ENGINE
+    if engine not in ROOF_DETECT_ENGINES:
+        return jsonify({"error": f"engine 需為 {', '.join(ROOF_DETECT_ENGINES)} 其中之一"}), 400
+    version = request.args.get("version") or result_version(engine)
+    entries = roof_result_cache.query_bbox(
+        *bbox, version=None if request.args.get("all_versions") else version, limit=limit
+    )
+    return jsonify({"version": version, "entries": entries})
+
+@bp.route("/api/roof-detect/cache/warm", methods=["POST"])
+def warm_roof_cache():
+    """
+    預熱快取：{"points": [{lat, lng}, ...]} 或 {"polygons": [[{lat, lng}, ...], ...]}
+    尚未快取者以低優先權送進背景工作佇列；多邊形以 detect: true 辨識，結果以多邊形指紋快取
+    每次預熱請求扣一個用戶端 token，各項工作執行時再各自取得全域 token
+    """
+    try:
+        roof_admission.admit_client(client_id(request.headers, request.remote_addr))
+    except Shed as e:
+        body, headers = shed_body(e)
+        return jsonify(body), 429, headers
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "請求內容需為 JSON 物件"}), 400
+    points, polygons = data.get("points", []), data.get("polygons", [])
+    if not isinstance(points, list) or not isinstance(polygons, list):
+        return jsonify({"error": "points 與 polygons 需為陣列"}), 400
+    # 與 prepare_roof_detect 以相同引擎、相同版本計算快取 key
+    version = result_version(ROOF_DETECT_ENGINE)
+    queued, skipped, rejected = [], 0, 0
+    for kind, raw in [("point", p) for p in points] + [("polygon", p) for p in polygons]:
+        # 逐項驗證，格式錯誤的項目只計入 rejected，不影響其他項目
+        try:
+            if kind == "polygon":
+                polygon, _ = prepare_polygon(raw, POLYGON_SIMPLIFY_TOLERANCE_M)
+                item = {"polygon": raw, "detect": True}
+                key = roof_result_cache.make_key(version, polygon)[0]
+            else:
+                item = {"lat": float(raw["lat"]), "lng": float(raw["lng"])}
+                if not (math.isfinite(item["lat"]) and math.isfinite(item["lng"])):
+                    raise ValueError("座標需為有限數值")
+                key = roof_result_cache.make_key(version, None, item["lat"], item["lng"])[0]
+        except (PolygonError, KeyError, TypeError, ValueError):
+            rejected += 1
+            continue
+        if roof_result_cache.get(key) is not None:
+            skipped += 1
+            continue
+        try:
+            job, _ = roof_jobs.submit(item, priority=ROOF_JOB_WARM_PRIORITY)
+        except QueueFull:
+            rejected += 1
+            continue
+        queued.append(job.id)
+    return jsonify({"queued": queued, "already_cached": skipped, "rejected": rejected}), 202
+
+@sock.route("/api/roof-detect/ws", bp=bp)
+def roof_outline_ws(ws):
+    """
+    屋頂輪廓即時編輯：前端傳送頂點 reset/insert/move/delete 訊息，
+    伺服器維護多邊形並增量更新面積，每筆訊息回傳 {"area", "signed_area", "vertices"}
+    """
+    outline = RoofOutlineSession()
+    while True:
+        raw = ws.receive()
+        if raw is None:
+            break
+        try:
+            outline.apply(json.loads(raw))
+            reply = outline.state()
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            reply = {"error": str(e), **outline.state()}
+        ws.send(json.dumps(reply, ensure_ascii=False))
+
+# 串流批次每次計算的 Feature 數
+GEOJSON_STREAM_CHUNK = int(os.environ.get("GEOJSON_STREAM_CHUNK", "1000"))
+
+def _feature_collection_features(data):
+    if not isinstance(data, dict) or data.get("type") != "FeatureCollection":
+        return None
+    features = data.get("features")
+    return features if isinstance(features, list) else None
+
+@bp.route("/api/roof-area/batch", methods=["POST"])
+def roof_area_batch():
+    """接收 GeoJSON FeatureCollection，回傳每個 Feature 的面積（平方米）"""
+    features = _feature_collection_features(request.get_json(silent=True))
+    if features is None:
+        return jsonify({"error": "請提供 GeoJSON FeatureCollection"}), 400
+    results = feature_areas(features)
+    total = round(sum(r.get("area", 0) for r in results), 2)
+    return jsonify({"features": results, "total_area": total})
+
+@bp.route("/api/roof-area/batch/stream", methods=["POST"])
+def roof_area_batch_stream():
+    """
+    串流版本，回傳 NDJSON（每行一個 {"id", "area"}）
+    請求可為 GeoJSON FeatureCollection，或每行一個 Feature 的 GeoJSONSeq / NDJSON
+    """
+    if request.mimetype in ("application/geo+json-seq", "application/x-ndjson"):
+        features = _iter_feature_lines(request.stream)
+    else:
+        features = _feature_collection_features(request.get_json(silent=True))
+        if features is None:
+            return jsonify({"error": "請提供 GeoJSON FeatureCollection"}), 400
+
+    def generate():
+        chunk = []
+        for feature in features:
+            chunk.append(feature)
+            if len(chunk) >= GEOJSON_STREAM_CHUNK:
+                yield from _ndjson_lines(feature_areas(chunk))
+                chunk = []
+        if chunk:
+            yield from _ndjson_lines(feature_areas(chunk))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def _iter_feature_lines(stream):
+    for line in stream:
+        # GeoJSONSeq 每行開頭可能有 RS（0x1e）分隔字元
+        line = line.strip().lstrip(b"\x1e")
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {"geometry": None}
+
+def _ndjson_lines(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
 
-@app.route("/", defaults={"path": ""})
-@app.route("/<path:path>")
+def service_stats():
+    """本服務的元件狀態，由 /api/metrics 輸出"""
+    return {
+        "imagery_cache": imagery_cache.stats(),
+        "roof_jobs": roof_jobs.stats(),
+        "roof_result_cache": roof_result_cache.stats(),
+        "roof_detect_admission": roof_admission.stats(),
+    }
+
+
+@bp.route("/", defaults={"path": ""})
+@bp.route("/<path:path>")
 def serve_frontend(path):
-    file_path = os.path.join(app.static_folder, path)
+    file_path = os.path.join(STATIC_DIR, path)
     if path != "" and os.path.exists(file_path):
-        return send_from_directory(app.static_folder, path)
-    return send_from_directory(app.static_folder, "index.html")
+        return send_from_directory(STATIC_DIR, path)
+    return send_from_directory(STATIC_DIR, "index.html")
+
+def init_app(app):
+    """把屋頂辨識服務掛到 app"""
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY", "your-secret-key")
+    app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", "dev-secret")
+    JWTManager(app)
+    oauth.init_app(app)
+    app.register_blueprint(bp)
+
+# 獨立部署用的 app（python run.py）
+app = Flask(__name__, static_folder="static")
+CORS(app, resources={r"/*": {"origins": "*"}})
+init_app(app)
+register_metrics_route(app, [service_stats])
+register_probe_routes(app)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    serve(app, 8080, prefix="BACKEND_")
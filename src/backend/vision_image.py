@@ -0,0 +1,113 @@
+# 送進 Gemini Vision 前的影像前處理：
+# 依多邊形外接矩形（加邊界）裁切、縮小並重新編碼為 JPEG/WebP，
+# 並以串流方式把 base64 內容寫進 JSON 請求本文，不產生整張圖的字串副本
+import base64
+import contextlib
+import io
+import json
+
+from PIL import Image
+
+from imagery_cache import latlng_to_world_px
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# 裁切後的最小邊長（像素），避免極小屋頂失去周邊脈絡
+MIN_CROP_PX = 96
+# base64 分段編碼的原始位元組數，需為 3 的倍數
+B64_CHUNK = 3 * 16 * 1024
+
+
+def polygon_pixel_bbox(polygon, center_lat, center_lng, zoom, width, height, scale=1):
+    """多邊形在 Static Maps 圖片中的像素外接矩形 (left, top, right, bottom)"""
+    cx, cy = latlng_to_world_px(center_lat, center_lng, zoom)
+    xs, ys = [], []
+    for p in polygon:
+        x, y = latlng_to_world_px(p["lat"], p["lng"], zoom)
+        xs.append((x - cx) * scale + width / 2)
+        ys.append((y - cy) * scale + height / 2)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _crop_box(bbox, margin_px, width, height):
+    left, top, right, bottom = bbox
+    left, top = left - margin_px, top - margin_px
+    right, bottom = right + margin_px, bottom + margin_px
+    # 不足最小邊長時由中心向外擴張
+    w, h = right - left, bottom - top
+    if w < MIN_CROP_PX:
+        left -= (MIN_CROP_PX - w) / 2
+        right = left + MIN_CROP_PX
+    if h < MIN_CROP_PX:
+        top -= (MIN_CROP_PX - h) / 2
+        bottom = top + MIN_CROP_PX
+    box = (
+        max(0, int(left)),
+        max(0, int(top)),
+        min(width, int(right + 0.999)),
+        min(height, int(bottom + 0.999)),
+    )
+    if box[2] - box[0] < 2 or box[3] - box[1] < 2:
+        return None
+    return box
+
+
+def prepare_vision_image(content, center_lat=None, center_lng=None, zoom=None, polygon=None,
+                         max_px=512, image_format="JPEG", quality=85, margin_px=32, scale=1):
+    """
+    content 可為圖片 bytes 或已拼接好的 PIL Image
+    回傳 (編碼後 bytes, mimeType)
+    有多邊形時先裁切到外接矩形加 margin_px，再縮到長邊不超過 max_px
+    """
+    image_format = image_format.upper()
+    # 傳入的 PIL Image 由呼叫端負責關閉
+    if isinstance(content, Image.Image):
+        opened = contextlib.nullcontext(content)
+    else:
+        opened = Image.open(io.BytesIO(content))
+    with opened as image:
+        image.load()
+        if polygon and center_lat is not None:
+            bbox = polygon_pixel_bbox(polygon, center_lat, center_lng, zoom, image.width, image.height, scale)
+            box = _crop_box(bbox, margin_px, image.width, image.height)
+            if box is not None:
+                image = image.crop(box)
+        if max(image.size) > max_px:
+            image.thumbnail((max_px, max_px), Image.LANCZOS)
+        if image_format in ("JPEG", "WEBP") and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        out = io.BytesIO()
+        save_kwargs = {"quality": quality} if image_format in ("JPEG", "WEBP") else {}
+        image.save(out, format=image_format, **save_kwargs)
+    return out.getbuffer(), MIME_TYPES[image_format]
+
+
+class StreamingVisionBody:
+    """
+    Gemini generateContent 的 JSON 請求本文，逐段輸出：
+    前綴 JSON、分段 base64 的圖片、結尾 JSON
+    提供 __len__ 讓 HTTP 用戶端送出 Content-Length 而非 chunked 編碼；
+    可同步迭代（requests）或非同步迭代（aiohttp）
+    """
+
+    def __init__(self, prompt, image, mime_type):
+        self.image = memoryview(image)
+        self.prefix = (
+            '{"contents":[{"parts":[{"text":' + json.dumps(prompt, ensure_ascii=False)
+            + '},{"inlineData":{"mimeType":' + json.dumps(mime_type) + ',"data":"'
+        ).encode("utf-8")
+        self.suffix = b'"}}]}]}'
+
+    def __len__(self):
+        b64_len = 4 * ((len(self.image) + 2) // 3)
+        return len(self.prefix) + b64_len + len(self.suffix)
+
+    def __iter__(self):
+        yield self.prefix
+        for start in range(0, len(self.image), B64_CHUNK):
+            yield base64.b64encode(self.image[start:start + B64_CHUNK])
+        yield self.suffix
+
+    async def __aiter__(self):
+        for chunk in self:
+            yield chunk
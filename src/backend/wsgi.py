@@ -0,0 +1,13 @@
+# 合併部署：屋頂辨識與推薦服務在同一個行程，共用連線池、快取與指標
+# python wsgi.py（SERVER_MODE=production 時為 gunicorn 多行程），APP_SERVICES 選擇要掛載的服務
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app import create_app
+from common.server import serve
+
+app = create_app()
+
+if __name__ == "__main__":
+    serve(app, int(os.environ.get("PORT", "8080")), prefix="BACKEND_")
@@ -0,0 +1 @@
+# 兩個後端（src/backend、src/dsa_backend）共用的基礎元件
@@ -0,0 +1,399 @@
+# 昂貴端點的准入控制（token bucket）
+# 每個端點各有一組預算：全域 bucket 控制整體速率，每個用戶端另有自己的 bucket，避免單一來源吃光預算
+# 全域 token 不足時可預支（排隊），預支量即排隊長度：超過 max_queue、或預估等待超過 max_wait
+# （或請求剩餘期限）時立即拒絕，回傳 429 與 Retry-After，不讓請求排在慢速的 Gemini 呼叫後面一起逾時
+# bucket 狀態存於共用的 SQLite（ADMISSION_STORE_PATH），同一台主機上的所有 worker 行程與 asyncio 服務共用同一份預算；
+# 設為空字串時改為每個行程各自計算（整體速率為行程數 × rate）
+import asyncio
+import ipaddress
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from common.metrics import metrics as default_metrics
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now, max_debt=0):
+        """取一個 token；不足時最多預支 max_debt 個，回傳需等待的秒數，超過預支上限時回傳 None"""
+        self._refill(now)
+        if self.tokens - 1 < -max_debt:
+            return None
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def wait_for(self, tokens_needed):
+        """bucket 累積到 tokens_needed 個 token 所需秒數"""
+        return max(0.0, (tokens_needed - self.tokens) / self.rate)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class BucketStore:
+    """
+    跨行程共用的 bucket 狀態（SQLite），每列為一個端點的全域 bucket（client 為空字串）或一個用戶端的 bucket
+    每次預約在一個 BEGIN IMMEDIATE 交易內讀出、更新並寫回，多個行程同時預約時依序進行
+    單次交易約 0.05 ms，整台主機合計上限約每秒萬次決策（src/backend/bench_admission.py），
+    遠高於這些端點的預算（每秒數次到數十次 Gemini 呼叫）；每個決策都需要最新的共用狀態（排隊長度、用戶端額度），
+    因此不在本機批次預留 token
+    """
+
+    # 每隔多少次預約清除已回滿（等同新用戶端）的用戶端 bucket
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ops = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS admission_buckets ("
+            " endpoint TEXT NOT NULL, client TEXT NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL,"
+            " full_at REAL NOT NULL, PRIMARY KEY (endpoint, client))"
+        )
+        conn.commit()
+        conn.close()
+
+    def _conn(self):
+        # sqlite 連線不可跨執行緒或跨 fork 共用，每個執行緒（行程）各自開啟；交易由 apply 自行控制
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _load(conn, endpoint, client, rate, burst, now):
+        bucket = TokenBucket(rate, burst, now)
+        row = conn.execute(
+            "SELECT tokens, updated FROM admission_buckets WHERE endpoint = ? AND client = ?", (endpoint, client)
+        ).fetchone()
+        if row is not None:
+            bucket.tokens, bucket.updated = row[0], min(row[1], now)
+        return bucket
+
+    @staticmethod
+    def _save(conn, endpoint, client, bucket):
+        full_at = bucket.updated + max(0.0, bucket.burst - bucket.tokens) / bucket.rate
+        conn.execute(
+            "INSERT OR REPLACE INTO admission_buckets (endpoint, client, tokens, updated, full_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (endpoint, client, bucket.tokens, bucket.updated, full_at),
+        )
+
+    def apply(self, endpoint, global_spec, client_id, client_spec, clock, fn):
+        """
+        讀出全域與用戶端 bucket（client_id 為 None 時只有全域），執行 fn(now, bucket, client) 後寫回
+        fn 拋出例外（如 Shed）時仍寫回 fn 已做的更新
+        現在時間在取得寫入鎖之後才讀取，不會早於其他行程寫入的 updated（否則同一段時間會重複回補）
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = clock()
+            bucket = self._load(conn, endpoint, "", *global_spec, now)
+            client = None if client_id is None else self._load(conn, endpoint, client_id, *client_spec, now)
+            try:
+                return fn(now, bucket, client)
+            finally:
+                self._save(conn, endpoint, "", bucket)
+                if client is not None:
+                    self._save(conn, endpoint, client_id, client)
+                self._ops += 1
+                if self._ops % self.PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM admission_buckets WHERE client != '' AND full_at < ?", (now,))
+                conn.execute("COMMIT")
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def client_count(self, endpoint, now):
+        """尚未回滿的用戶端 bucket 數"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM admission_buckets WHERE endpoint = ? AND client != '' AND full_at >= ?",
+            (endpoint, now),
+        ).fetchone()[0]
+
+
+class Shed(Exception):
+    """請求被拒絕；retry_after 為建議的重試秒數"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, name, rate, burst, client_rate, client_burst, max_queue=20, max_wait=5.0,
+                 max_clients=10000, metrics=None, clock=None, store=None):
+        """store 為選用的 BucketStore，多個行程共用同一份預算；共用時以系統時間計算 token 回補"""
+        self.name = name
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_clients = max_clients
+        self.metrics = metrics or default_metrics
+        self.store = store
+        self.clock = clock or (time.time if store is not None else time.monotonic)
+        self._bucket = TokenBucket(rate, burst, self.clock())
+        self._clients = OrderedDict()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def _client_bucket(self, client_id, now):
+        bucket = self._clients.get(client_id)
+        if bucket is None:
+            bucket = self._clients[client_id] = TokenBucket(self.client_rate, self.client_burst, now)
+            # 用戶端過多時移除最久未使用、且 bucket 已回滿（等同新用戶端）的項目
+            while len(self._clients) > self.max_clients:
+                oldest_id, oldest = next(iter(self._clients.items()))
+                if oldest_id == client_id or not oldest.is_full(now):
+                    break
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(client_id)
+        return bucket
+
+    def _apply(self, client_id, fn):
+        """
+        以 (現在時間, 全域 bucket, 用戶端 bucket) 執行 fn 並回傳結果；client_id 為 None 時用戶端 bucket 為 None
+        有 store 時使用共用狀態，無法存取時改用本行程的 bucket
+        """
+        with self._lock:
+            if self.store is not None:
+                try:
+                    return self.store.apply(
+                        self.name,
+                        (self._bucket.rate, self._bucket.burst),
+                        client_id,
+                        (self.client_rate, self.client_burst),
+                        self.clock,
+                        fn,
+                    )
+                except sqlite3.Error as e:
+                    print("准入狀態讀寫失敗，改用本行程的預算：", e)
+            now = self.clock()
+            client = None if client_id is None else self._client_bucket(client_id, now)
+            return fn(now, self._bucket, client)
+
+    def reserve(self, client_id, deadline_seconds=None):
+        """預約一個名額，回傳需等待的秒數；應拒絕時拋出 Shed"""
+        max_wait = self.max_wait if deadline_seconds is None else min(self.max_wait, deadline_seconds)
+
+        def take(now, bucket, client):
+            if client.reserve(now) is None:
+                raise self._shed("client", client.wait_for(1))
+            wait = bucket.reserve(now, max_debt=self.max_queue)
+            if wait is None:
+                client.refund()
+                raise self._shed("queue_full", bucket.wait_for(1 - self.max_queue))
+            if wait > max_wait:
+                client.refund()
+                bucket.refund()
+                raise self._shed("deadline", wait)
+            return wait
+
+        wait = self._apply(client_id, take)
+        self.metrics.incr("admission_admitted_total", endpoint=self.name)
+        self.metrics.observe("admission_wait_seconds", wait, endpoint=self.name)
+        return wait
+
+    def admit_client(self, client_id):
+        """只扣用戶端 bucket（背景工作送出時），超量時拋出 Shed；全域預算在工作執行時由 admit_background 取得"""
+
+        def take(now, bucket, client):
+            if client.reserve(now) is None:
+                raise self._shed("client", client.wait_for(1))
+
+        self._apply(client_id, take)
+
+    def admit_background(self):
+        """
+        背景工作：全域 bucket 有剩餘 token 時才取用（不預支），token 被排隊中的即時請求預支時等待回補，
+        讓即時請求優先；背景工作與即時請求共用同一個對外呼叫速率上限
+        """
+
+        def take(now, bucket, client):
+            if bucket.reserve(now, max_debt=0) is not None:
+                return None
+            return bucket.wait_for(1)
+
+        start = time.monotonic()
+        retry = self._apply(None, take)
+        if retry is not None:
+            self._waiting_add(1)
+            try:
+                while retry is not None:
+                    time.sleep(max(retry, 0.05))
+                    retry = self._apply(None, take)
+            finally:
+                self._waiting_add(-1)
+        self.metrics.incr("admission_background_admitted_total", endpoint=self.name)
+        self.metrics.observe("admission_background_wait_seconds", time.monotonic() - start, endpoint=self.name)
+
+    def _shed(self, reason, retry_after):
+        self.metrics.incr("admission_shed_total", endpoint=self.name, reason=reason)
+        return Shed(reason, retry_after)
+
+    def _waiting_add(self, delta):
+        with self._lock:
+            self._waiting += delta
+            waiting = self._waiting
+        self.metrics.gauge_set("admission_waiting", waiting, endpoint=self.name)
+
+    def admit(self, client_id, deadline_seconds=None):
+        """同步版本：需排隊時在此等待；應拒絕時拋出 Shed"""
+        wait = self.reserve(client_id, deadline_seconds)
+        if wait > 0:
+            self._waiting_add(1)
+            try:
+                time.sleep(wait)
+            finally:
+                self._waiting_add(-1)
+
+    async def admit_async(self, client_id, deadline_seconds=None):
+        """asyncio 版本：排隊時不佔用執行緒；共用狀態的 SQLite 交易在執行緒池進行，不阻塞事件迴圈"""
+        if self.store is not None:
+            wait = await asyncio.get_running_loop().run_in_executor(None, self.reserve, client_id, deadline_seconds)
+        else:
+            wait = self.reserve(client_id, deadline_seconds)
+        if wait > 0:
+            self._waiting_add(1)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._waiting_add(-1)
+
+    def stats(self):
+        def snapshot(now, bucket, client):
+            bucket._refill(now)
+            if self.store is not None:
+                clients = self.store.client_count(self.name, now)
+            else:
+                clients = len(self._clients)
+            return round(bucket.tokens, 2), clients
+
+        tokens, clients = self._apply(None, snapshot)
+        return {
+            "rate": self._bucket.rate,
+            "burst": self._bucket.burst,
+            "tokens": tokens,
+            "client_rate": self.client_rate,
+            "client_burst": self.client_burst,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "waiting": self._waiting,
+            "clients": clients,
+            "shared": self.store is not None,
+        }
+
+
+# 共用 bucket 狀態的 SQLite 路徑，預設與屋頂服務的其他共用狀態放在一起；空字串為每個行程各自計算
+ADMISSION_STORE_PATH = os.environ.get(
+    "ADMISSION_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "cache", "admission.sqlite3"),
+)
+_stores = {}
+
+
+def shared_store(path=None):
+    """同一路徑在行程內共用一個 BucketStore；未設定路徑或無法建立時回傳 None（每個行程各自計算）"""
+    path = ADMISSION_STORE_PATH if path is None else path
+    if not path:
+        return None
+    if path not in _stores:
+        try:
+            _stores[path] = BucketStore(path)
+        except (OSError, sqlite3.Error) as e:
+            print("無法建立共用的准入狀態，改為每個行程各自計算：", e)
+            _stores[path] = None
+    return _stores[path]
+
+
+def admission_from_env(name, prefix, rate, burst, client_rate, client_burst, max_queue, max_wait):
+    """
+    依環境變數 <prefix>_RATE、_BURST、_CLIENT_RATE、_CLIENT_BURST、_MAX_QUEUE、_MAX_WAIT 建立，未設定時用預設值
+    bucket 狀態存於 ADMISSION_STORE_PATH，所有行程共用
+    """
+
+    def setting(key, default):
+        return float(os.environ.get(f"{prefix}_{key}", default))
+
+    return AdmissionController(
+        name,
+        rate=setting("RATE", rate),
+        burst=setting("BURST", burst),
+        client_rate=setting("CLIENT_RATE", client_rate),
+        client_burst=setting("CLIENT_BURST", client_burst),
+        max_queue=int(setting("MAX_QUEUE", max_queue)),
+        max_wait=setting("MAX_WAIT", max_wait),
+        store=shared_store(),
+    )
+
+
+# 可信任的反向代理（逗號分隔的位址或網段）：只有來自這些位址的連線才採用 X-Real-IP / X-Forwarded-For，
+# 直接連到服務埠口的用戶端無法以標頭冒用其他位址
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.environ.get("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+    if p.strip()
+]
+
+
+def is_trusted_proxy(addr):
+    try:
+        ip = ipaddress.ip_address((addr or "").strip())
+    except ValueError:
+        return False
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_id(headers, remote_addr):
+    """
+    用戶端識別：連線來自可信任的代理（TRUSTED_PROXIES）時，採用 nginx 設定的 X-Real-IP，
+    其次為 X-Forwarded-For 由右往左第一個不是可信任代理的位址；其餘情況為連線位址
+    """
+    if not is_trusted_proxy(remote_addr):
+        return remote_addr or "unknown"
+    real_ip = headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip.strip()
+    forwarded = [hop.strip() for hop in (headers.get("X-Forwarded-For") or "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        if not is_trusted_proxy(hop):
+            return hop
+    if forwarded:
+        return forwarded[0]
+    return remote_addr or "unknown"
+
+
+def shed_body(shed):
+    """拒絕時的回應本文與標頭"""
+    retry_after = max(1, math.ceil(shed.retry_after))
+    body = {"error": "請求過多，請稍後再試", "reason": shed.reason, "retry_after": retry_after}
+    return body, {"Retry-After": str(retry_after)}
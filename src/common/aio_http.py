@@ -0,0 +1,105 @@
+# 非同步的對外 HTTP 連線池（aiohttp），供 asyncio 服務使用
+# 與 http_pool.HTTPPool 相同：每個行程共用 keep-alive 連線並記錄相同名稱的指標；
+# 等待回應時不佔用執行緒，同時進行的請求數只受 AIO_HTTP_LIMIT 限制
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from common.deadline import DeadlineExceeded
+from common.metrics import metrics as default_metrics
+
+
+class AsyncResponse:
+    """已讀完本文的回應，介面同 requests.Response 常用的部分"""
+
+    def __init__(self, status_code, content, encoding="utf-8"):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHTTPPool:
+    def __init__(self, limit=500, connect_timeout=3.05, read_timeout=30.0, metrics=None):
+        self.limit = limit
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.metrics = metrics or default_metrics
+        self._session = None
+        self._in_flight = {}
+
+    async def start(self):
+        """在事件迴圈內建立 session（aiohttp 的 session 綁定建立時的事件迴圈）"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method, url, timeout=None, deadline=None, **kwargs):
+        """deadline 同 HTTPPool.request：整個請求不超過剩餘時間，因期限而逾時時拋出 DeadlineExceeded"""
+        await self.start()
+        host = urlsplit(url).netloc
+        if deadline is not None:
+            try:
+                connect_timeout, _ = deadline.timeout(self.connect_timeout, self.read_timeout)
+            except DeadlineExceeded as e:
+                self.metrics.incr("http_deadline_exceeded_total", host=host, reason=e.reason)
+                raise
+            kwargs["timeout"] = aiohttp.ClientTimeout(
+                total=deadline.remaining(), sock_connect=connect_timeout, sock_read=self.read_timeout
+            )
+        elif timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        in_flight = self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        self.metrics.gauge_set("http_pool_in_flight", in_flight, host=host, client="aiohttp")
+
+        start = time.monotonic()
+        try:
+            async with self._session.request(method, url, **kwargs) as resp:
+                content = await resp.read()
+                response = AsyncResponse(resp.status, content, resp.get_encoding() if content else "utf-8")
+        except Exception as e:
+            self.metrics.incr("http_request_errors_total", host=host)
+            if deadline is not None and deadline.expired():
+                self.metrics.incr("http_deadline_exceeded_total", host=host, reason="deadline")
+                raise DeadlineExceeded("deadline") from e
+            raise
+        finally:
+            self._in_flight[host] -= 1
+            self.metrics.gauge_set("http_pool_in_flight", self._in_flight[host], host=host, client="aiohttp")
+            self.metrics.observe("http_request_seconds", time.monotonic() - start, host=host)
+        self.metrics.incr("http_requests_total", host=host, status=response.status_code)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self):
+        return {"limit": self.limit, "client": "aiohttp", "hosts": dict(self._in_flight)}
+
+
+def create_async_http_pool():
+    """依環境變數建立；每個事件迴圈（服務行程）一個"""
+    return AsyncHTTPPool(
+        limit=int(os.environ.get("AIO_HTTP_LIMIT", "500")),
+        connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05")),
+        read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", "30")),
+    )
@@ -0,0 +1,75 @@
+# 請求期限：每個請求一個 Deadline，傳給所有對外呼叫，以剩餘時間作為逾時
+# 期限由用戶端以 X-Request-Timeout-Ms（剩餘毫秒數，相對時間不受時鐘誤差影響）指定，只能縮短端點預設值
+# is_cancelled 回傳 True（用戶端已斷線）時視同期限已到，尚未開始的工作不再執行
+import socket
+import time
+
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+
+class DeadlineExceeded(Exception):
+    """期限已到（reason="deadline"）或用戶端已離開（reason="cancelled"）"""
+
+    def __init__(self, reason="deadline"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    def __init__(self, seconds, is_cancelled=None, clock=time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.expires_at = clock() + seconds
+        self.is_cancelled = is_cancelled
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self.clock())
+
+    def expired(self):
+        return self.clock() >= self.expires_at
+
+    @property
+    def cancelled(self):
+        return self.is_cancelled is not None and self.is_cancelled()
+
+    def check(self):
+        """期限已到或用戶端已離開時拋出 DeadlineExceeded"""
+        if self.cancelled:
+            raise DeadlineExceeded("cancelled")
+        if self.expired():
+            raise DeadlineExceeded("deadline")
+
+    def timeout(self, connect_timeout, read_timeout):
+        """(連線, 讀取) 逾時，各自不超過剩餘時間"""
+        self.check()
+        remaining = self.remaining()
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+
+def request_deadline(headers, default_seconds, is_cancelled=None):
+    """依請求標頭建立期限；標頭缺少或格式錯誤時使用端點預設值"""
+    seconds = default_seconds
+    value = headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            seconds = min(default_seconds, max(0.0, float(value) / 1000))
+        except ValueError:
+            pass
+    return Deadline(seconds, is_cancelled)
+
+
+def client_gone(environ):
+    """
+    WSGI 請求的用戶端是否已斷線：對連線 socket 做非阻塞 peek，讀到 EOF 表示對方已關閉
+    gunicorn 與 werkzeug 開發伺服器會在 environ 提供 socket，其他伺服器一律視為未斷線
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except (BlockingIOError, InterruptedError, ValueError):
+        # ValueError：TLS socket 不支援 flags，無法判斷
+        return False
+    except OSError:
+        return True
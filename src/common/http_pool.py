@@ -0,0 +1,180 @@
+# 共用的對外 HTTP 連線池
+# 每個 host 一個 keep-alive session，重複使用 TCP/TLS 連線，並記錄連線池飽和等指標
+# 設定 HTTP_POOL_HTTP2=1 且已安裝 httpx[http2] 時改用 HTTP/2
+# 帶 deadline 的請求在 watchdog 執行緒送出，呼叫端最多等到期限（用戶端離開時提早結束）：
+# requests/httpx 的逾時只限制連線與每次讀取，回應緩慢滴入時整體時間可能遠超過期限
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common.deadline import DeadlineExceeded
+from common.metrics import metrics as default_metrics
+
+try:
+    import httpx
+except ImportError:  # 選用套件
+    httpx = None
+
+
+# 等待 watchdog 執行緒時檢查用戶端是否離開的間隔（秒）
+WATCHDOG_POLL_SECONDS = 0.25
+
+
+class HTTPPool:
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=30.0, http2=False, metrics=None):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.metrics = metrics or default_metrics
+        self.http2 = http2 and httpx is not None
+        if http2 and httpx is None:
+            print("未安裝 httpx，HTTP/2 停用，改用 requests 連線池")
+        self._clients = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def _new_client(self):
+        if self.http2:
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+        session = requests.Session()
+        # pool_block=True：連線用盡時等待，而不是另開無法重用的連線
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _client(self, host):
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = self._clients[host] = self._new_client()
+                self._in_flight[host] = 0
+            return client
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if self.http2:
+            if isinstance(timeout, tuple):
+                return httpx.Timeout(timeout[1], connect=timeout[0])
+            return httpx.Timeout(timeout)
+        return timeout
+
+    def _watchdog_executor(self):
+        # 第一次使用時才建立執行緒，多行程模式下不會在 fork 前啟動
+        with self._lock:
+            if self._watchdog is None:
+                self._watchdog = ThreadPoolExecutor(
+                    max_workers=max(32, 4 * self.pool_size), thread_name_prefix="http-deadline"
+                )
+            return self._watchdog
+
+    def request(self, method, url, timeout=None, deadline=None, **kwargs):
+        """
+        deadline（common.deadline.Deadline）：整個請求（含讀取回應本文）不超過剩餘時間，期限已到時不送出請求；
+        期限到或用戶端離開時拋出 DeadlineExceeded，背景中的請求以各自的連線/讀取逾時結束
+        """
+        host = urlsplit(url).netloc
+        if deadline is None:
+            return self._send(host, method, url, timeout, None, kwargs)
+        try:
+            deadline.check()
+        except DeadlineExceeded as e:
+            self.metrics.incr("http_deadline_exceeded_total", host=host, reason=e.reason)
+            raise
+        future = self._watchdog_executor().submit(self._send, host, method, url, timeout, deadline, kwargs)
+        while True:
+            try:
+                return future.result(timeout=min(WATCHDOG_POLL_SECONDS, deadline.remaining()))
+            except FutureTimeout:
+                pass
+            reason = "cancelled" if deadline.cancelled else "deadline" if deadline.expired() else None
+            if reason is not None:
+                # 尚未開始的請求直接取消；已送出的在背景完成後捨棄
+                future.cancel()
+                self.metrics.incr("http_deadline_exceeded_total", host=host, reason=reason)
+                raise DeadlineExceeded(reason)
+
+    def _send(self, host, method, url, timeout, deadline, kwargs):
+        if deadline is not None:
+            # 在 watchdog 執行緒排隊期間期限可能已到
+            try:
+                timeout = deadline.timeout(self.connect_timeout, self.read_timeout)
+            except DeadlineExceeded as e:
+                self.metrics.incr("http_deadline_exceeded_total", host=host, reason=e.reason)
+                raise
+        client = self._client(host)
+        if self.http2 and "data" in kwargs and not isinstance(kwargs["data"], dict):
+            # httpx 以 content 傳送原始位元組或可迭代的串流本文
+            kwargs["content"] = kwargs.pop("data")
+
+        with self._lock:
+            self._in_flight[host] += 1
+            in_flight = self._in_flight[host]
+            self.metrics.gauge_set("http_pool_in_flight", in_flight, host=host)
+        if in_flight > self.pool_size:
+            # 同時請求數超過連線池大小，需排隊等待連線
+            self.metrics.incr("http_pool_saturated_total", host=host)
+
+        start = time.monotonic()
+        try:
+            resp = client.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        except Exception as e:
+            self.metrics.incr("http_request_errors_total", host=host)
+            if deadline is not None and deadline.expired():
+                self.metrics.incr("http_deadline_exceeded_total", host=host, reason="deadline")
+                raise DeadlineExceeded("deadline") from e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight[host] -= 1
+                self.metrics.gauge_set("http_pool_in_flight", self._in_flight[host], host=host)
+            self.metrics.observe("http_request_seconds", time.monotonic() - start, host=host)
+        self.metrics.incr("http_requests_total", host=host, status=resp.status_code)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "http2": self.http2,
+                "hosts": dict(self._in_flight),
+            }
+
+
+_shared_pool = None
+_shared_pid = None
+_shared_lock = threading.Lock()
+
+
+def get_http_pool():
+    """
+    行程內共用的連線池，第一次使用時依環境變數建立（此時 .env 已載入）
+    fork 出的 worker 行程會重新建立，不與父行程共用 socket
+    """
+    global _shared_pool, _shared_pid
+    with _shared_lock:
+        if _shared_pool is None or _shared_pid != os.getpid():
+            _shared_pid = os.getpid()
+            _shared_pool = HTTPPool(
+                pool_size=int(os.environ.get("HTTP_POOL_SIZE", "10")),
+                connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05")),
+                read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", "30")),
+                http2=os.environ.get("HTTP_POOL_HTTP2", "0") == "1",
+            )
+        return _shared_pool
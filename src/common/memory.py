@@ -0,0 +1,64 @@
+# 行程記憶體用量（Linux /proc/<pid>/smaps_rollup）
+# USS（unique）= 只屬於該行程的頁面，也就是多開一個 worker 實際增加的記憶體；
+# PSS 把共用頁面依共用行程數平均分攤；copy-on-write 共用得越好，worker 的 USS 越小
+# 查看 gunicorn 所有 worker：python -m common.memory <master pid>
+import gc
+import os
+import sys
+
+_FIELDS = {
+    "Rss": "rss_bytes",
+    "Pss": "pss_bytes",
+    "Shared_Clean": "shared_bytes",
+    "Shared_Dirty": "shared_bytes",
+    "Private_Clean": "uss_bytes",
+    "Private_Dirty": "uss_bytes",
+}
+
+
+def process_memory(pid="self"):
+    """回傳 {rss_bytes, pss_bytes, uss_bytes, shared_bytes}；非 Linux 或無權限時回傳 None"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    usage = dict.fromkeys(_FIELDS.values(), 0)
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in _FIELDS:
+            usage[_FIELDS[name]] += int(value.split()[0]) * 1024
+    return usage
+
+
+def memory_stats():
+    """本行程的記憶體用量與 gc.freeze 凍結的物件數，供 /api/metrics 輸出"""
+    return {"pid": os.getpid(), **(process_memory() or {}), "gc_frozen_objects": gc.get_freeze_count()}
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def worker_report(master_pid):
+    """master 與各 worker 的記憶體用量"""
+    report = {"master": {"pid": master_pid, **(process_memory(master_pid) or {})}, "workers": []}
+    for pid in child_pids(master_pid):
+        report["workers"].append({"pid": pid, **(process_memory(pid) or {})})
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("用法：python -m common.memory <master pid>")
+    result = worker_report(int(sys.argv[1]))
+    mib = 1024 * 1024
+    for role, entry in [("master", result["master"])] + [("worker", w) for w in result["workers"]]:
+        print(
+            f"{role:<7}{entry['pid']:>8}  RSS {entry.get('rss_bytes', 0) / mib:8.1f} MiB"
+            f"  PSS {entry.get('pss_bytes', 0) / mib:8.1f} MiB  USS {entry.get('uss_bytes', 0) / mib:8.1f} MiB"
+        )
@@ -0,0 +1,54 @@
+# 簡易的行程內指標（counter / gauge / 延遲統計），由各服務的 /api/metrics 輸出
+import threading
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+
+    @staticmethod
+    def _name(name, labels):
+        if not labels:
+            return name
+        label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+        return f"{name}{{{label_str}}}"
+
+    def incr(self, name, value=1, **labels):
+        key = self._name(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name, value, **labels):
+        key = self._name(name, labels)
+        with self._lock:
+            current = self._gauges.get(key, 0) + value
+            self._gauges[key] = current
+            return current
+
+    def gauge_set(self, name, value, **labels):
+        key = self._name(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = self._name(name, labels)
+        with self._lock:
+            stat = self._timings.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+            stat["count"] += 1
+            stat["sum"] += seconds
+            stat["max"] = max(stat["max"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {k: dict(v) for k, v in self._timings.items()},
+            }
+
+
+# 行程內共用的指標實例
+metrics = Metrics()
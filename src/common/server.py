@@ -0,0 +1,133 @@
+# 服務啟動方式
+# SERVER_MODE=development（預設）：Flask 開發伺服器（reloader + debugger），單一行程
+# SERVER_MODE=production：gunicorn pre-fork，多個 worker 行程 × 每個 worker 多個執行緒（gthread），
+#   應用程式在 master 載入後才 fork（preload），設定與唯讀資料以 copy-on-write 共用；
+#   fork 前以 gc.freeze() 把既有物件移出 GC 追蹤，避免 worker 執行 GC 時寫入而複製這些頁面
+#   kill -HUP <master pid>：平順重啟所有 worker（處理中的請求完成後才結束舊 worker）
+#   kill -TERM <master pid>：平順關閉
+import gc
+import multiprocessing
+import os
+import threading
+
+from flask import jsonify
+
+from common.http_pool import get_http_pool
+from common.memory import memory_stats
+from common.metrics import metrics
+from common.warmup import warmup
+
+_shutdown_hooks = []
+_shutdown_lock = threading.Lock()
+
+
+def on_worker_exit(fn):
+    """註冊 worker 行程結束前要執行的函式（例如等待背景工作完成），可當 decorator 使用"""
+    with _shutdown_lock:
+        _shutdown_hooks.append(fn)
+    return fn
+
+
+def run_shutdown_hooks():
+    with _shutdown_lock:
+        hooks = list(_shutdown_hooks)
+    for fn in hooks:
+        try:
+            fn()
+        except Exception as e:
+            print("worker 結束處理失敗：", e)
+
+
+def register_metrics_route(app, stats_providers):
+    """
+    GET /api/metrics：行程內指標、連線池、記憶體，加上各服務 stats_providers() 回傳的元件狀態
+    合併部署時所有服務共用同一個端點
+    """
+    def get_metrics():
+        body = {**metrics.snapshot(), "http_pool": get_http_pool().stats()}
+        for provider in stats_providers:
+            body.update(provider())
+        body["memory"] = memory_stats()
+        return jsonify(body)
+
+    app.add_url_rule("/api/metrics", "metrics", get_metrics)
+
+
+def register_probe_routes(app):
+    """
+    GET /api/health：行程存活即回傳 200（liveness）
+    GET /api/ready：預熱完成才回傳 200，之前回傳 503（readiness），本文為各預熱工作狀態
+    """
+    def health():
+        return jsonify({"status": "ok"})
+
+    def ready():
+        # 未經 serve 啟動（例如直接以 gunicorn 指令載入）時，第一次探測才開始預熱
+        warmup.start()
+        return jsonify(warmup.status()), 200 if warmup.ready else 503
+
+    app.add_url_rule("/api/health", "health", health)
+    app.add_url_rule("/api/ready", "ready", ready)
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def gunicorn_options(port, prefix=""):
+    """
+    由環境變數組出 gunicorn 設定；prefix（如 "BACKEND_"）可為個別服務覆寫，
+    例如 BACKEND_WEB_WORKERS 優先於 WEB_WORKERS
+    """
+
+    def setting(name, default):
+        return _env_int(prefix + name, _env_int(name, default))
+
+    cpus = multiprocessing.cpu_count()
+    return {
+        "bind": f"{os.environ.get('HOST', '0.0.0.0')}:{port}",
+        "workers": setting("WEB_WORKERS", min(2 * cpus + 1, 8)),
+        # 每個 worker 的執行緒數；SSE 與 WebSocket 連線各佔一個執行緒
+        "threads": setting("WEB_THREADS", 8),
+        "worker_class": "gthread",
+        # 處理 N 個請求後回收 worker，jitter 避免所有 worker 同時重啟
+        "max_requests": setting("WEB_MAX_REQUESTS", 2000),
+        "max_requests_jitter": setting("WEB_MAX_REQUESTS_JITTER", 200),
+        "timeout": setting("WEB_TIMEOUT", 120),
+        "graceful_timeout": setting("WEB_GRACEFUL_TIMEOUT", 30),
+        "keepalive": setting("WEB_KEEPALIVE", 5),
+        "preload_app": True,
+        "accesslog": "-",
+        "worker_exit": lambda server, worker: run_shutdown_hooks(),
+    }
+
+
+def serve(app, port, prefix=""):
+    """依 SERVER_MODE 啟動 app"""
+    mode = os.environ.get("SERVER_MODE", "development")
+    if mode == "development":
+        warmup.start()
+        app.run(host=os.environ.get("HOST", "0.0.0.0"), port=port, debug=True)
+        return
+    if mode != "production":
+        raise ValueError(f"SERVER_MODE 必須是 development 或 production：{mode}")
+
+    from gunicorn.app.base import BaseApplication
+
+    # 預熱在 fork 前完成，worker 一啟動即為 ready
+    warmup.run()
+    # 載入階段產生的垃圾先回收，其餘（設定、索引、模組）凍結後由所有 worker 共用
+    gc.collect()
+    gc.freeze()
+
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(port, prefix).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # app 已在 master 行程載入完成，fork 後各 worker 直接沿用
+            return app
+
+    PreforkApplication().run()
@@ -0,0 +1,72 @@
+# 啟動預熱：各服務載入時登記預熱工作（預先計算、填入快取），全部執行完才回報 ready
+# 正式環境（pre-fork）由 common.server.serve 在 master fork 前同步執行，worker 以 copy-on-write 共用結果；
+# 開發模式與 asyncio 服務在背景執行緒執行，完成前 GET /api/ready 回傳 503
+# 預熱失敗不影響正確性（請求照常計算，只是較慢），記錄錯誤後仍視為完成
+import threading
+import time
+
+from common.metrics import metrics as default_metrics
+
+
+class Warmup:
+    def __init__(self, metrics=None):
+        self.metrics = metrics or default_metrics
+        self._tasks = []
+        self._status = {}
+        self._started = False
+        self._done = threading.Event()
+        self._done.set()
+        self._lock = threading.Lock()
+
+    def add(self, name, fn):
+        """登記預熱工作；fn() 的回傳值（可 JSON 序列化）記錄在 status 中"""
+        with self._lock:
+            self._tasks.append((name, fn))
+            self._status[name] = {"state": "pending"}
+            self._started = False
+            self._done.clear()
+
+    def run(self):
+        """依登記順序執行尚未執行的工作"""
+        with self._lock:
+            self._started = True
+            tasks = [(name, fn) for name, fn in self._tasks if self._status[name]["state"] == "pending"]
+            for name, _ in tasks:
+                self._status[name] = {"state": "running"}
+        for name, fn in tasks:
+            start = time.perf_counter()
+            try:
+                detail = fn()
+            except Exception as e:
+                print(f"預熱 {name} 失敗：", e)
+                status = {"state": "failed", "error": str(e)}
+            else:
+                status = {"state": "done", "detail": detail}
+            elapsed = time.perf_counter() - start
+            self.metrics.observe("warmup_seconds", elapsed, task=name)
+            self._status[name] = {**status, "seconds": round(elapsed, 3)}
+        with self._lock:
+            if all(status["state"] in ("done", "failed") for status in self._status.values()):
+                self._done.set()
+
+    def start(self):
+        """在背景執行緒執行；已開始或已完成時不重複執行"""
+        with self._lock:
+            if self._started or self._done.is_set():
+                return
+            self._started = True
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def status(self):
+        return {"ready": self.ready, "tasks": {name: dict(status) for name, status in self._status.items()}}
+
+
+# 行程內共用
+warmup = Warmup()
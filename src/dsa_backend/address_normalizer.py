@@ -0,0 +1,180 @@
+# 地址正規化：從自由輸入的地址判定縣市與鄉鎮市區
+# 縣市、舊縣名、簡稱與鄉鎮市區名稱（含改制前的「市/鎮/鄉」寫法）預先編成 Aho–Corasick 自動機，
+# 一次掃描找出所有候選，再依「縣市全名 > 郵遞區號 > 鄉鎮市區 > 簡稱」決定結果
+# 「臺」統一為「台」以對應 city_to_kwh_day.json 等設定檔的 key
+import re
+from collections import deque
+from functools import lru_cache
+
+# 字元正規化：異體字與全形數字
+_CHAR_MAP = str.maketrans({"臺": "台", **{chr(0xFF10 + i): str(i) for i in range(10)}})
+_POSTAL_RE = re.compile(r"^(\d{3})(?:\d{2,3})?(?!\d)")
+_SPACE_RE = re.compile(r"\s+")
+
+# 比對結果種類的優先順序（數字越小越優先）
+KIND_COUNTY = 0
+KIND_DISTRICT = 1
+KIND_ALIAS = 2
+
+# 2010 年改制前的縣名
+LEGACY_COUNTIES = {
+    "台北縣": "新北市",
+    "桃園縣": "桃園市",
+    "台中縣": "台中市",
+    "台南縣": "台南市",
+    "高雄縣": "高雄市",
+}
+# 沒有「縣/市」的簡稱；新竹、嘉義同時有縣與市，不列入
+COUNTY_ALIASES = {
+    "台北": "台北市", "北市": "台北市", "新北": "新北市", "桃園": "桃園市", "台中": "台中市",
+    "台南": "台南市", "高雄": "高雄市", "基隆": "基隆市", "宜蘭": "宜蘭縣", "苗栗": "苗栗縣",
+    "彰化": "彰化縣", "南投": "南投縣", "雲林": "雲林縣", "屏東": "屏東縣", "花蓮": "花蓮縣",
+    "台東": "台東縣", "澎湖": "澎湖縣", "金門": "金門縣", "馬祖": "連江縣",
+}
+
+
+def normalize_text(address):
+    return _SPACE_RE.sub("", str(address).translate(_CHAR_MAP))
+
+
+class AhoCorasick:
+    def __init__(self, patterns):
+        """patterns: {字串: 值}；search 回傳 (結束位置, 字串, 值) 的列表"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for word, value in patterns.items():
+            node = 0
+            for ch in word:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((word, value))
+
+        # 廣度優先建立失敗連結，並把失敗節點的輸出併入
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for word, value in self._out[node]:
+                matches.append((i + 1, word, value))
+        return matches
+
+
+class AddressNormalizer:
+    def __init__(self, districts, cache_size=4096):
+        """districts: {縣市: {鄉鎮市區: 郵遞區號}}"""
+        self.districts = districts
+        self._postal = {}  # 郵遞區號 -> [(縣市, 鄉鎮市區), ...]
+        patterns = {}
+
+        def add(word, kind, county, district=None):
+            # 同一字串對應多個縣市時（如「東區」「信義區」）全部保留，之後以縣市判斷
+            patterns.setdefault(word, []).append((kind, county, district))
+
+        all_districts = {district for county_districts in districts.values() for district in county_districts}
+        for county, county_districts in districts.items():
+            add(county, KIND_COUNTY, county)
+            for district, postal in county_districts.items():
+                add(district, KIND_DISTRICT, county, district)
+                self._postal.setdefault(postal, []).append((county, district))
+                # 直轄市的區在改制前多為「市/鎮/鄉」，如「板橋市」「鳳山市」；
+                # 與其他縣市現有名稱相同者（如宜蘭縣大同鄉）不加入
+                base = district[:-1]
+                if district.endswith("區") and len(base) >= 2:
+                    for suffix in ("市", "鎮", "鄉"):
+                        if base + suffix not in all_districts:
+                            add(base + suffix, KIND_DISTRICT, county, district)
+        for legacy, county in LEGACY_COUNTIES.items():
+            add(legacy, KIND_COUNTY, county)
+        for alias, county in COUNTY_ALIASES.items():
+            add(alias, KIND_ALIAS, county)
+
+        self._automaton = AhoCorasick(patterns)
+        self._cached = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def normalize(self, address):
+        """
+        回傳 {"city", "district", "postal_code"}，無法判定的欄位為 None
+        相同地址的結果會被快取
+        """
+        if not address:
+            return {"city": None, "district": None, "postal_code": None}
+        return dict(self._cached(normalize_text(address)))
+
+    def normalize_many(self, addresses):
+        return [self.normalize(address) for address in addresses]
+
+    def city(self, address, default=None):
+        return self.normalize(address)["city"] or default
+
+    def _longest_matches(self, text):
+        """由左而右取最長且不重疊的比對"""
+        matches = sorted(self._automaton.search(text), key=lambda m: (m[0] - len(m[1]), -len(m[1])))
+        chosen, covered_until = [], 0
+        for end, word, candidates in matches:
+            if end - len(word) >= covered_until:
+                chosen.append(candidates)
+                covered_until = end
+        return chosen
+
+    def _resolve(self, text):
+        postal_match = _POSTAL_RE.match(text)
+        postal_code = postal_match.group(1) if postal_match else None
+        postal_places = self._postal.get(postal_code, [])
+
+        counties, districts, aliases = [], [], []
+        for candidates in self._longest_matches(text):
+            for kind, county, district in candidates:
+                if kind == KIND_COUNTY:
+                    counties.append(county)
+                elif kind == KIND_DISTRICT:
+                    districts.append((county, district))
+                else:
+                    aliases.append(county)
+
+        # 縣市：全名 > 郵遞區號 > 唯一的鄉鎮市區 > 簡稱
+        city = counties[0] if counties else None
+        if city is None and postal_places:
+            city = postal_places[0][0]
+        if city is None:
+            district_counties = {county for county, _ in districts}
+            if len(district_counties) == 1:
+                city = district_counties.pop()
+        if city is None and aliases:
+            city = aliases[0]
+
+        district = next((d for county, d in districts if county == city), None)
+        if district is None:
+            in_city = [d for county, d in postal_places if county == city]
+            if len(in_city) == 1:
+                district = in_city[0]
+        if postal_code is None and city is not None and district is not None:
+            postal_code = self.districts[city][district]
+        elif postal_code is not None and not any(county == city for county, _ in postal_places):
+            # 郵遞區號與判定的縣市不符時不採用
+            postal_code = None
+        return (("city", city), ("district", district), ("postal_code", postal_code))
+
+    def cache_info(self):
+        info = self._cached.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -1,44 +1,199 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, request, jsonify
 from flask_cors import CORS
+import hashlib
 import json
 import os
 import re
+import sys
+import threading
+import time
+from bisect import bisect_right
 from dotenv import load_dotenv
-import google.generativeai as genai
+from rule_scorer import score_locally
+from llm_hedge import HedgedLLM
+from solar_raster import load_raster
+from county_locator import CountyLocator
+from installation_index import load_installations_csv
+from address_normalizer import AddressNormalizer
+from recommend_cube import RecommendCube
+import numpy as np
 
-app = Flask(__name__)
-CORS(app)
-
-# 初始化配置
-genai.configure(api_key=os.environ.get("GOOGLE_API_KEY", "GOOGLE_API_KEY"))
+# 推薦、LLM 評估與日照/地理查詢的路由都在 bp 上；獨立執行時掛到本檔的 app，
+# 合併部署時由 src/backend/app 的 create_app 與屋頂辨識服務掛到同一個 Flask app
+bp = Blueprint("recommend", __name__)
 
 load_dotenv()
 base_dir = os.path.dirname(__file__)  # 指向 src/dsa_backend
+sys.path.append(os.path.join(os.path.abspath(base_dir), ".."))
+from common.admission import Shed, admission_from_env, client_id, shed_body
+from common.deadline import Deadline, client_gone, request_deadline
+from common.http_pool import get_http_pool
+from common.metrics import metrics
+from common.server import register_metrics_route, register_probe_routes, serve
+from common.warmup import warmup
+
+GEMINI_MODEL = "gemini-2.0-flash"
+# GEMINI_API_BASE 可指向本機替身服務（負載測試用，見 src/backend/bench_aio.py）
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+GEMINI_URL = f"{GEMINI_API_BASE}/v1beta/models/{GEMINI_MODEL}:generateContent"
 config_path = os.path.join(base_dir, "solar_config")
-with open(os.path.join(config_path, "modules.json"), encoding="utf-8") as f:
-    modules = json.load(f)
-with open(os.path.join(config_path, "formulas.json"), encoding="utf-8") as f:
-    formulas = json.load(f)
-with open(os.path.join(config_path, "city_to_kwh_day.json"), encoding="utf-8") as f:
-    city_to_kwh_day = json.load(f)
-with open(os.path.join(config_path, "fit_rate_table.json"), encoding="utf-8") as f:
-    fit_rate_table = json.load(f)
-with open(os.path.join(config_path, "region_bonus.json"), encoding="utf-8") as f:
-    region_bonus = json.load(f)
-
-def get_fit_rate(capacity_kw, efficiency_level, city):
+with open(os.path.join(config_path, "city_stations.json"), encoding="utf-8") as f:
+    city_stations = json.load(f)
+with open(os.path.join(config_path, "districts.json"), encoding="utf-8") as f:
+    districts = json.load(f)
+
+# 推薦計算用的設定檔；每 RECOMMEND_CONFIG_CHECK_SECONDS 秒（0 為不檢查）檢查一次，內容變更時重新載入並預熱
+RECOMMEND_CONFIG_FILES = (
+    "modules.json", "formulas.json", "city_to_kwh_day.json", "fit_rate_table.json", "region_bonus.json",
+)
+RECOMMEND_CONFIG_CHECK_SECONDS = float(os.environ.get("RECOMMEND_CONFIG_CHECK_SECONDS", "30"))
+# LLM 產生的欄位不在此計算
+LLM_FIELDS = ("final_recommendation", "score", "explanation_text")
+# 投資回收試算的年數
+PROJECTION_YEARS = tuple(range(1, 21))
+_PROJECTION_YEARS = np.array(PROJECTION_YEARS, dtype=float)
+
+def recommend_config_fingerprint():
+    """各設定檔的（修改時間, 大小），用來判斷是否需要重新載入"""
+    stats = (os.stat(os.path.join(config_path, name)) for name in RECOMMEND_CONFIG_FILES)
+    return tuple((st.st_mtime_ns, st.st_size) for st in stats)
+
+class RecommendConfig:
+    """
+    推薦計算用的設定，建立後唯讀；重新載入時整組替換，進行中的請求沿用開始時取得的設定
+    公式預先編譯，請求時不再重複解析；躉購費率級距依下限排序，以二分搜尋找出容量所在級距
+    """
+
+    def __init__(self):
+        self.fingerprint = recommend_config_fingerprint()
+        digest = hashlib.sha1()
+        loaded = {}
+        for name in RECOMMEND_CONFIG_FILES:
+            with open(os.path.join(config_path, name), "rb") as f:
+                raw = f.read()
+            digest.update(raw)
+            loaded[name] = json.loads(raw)
+        self.version = digest.hexdigest()[:12]
+        self.modules = loaded["modules.json"]
+        self.formulas = loaded["formulas.json"]
+        self.city_to_kwh_day = loaded["city_to_kwh_day.json"]
+        self.fit_rate_table = loaded["fit_rate_table.json"]
+        self.region_bonus = loaded["region_bonus.json"]
+        self.compiled_formulas = tuple(
+            (field, compile(expr, f"formulas.json:{field}", "eval"))
+            for field, expr in self.formulas.items()
+            if field not in LLM_FIELDS
+        )
+        self.fit_rate_tiers = sorted(self.fit_rate_table, key=lambda tier: tier["min_kw"])
+        self.fit_rate_bounds = [tier["min_kw"] for tier in self.fit_rate_tiers]
+        # 縣市 × 模組 × 費率級距的查表，由 warm() 建立；公式不是分段線性時停用，一律逐條計算
+        # 所有模組都有的欄位才是常數（缺少時公式會取用請求中的同名欄位）
+        module_fields = set.intersection(*(set(mod) for mod in self.modules)) if self.modules else set()
+        self.cube = RecommendCube(
+            self.evaluate, self.compiled_formulas, self.formulas, module_fields, self.fit_rate_table
+        )
+
+    def formula_vars(self, data, mod, roof_area_m2, coverage_rate, address):
+        return {
+            **data,
+            **mod,
+            "roof_area_m2": roof_area_m2,
+            "coverage_rate": coverage_rate,
+            "address": address,
+            "city_to_kwh_day": self.city_to_kwh_day,
+            "get_fit_rate": lambda cap, eff: get_fit_rate(cap, eff, address, self),
+        }
+
+    def evaluate(self, mod, city, roof_area_m2, coverage_rate):
+        """
+        不含請求其他欄位，逐條計算公式，回傳 {欄位: 值}（建立查表時取樣用）
+        需要請求其他欄位而無法計算的欄位不列入
+        """
+        local_vars = self.formula_vars({}, mod, roof_area_m2, coverage_rate, city)
+        values = {}
+        for field, code in self.compiled_formulas:
+            try:
+                values[field] = local_vars[field] = eval(code, {}, local_vars)
+            except Exception:
+                continue
+        return values
+
+    def warm(self):
+        cities = sorted(set(self.city_to_kwh_day) | set(self.region_bonus))
+        return {"version": self.version, **self.cube.build(self.modules, cities)}
+
+# 啟動時（多行程模式為 fork 前）建立，之後唯讀，由所有 worker 共用
+recommend_config = RecommendConfig()
+warmup.add("recommend_cube", lambda: recommend_config.warm())
+_config_checked_at = time.monotonic()
+_config_reload_lock = threading.Lock()
+
+def maybe_reload_recommend_config():
+    """
+    設定檔變更時重新載入並建立查表，完成後才替換；
+    同時間只有一個執行緒重新載入，其餘請求沿用原設定，新設定有誤時也沿用原設定
+    """
+    global recommend_config, _config_checked_at
+    if RECOMMEND_CONFIG_CHECK_SECONDS <= 0 or time.monotonic() - _config_checked_at < RECOMMEND_CONFIG_CHECK_SECONDS:
+        return
+    if not _config_reload_lock.acquire(blocking=False):
+        return
+    try:
+        _config_checked_at = time.monotonic()
+        if recommend_config_fingerprint() == recommend_config.fingerprint:
+            return
+        config = RecommendConfig()
+        detail = config.warm()
+        recommend_config = config
+        metrics.incr("recommend_config_reloads_total")
+        print("推薦設定已重新載入：", detail)
+    except Exception as e:
+        metrics.incr("recommend_config_reload_errors_total")
+        print("推薦設定重新載入失敗，沿用原設定：", e)
+    finally:
+        _config_reload_lock.release()
+
+# 地址正規化（縣市/鄉鎮市區/郵遞區號），相同地址的結果快取在記憶體
+address_normalizer = AddressNormalizer(districts, cache_size=int(os.environ.get("ADDRESS_CACHE_SIZE", "4096")))
+ADDRESS_BATCH_MAX = int(os.environ.get("ADDRESS_BATCH_MAX", "10000"))
+
+# 日照/溫度網格（記憶體對應），不存在時由縣市資料建立
+solar_raster = load_raster(
+    os.environ.get("SOLAR_RASTER_PATH", os.path.join(config_path, "solar_raster.npy")),
+    recommend_config.city_to_kwh_day,
+    city_stations,
+)
+# 縣市界（反向地理編碼），可用 COUNTY_BOUNDARIES_PATH 改用其他縣市界 GeoJSON
+county_locator = CountyLocator.from_geojson(
+    os.environ.get("COUNTY_BOUNDARIES_PATH", os.path.join(config_path, "county_boundaries.geojson"))
+)
+REVERSE_GEOCODE_MAX_POINTS = int(os.environ.get("REVERSE_GEOCODE_MAX_POINTS", "10000"))
+
+# 既有案場資料（CSV），未提供時附近案場查詢回傳 503
+INSTALLATIONS_PATH = os.environ.get("INSTALLATIONS_PATH", os.path.join(config_path, "installations.csv"))
+installation_index = load_installations_csv(INSTALLATIONS_PATH) if os.path.exists(INSTALLATIONS_PATH) else None
+INSTALLATIONS_MAX_RADIUS_KM = float(os.environ.get("INSTALLATIONS_MAX_RADIUS_KM", "100"))
+INSTALLATIONS_MAX_RESULTS = int(os.environ.get("INSTALLATIONS_MAX_RESULTS", "1000"))
+
+# 系統效率（每 kW 每日發電量 → 峰值日照時數）與太陽能潛力 100 分對應的每日每 kW 發電量
+SOLAR_PERFORMANCE_RATIO = 0.8
+SOLAR_POTENTIAL_FULL_KWH = 3.5
+SOLAR_DATA_MAX_POINTS = int(os.environ.get("SOLAR_DATA_MAX_POINTS", "10000"))
+
+def get_fit_rate(capacity_kw, efficiency_level, city, config=None):
+    config = config or recommend_config
     base_rate = None
-    for tier in fit_rate_table:
-        max_kw = tier["max_kw"] if tier["max_kw"] is not None else float("inf")
-        if tier["min_kw"] <= capacity_kw < max_kw:
+    i = bisect_right(config.fit_rate_bounds, capacity_kw) - 1
+    if i >= 0:
+        tier = config.fit_rate_tiers[i]
+        if tier["max_kw"] is None or capacity_kw < tier["max_kw"]:
             if efficiency_level in ["非常高效", "高效"]:
                 base_rate = tier["high_eff"]
             else:
                 base_rate = tier["standard"]
-            break
     if base_rate is None:
         base_rate = 3.5
-    bonus_ratio = region_bonus.get(city, 0)
+    bonus_ratio = config.region_bonus.get(city, 0)
     return round(base_rate * (1 + bonus_ratio), 4)
 
 # JSON 解析工具
@@ -67,7 +222,20 @@ def parse_llm_output(text):
     return {"final_recommendation": "", "score": 0, "explanation_text": "解析失敗"}
 
 # 呼叫 Gemini 產生建議
+# 單次 Gemini LLM 呼叫的期限（秒）：呼叫由 llm_hedge 在背景執行，請求逾時後仍繼續以回填快取，
+# 因此不使用請求的期限，而以此值限制整個呼叫（含讀取回應）
+LLM_CALL_DEADLINE = float(os.environ.get("LLM_CALL_DEADLINE", "20"))
+
 def generate_llm_outputs(summary):
+    # 透過共用連線池呼叫 Gemini REST API，重複使用 keep-alive 連線
+    url, payload = gemini_llm_request(summary)
+    response = get_http_pool().post(url, json=payload, deadline=Deadline(LLM_CALL_DEADLINE))
+    if response.status_code != 200:
+        raise RuntimeError(f"Gemini API 失敗 {response.status_code}: {response.text}")
+    return parse_gemini_llm_response(response.json())
+
+def gemini_llm_request(summary):
+    """Gemini 請求的 (url, JSON 本文)，同步與 asyncio 路徑共用"""
     prompt = f"""
 你是一位太陽能投資顧問。以下是客戶的模擬數據摘要：
 
@@ -85,36 +253,89 @@ def generate_llm_outputs(summary):
   "explanation_text": "..."
 }}
 """
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt)
-    return parse_llm_output(response.text)
+    gemini_api_key = os.environ.get("GOOGLE_API_KEY", "GOOGLE_API_KEY")
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    return f"{GEMINI_URL}?key={gemini_api_key}", payload
+
+def parse_gemini_llm_response(data):
+    text = data["candidates"][0]["content"]["parts"][0]["text"]
+    return parse_llm_output(text)
+
+# LLM 期限對沖：超過期限即回傳本地評分，LLM 回應後回填快取
+llm_hedge = HedgedLLM(
+    llm_fn=generate_llm_outputs,
+    fallback_fn=lambda data: score_locally(data, recommend_config.city_to_kwh_day),
+    deadline_seconds=float(os.environ.get("LLM_DEADLINE_SECONDS", "3.0")),
+    max_workers=int(os.environ.get("LLM_MAX_WORKERS", "8")),
+    cache_size=int(os.environ.get("LLM_CACHE_SIZE", "1024")),
+)
+
+def resolve_city(data):
+    """
+    address 能正規化為縣市時以它為準；否則有 lat/lng 時以縣市界判定所在縣市，
+    仍無法判定時沿用原始 address
+    （內附的縣市界為近似邊界，交界附近可能判錯，不覆寫使用者輸入的地址）
+    """
+    address = data.get("address")
+    city = address_normalizer.city(address)
+    if city is not None:
+        return city
+    if data.get("lat") is not None and data.get("lng") is not None:
+        try:
+            city = county_locator.locate(data["lat"], data["lng"])
+        except (TypeError, ValueError):
+            city = None
+        if city is not None:
+            return city
+    return address
 
-@app.route("/api/recommend", methods=["POST"])
+@bp.route("/api/recommend", methods=["POST"])
 def recommend():
-    data = request.json
+    result, status = recommend_payload(request.json)
+    return jsonify(result), status
+
+def investment_projections(inputs):
+    """
+    各模組逐年累計損益 round(-成本 + 年收入 × 年)，inputs 為 [(成本, 年收入), ...]
+    所有模組一次以陣列計算（四捨五入同為取偶）；有非有限值或超出整數精確範圍時逐一計算
+    """
+    values = np.array(inputs, dtype=float).reshape(-1, 2)
+    projections = -values[:, :1] + values[:, 1:] * _PROJECTION_YEARS
+    if np.all(np.abs(projections) < 2.0 ** 53):
+        return np.rint(projections).astype(np.int64).tolist()
+    return [[round(-cost + revenue * y) for y in PROJECTION_YEARS] for cost, revenue in inputs]
+
+def recommend_payload(data):
+    """
+    推薦主流程，回傳 (結果 dict, HTTP 狀態碼)
+    不依賴 request context，可由合併部署的 pipeline 直接呼叫
+    """
     roof_area_m2 = data["roof_area_m2"]
     coverage_rate = data["coverage_rate"]
-    address = data["address"]
+    address = resolve_city(data)
+    if address is None:
+        return {"error": "請提供 address 或 lat/lng"}, 400
 
+    maybe_reload_recommend_config()
+    config = recommend_config
     recommendations = []
-    for mod in modules:
-        local_vars = {
-            **data,
-            **mod,
-            "roof_area_m2": roof_area_m2,
-            "coverage_rate": coverage_rate,
-            "address": address,
-            "city_to_kwh_day": city_to_kwh_day,
-            "get_fit_rate": lambda cap, eff: get_fit_rate(cap, eff, address)
-        }
+    projection_inputs = []
+    hits = 0
+    # 所有模組的數值欄位一次查表；命中的模組只計算其餘欄位（例如文字）
+    looked_up = config.cube.lookup(address, roof_area_m2, coverage_rate)
+    for index, mod in enumerate(config.modules):
+        local_vars = config.formula_vars(data, mod, roof_area_m2, coverage_rate, address)
+        cached = looked_up[index] if looked_up is not None else None
+        if cached is not None:
+            hits += 1
+            local_vars.update(cached)
 
         try:
-            for field, expr in formulas.items():
-                if field in ["final_recommendation", "score", "explanation_text"]:
-                    continue
-                local_vars[field] = eval(expr, {}, local_vars)
+            for field, code in config.compiled_formulas:
+                if cached is None or field not in cached:
+                    local_vars[field] = eval(code, {}, local_vars)
         except Exception as e:
-            return jsonify({"error": f"公式計算錯誤: {str(e)}"}), 500
+            return {"error": f"公式計算錯誤: {str(e)}"}, 500
 
         recommendation = {
             "module_name": mod["module_name"],
@@ -130,19 +351,68 @@ def recommend():
             "install_cost_ntd": int(local_vars["install_cost_ntd"]),
             "payback_years": round(local_vars["payback_years"], 1),
             "environmental_benefit": local_vars["environmental_benefit"],
-            "investment_projection_20yr": [
-                {"year": y, "value": round(-local_vars["install_cost_ntd"] + local_vars["annual_revenue_ntd"] * y)}
-                for y in range(1, 21)
-            ]
         }
 
         recommendations.append(recommendation)
+        projection_inputs.append((local_vars["install_cost_ntd"], local_vars["annual_revenue_ntd"]))
+
+    for recommendation, projection in zip(recommendations, investment_projections(projection_inputs)):
+        recommendation["investment_projection_20yr"] = [
+            {"year": y, "value": value} for y, value in zip(PROJECTION_YEARS, projection)
+        ]
+    metrics.incr("recommend_cube_total", hits, result="hit")
+    metrics.incr("recommend_cube_total", len(config.modules) - hits, result="miss")
+    return {"recommendations": recommendations, "city": address}, 200
 
-    return jsonify({"recommendations": recommendations})
+# /api/llm_decision 的准入預算：只有快取未命中、需要呼叫 Gemini 的請求消耗 token；
+# 排隊上限低於 LLM 期限，排不進去的請求直接回 429，不佔用 worker 等到逾時
+llm_admission = admission_from_env(
+    "llm_decision", "LLM_ADMISSION",
+    rate=20, burst=40, client_rate=2, client_burst=10, max_queue=50, max_wait=1,
+)
 
-@app.route("/api/llm_decision", methods=["POST"])
+# /api/llm_decision 的請求期限（秒），用戶端可用 X-Request-Timeout-Ms 縮短；
+# 等待 LLM 的時間取 LLM_DEADLINE_SECONDS 與剩餘期限較小者，到期即回傳本地評分
+LLM_DECISION_DEADLINE = float(os.environ.get("LLM_DECISION_DEADLINE", "10"))
+
+@bp.route("/api/llm_decision", methods=["POST"])
 def llm_decision():
     data = request.json
+    environ = request.environ
+    deadline = request_deadline(request.headers, LLM_DECISION_DEADLINE, lambda: client_gone(environ))
+    if llm_decision_error(data) is None and not llm_hedge.is_cached(llm_decision_summary(data)):
+        try:
+            llm_admission.admit(client_id(request.headers, request.remote_addr), deadline.remaining())
+        except Shed as e:
+            body, headers = shed_body(e)
+            return jsonify(body), 429, headers
+    result, status = llm_decision_payload(data, deadline)
+    return jsonify(result), status
+
+def llm_decision_payload(data, deadline=None):
+    """單一模組的 LLM 評估，回傳 (結果 dict, HTTP 狀態碼)"""
+    error = llm_decision_error(data)
+    if error is not None:
+        return error, 400
+    summary = llm_decision_summary(data)
+    # 本地評分以正規化後的縣市查日照
+    result, source = llm_hedge.decide(
+        summary,
+        summary,
+        {**data, "address": resolve_city(data)},
+        llm_deadline_seconds(deadline),
+        is_cancelled=None if deadline is None else deadline.is_cancelled,
+    )
+    result["source"] = source
+    return result, 200
+
+def llm_deadline_seconds(deadline):
+    """等待 LLM 的時間上限；None 表示使用 llm_hedge 的預設值"""
+    if deadline is None:
+        return None
+    return min(llm_hedge.deadline_seconds, deadline.remaining())
+
+def llm_decision_error(data):
     required_fields = [
         "module_name", "efficiency_percent", "efficiency_level",
         "capacity_kw", "address", "annual_generation_kwh",
@@ -150,9 +420,11 @@ def llm_decision():
     ]
     for field in required_fields:
         if field not in data:
-            return jsonify({"error": f"Missing field: {field}"}), 400
+            return {"error": f"Missing field: {field}"}
+    return None
 
-    summary = f"""
+def llm_decision_summary(data):
+    return f"""
 模組名稱：{data['module_name']}
 模組效率：{data['efficiency_percent']}%
 模組等級：{data['efficiency_level']}
@@ -164,8 +436,163 @@ def llm_decision():
 回本年限：約 {round(data['payback_years'], 1)} 年
 """
 
-    result = generate_llm_outputs(summary)
-    return jsonify(result)
+def solar_data_payload(lat, lng, kwh_per_kw_day, temperature):
+    potential = min(100, round(100 * kwh_per_kw_day / SOLAR_POTENTIAL_FULL_KWH))
+    return {
+        "location": [lat, lng],
+        "solarPotential": potential,
+        "averageSunlight": round(kwh_per_kw_day / SOLAR_PERFORMANCE_RATIO, 2),
+        "temperature": round(temperature, 1),
+        "weatherCondition": "晴朗" if potential >= 80 else "多雲",
+        "daily_kwh_per_kw": round(kwh_per_kw_day, 3),
+    }
+
+@bp.route("/api/solar-data", methods=["GET"])
+def solar_data():
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "請提供數值 lat 與 lng"}), 400
+    sampled = solar_raster.sample(lat, lng)
+    kwh, temperature = float(sampled["kwh_per_kw_day"][0]), float(sampled["temperature"][0])
+    if np.isnan(kwh):
+        return jsonify({"error": "座標不在資料範圍內"}), 404
+    return jsonify(solar_data_payload(lat, lng, kwh, temperature))
+
+@bp.route("/api/solar-data", methods=["POST"])
+def solar_data_batch():
+    """批次查詢：{"points": [{lat, lng}, ...]}，範圍外的點回傳 null"""
+    points = (request.get_json(silent=True) or {}).get("points")
+    if not isinstance(points, list):
+        return jsonify({"error": "請提供 points 陣列"}), 400
+    if len(points) > SOLAR_DATA_MAX_POINTS:
+        return jsonify({"error": f"points 最多 {SOLAR_DATA_MAX_POINTS} 筆"}), 400
+    try:
+        lats = np.array([float(p["lat"]) for p in points])
+        lngs = np.array([float(p["lng"]) for p in points])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "points 需為 [{lat, lng}, ...]"}), 400
+    sampled = solar_raster.sample(lats, lngs)
+    results = [
+        None if np.isnan(kwh) else solar_data_payload(lat, lng, kwh, temperature)
+        for lat, lng, kwh, temperature in zip(
+            lats.tolist(), lngs.tolist(), sampled["kwh_per_kw_day"].tolist(), sampled["temperature"].tolist()
+        )
+    ]
+    return jsonify({"results": results})
+
+@bp.route("/api/reverse-geocode", methods=["GET"])
+def reverse_geocode():
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "請提供數值 lat 與 lng"}), 400
+    city = county_locator.locate(lat, lng)
+    if city is None:
+        return jsonify({"error": "座標不在任何縣市內"}), 404
+    return jsonify({"location": [lat, lng], "city": city})
+
+@bp.route("/api/reverse-geocode", methods=["POST"])
+def reverse_geocode_batch():
+    """批次查詢：{"points": [{lat, lng}, ...]}，回傳與 points 等長的縣市名稱（找不到為 null）"""
+    points = (request.get_json(silent=True) or {}).get("points")
+    if not isinstance(points, list):
+        return jsonify({"error": "請提供 points 陣列"}), 400
+    if len(points) > REVERSE_GEOCODE_MAX_POINTS:
+        return jsonify({"error": f"points 最多 {REVERSE_GEOCODE_MAX_POINTS} 筆"}), 400
+    try:
+        lats = [float(p["lat"]) for p in points]
+        lngs = [float(p["lng"]) for p in points]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "points 需為 [{lat, lng}, ...]"}), 400
+    return jsonify({"cities": county_locator.locate_many(lats, lngs)})
+
+def _installation_query_args():
+    """解析 lat/lng，回傳 ((lat, lng), None) 或 (None, 錯誤回應)"""
+    if installation_index is None:
+        return None, (jsonify({"error": "未設定案場資料（INSTALLATIONS_PATH）"}), 503)
+    try:
+        return (float(request.args["lat"]), float(request.args["lng"])), None
+    except (KeyError, ValueError):
+        return None, (jsonify({"error": "請提供數值 lat 與 lng"}), 400)
+
+@bp.route("/api/installations/nearby", methods=["GET"])
+def nearby_installations():
+    """半徑內案場統計與最近的 limit 筆：?lat=&lng=&radius_km=10&limit=50"""
+    point, error = _installation_query_args()
+    if error:
+        return error
+    try:
+        radius_km = min(float(request.args.get("radius_km", 10)), INSTALLATIONS_MAX_RADIUS_KM)
+        limit = min(int(request.args.get("limit", 50)), INSTALLATIONS_MAX_RESULTS)
+    except ValueError:
+        return jsonify({"error": "radius_km 與 limit 需為數值"}), 400
+    idx, dist = installation_index.within(*point, radius_km)
+    return jsonify({
+        "location": list(point),
+        "radius_km": radius_km,
+        "stats": installation_index.aggregate(idx),
+        "installations": installation_index.describe(idx[:limit], dist[:limit]),
+    })
+
+@bp.route("/api/installations/nearest", methods=["GET"])
+def nearest_installations():
+    """最近的 k 個案場：?lat=&lng=&k=10"""
+    point, error = _installation_query_args()
+    if error:
+        return error
+    try:
+        k = min(int(request.args.get("k", 10)), INSTALLATIONS_MAX_RESULTS)
+    except ValueError:
+        return jsonify({"error": "k 需為整數"}), 400
+    idx, dist = installation_index.nearest(*point, k)
+    return jsonify({
+        "location": list(point),
+        "stats": installation_index.aggregate(idx),
+        "installations": installation_index.describe(idx, dist),
+    })
+
+@bp.route("/api/normalize-address", methods=["GET"])
+def normalize_address():
+    address = request.args.get("address")
+    if not address:
+        return jsonify({"error": "請提供 address"}), 400
+    return jsonify({"address": address, **address_normalizer.normalize(address)})
+
+@bp.route("/api/normalize-address", methods=["POST"])
+def normalize_address_batch():
+    """批次正規化：{"addresses": ["...", ...]}"""
+    addresses = (request.get_json(silent=True) or {}).get("addresses")
+    if not isinstance(addresses, list):
+        return jsonify({"error": "請提供 addresses 陣列"}), 400
+    if len(addresses) > ADDRESS_BATCH_MAX:
+        return jsonify({"error": f"addresses 最多 {ADDRESS_BATCH_MAX} 筆"}), 400
+    return jsonify({"results": address_normalizer.normalize_many(addresses)})
+
+def service_stats():
+    """本服務的元件狀態，由 /api/metrics 輸出"""
+    return {
+        "solar_raster": solar_raster.stats(),
+        "county_locator": county_locator.stats(),
+        "address_cache": address_normalizer.cache_info(),
+        "installations": installation_index.stats() if installation_index is not None else None,
+        "recommend_config": {"version": recommend_config.version, "cube": recommend_config.cube.stats()},
+        "warmup": warmup.status(),
+        "llm_decision_admission": llm_admission.stats(),
+    }
+
+def init_app(app):
+    """把推薦服務掛到 app"""
+    app.register_blueprint(bp)
+
+# 獨立部署用的 app（python app.py）
+app = Flask(__name__)
+CORS(app)
+init_app(app)
+register_metrics_route(app, [service_stats])
+register_probe_routes(app)
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    serve(app, 5001, prefix="DSA_")
@@ -0,0 +1,123 @@
+# 離線反向地理編碼：經緯度 → 縣市
+# 讀取縣市界 GeoJSON（Polygon/MultiPolygon，含孔洞），以規則網格索引縮小候選縣市，
+# 再以外接矩形預篩與射線法（even-odd）判斷點是否在多邊形內；批次查詢以 NumPy 向量化
+import json
+
+import numpy as np
+
+# 向量化點在多邊形內判斷時，每批「點數 × 邊數」的上限，控制暫存陣列大小
+PIP_CHUNK = 2_000_000
+
+
+class County:
+    def __init__(self, name, rings):
+        """rings 為所有外環與孔洞的 (N, 2) [lng, lat] 陣列；even-odd 規則下孔洞與多個部分都能正確處理"""
+        self.name = name
+        edges = [np.column_stack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]
+        # 每列為一條邊 (x1, y1, x2, y2)，去除水平邊（射線法不需要）
+        edges = np.vstack(edges)
+        self.edges = edges[edges[:, 1] != edges[:, 3]]
+        points = np.vstack(rings)
+        self.bbox = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+    def contains(self, lngs, lats):
+        """lngs/lats 為一維陣列，回傳布林陣列"""
+        inside = np.zeros(len(lngs), dtype=bool)
+        x1, y1, x2, y2 = self.edges.T
+        step = max(1, PIP_CHUNK // max(len(self.edges), 1))
+        for start in range(0, len(lngs), step):
+            px = lngs[start:start + step, None]
+            py = lats[start:start + step, None]
+            crosses = (y1 > py) != (y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside[start:start + step] = (crosses & (px < x_at)).sum(axis=1) % 2 == 1
+        return inside
+
+
+def _geometry_rings(geometry):
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        raise ValueError(f"不支援的幾何類型：{geometry['type']}")
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+                ring = ring[:-1]
+            if len(ring) >= 3:
+                rings.append(ring)
+    return rings
+
+
+class CountyLocator:
+    def __init__(self, counties, cell_deg=0.05):
+        self.counties = counties
+        self.cell_deg = cell_deg
+        bboxes = np.array([c.bbox for c in counties])
+        self.west, self.south = bboxes[:, 0].min(), bboxes[:, 1].min()
+        self.east, self.north = bboxes[:, 2].max(), bboxes[:, 3].max()
+        self.cols = int(np.ceil((self.east - self.west) / cell_deg)) + 1
+        self.rows = int(np.ceil((self.north - self.south) / cell_deg)) + 1
+        # 網格索引：每個格子記錄外接矩形與之重疊的縣市
+        self._grid = {}
+        for i, (west, south, east, north) in enumerate(bboxes):
+            c0, c1 = self._col(west), self._col(east)
+            r0, r1 = self._row(south), self._row(north)
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    self._grid.setdefault((r, c), []).append(i)
+
+    @classmethod
+    def from_geojson(cls, path, name_property="name", cell_deg=0.05):
+        with open(path, encoding="utf-8") as f:
+            collection = json.load(f)
+        counties = [
+            County(feature["properties"][name_property], _geometry_rings(feature["geometry"]))
+            for feature in collection["features"]
+        ]
+        return cls(counties, cell_deg)
+
+    def _col(self, lng):
+        return int((lng - self.west) // self.cell_deg)
+
+    def _row(self, lat):
+        return int((lat - self.south) // self.cell_deg)
+
+    def locate(self, lat, lng):
+        """回傳縣市名稱，不在任何縣市內時回傳 None"""
+        lat, lng = float(lat), float(lng)
+        point_lng, point_lat = np.array([lng]), np.array([lat])
+        for i in self._grid.get((self._row(lat), self._col(lng)), ()):
+            county = self.counties[i]
+            west, south, east, north = county.bbox
+            if west <= lng <= east and south <= lat <= north and county.contains(point_lng, point_lat)[0]:
+                return county.name
+        return None
+
+    def locate_many(self, lats, lngs):
+        """批次查詢，回傳與輸入等長的縣市名稱列表（找不到為 None）"""
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        result = np.full(len(lats), -1)
+        for i, county in enumerate(self.counties):
+            west, south, east, north = county.bbox
+            # 外接矩形預篩，只對尚未判定且落在矩形內的點做多邊形判斷
+            candidates = np.flatnonzero(
+                (result < 0) & (lngs >= west) & (lngs <= east) & (lats >= south) & (lats <= north)
+            )
+            if len(candidates):
+                hit = county.contains(lngs[candidates], lats[candidates])
+                result[candidates[hit]] = i
+        return [self.counties[i].name if i >= 0 else None for i in result.tolist()]
+
+    def stats(self):
+        return {
+            "counties": len(self.counties),
+            "edges": int(sum(len(c.edges) for c in self.counties)),
+            "grid_cells": len(self._grid),
+            "cell_deg": self.cell_deg,
+        }
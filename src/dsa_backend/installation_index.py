@@ -0,0 +1,139 @@
+# 既有太陽能案場的空間索引
+# 依規則網格（預設 0.01°，約 1 公里）排序所有案場，同一列連續的格子在陣列中也連續，
+# 半徑查詢只需對每列做一次二分搜尋取出區段，再以 haversine 精確過濾；
+# k 近鄰以倍增半徑的半徑查詢完成
+import csv
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+# k 近鄰搜尋的最大半徑（公里），涵蓋全台
+MAX_SEARCH_RADIUS_KM = 600.0
+
+
+def haversine_km(lat, lng, lats, lngs):
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def load_installations_csv(path):
+    """
+    讀取案場 CSV，欄位：id, lat, lng, capacity_kw, annual_generation_kwh, install_date
+    （annual_generation_kwh 與 install_date 可留空）
+    """
+    ids, lats, lngs, capacity, generation, dates = [], [], [], [], [], []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                lat, lng = float(row["lat"]), float(row["lng"])
+                cap = float(row["capacity_kw"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            ids.append(row.get("id") or str(len(ids)))
+            lats.append(lat)
+            lngs.append(lng)
+            capacity.append(cap)
+            generation.append(float(row["annual_generation_kwh"]) if row.get("annual_generation_kwh") else np.nan)
+            dates.append(row.get("install_date") or None)
+    return InstallationIndex(ids, lats, lngs, capacity, generation, dates)
+
+
+class InstallationIndex:
+    def __init__(self, ids, lats, lngs, capacity_kw, annual_generation_kwh=None, install_dates=None, cell_deg=0.01):
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        n = len(lats)
+        self.cell_deg = cell_deg
+        self.south = float(lats.min()) if n else 0.0
+        self.west = float(lngs.min()) if n else 0.0
+        self.cols = int((float(lngs.max()) - self.west) // cell_deg) + 1 if n else 1
+
+        rows = ((lats - self.south) // cell_deg).astype(np.int64)
+        cols = ((lngs - self.west) // cell_deg).astype(np.int64)
+        cells = rows * self.cols + cols
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.lats = lats[order]
+        self.lngs = lngs[order]
+        self.capacity_kw = np.asarray(capacity_kw, dtype=float)[order]
+        if annual_generation_kwh is None:
+            annual_generation_kwh = np.full(n, np.nan)
+        self.annual_generation_kwh = np.asarray(annual_generation_kwh, dtype=float)[order]
+        self.ids = [ids[i] for i in order.tolist()]
+        self.install_dates = [install_dates[i] for i in order.tolist()] if install_dates is not None else [None] * n
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _candidates(self, lat, lng, radius_km):
+        """半徑外接矩形涵蓋的格子中所有案場的索引"""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+        row0 = max(int((lat - dlat - self.south) // self.cell_deg), 0)
+        row1 = int((lat + dlat - self.south) // self.cell_deg)
+        col0 = max(int((lng - dlng - self.west) // self.cell_deg), 0)
+        col1 = min(int((lng + dlng - self.west) // self.cell_deg), self.cols - 1)
+        if row1 < row0 or col1 < col0:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(self.cells, rows * self.cols + col0, side="left")
+        ends = np.searchsorted(self.cells, rows * self.cols + col1, side="right")
+        slices = [np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist()) if e > s]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def within(self, lat, lng, radius_km):
+        """半徑內所有案場，回傳 (索引陣列, 距離陣列)，依距離排序"""
+        idx = self._candidates(lat, lng, radius_km)
+        dist = haversine_km(lat, lng, self.lats[idx], self.lngs[idx])
+        keep = dist <= radius_km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        return idx[order], dist[order]
+
+    def nearest(self, lat, lng, k=10):
+        """k 近鄰，回傳 (索引陣列, 距離陣列)"""
+        if len(self) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius = self.cell_deg * 111.0
+        while True:
+            idx, dist = self.within(lat, lng, radius)
+            # 半徑查詢是精確的：半徑內已有 k 個案場時，最近的 k 個必在其中
+            if len(idx) >= k or radius >= MAX_SEARCH_RADIUS_KM:
+                return idx[:k], dist[:k]
+            radius = min(radius * 2, MAX_SEARCH_RADIUS_KM)
+
+    def aggregate(self, idx):
+        capacity = self.capacity_kw[idx]
+        generation = self.annual_generation_kwh[idx]
+        known = ~np.isnan(generation) & (capacity > 0)
+        return {
+            "count": int(len(idx)),
+            "total_capacity_kw": round(float(capacity.sum()), 2),
+            "mean_capacity_kw": round(float(capacity.mean()), 2) if len(idx) else None,
+            # 每 kW 年發電量（度/kW），只計入有發電量資料的案場
+            "mean_annual_yield_kwh_per_kw": (
+                round(float((generation[known] / capacity[known]).mean()), 1) if known.any() else None
+            ),
+        }
+
+    def describe(self, idx, dist):
+        return [
+            {
+                "id": self.ids[i],
+                "location": [float(self.lats[i]), float(self.lngs[i])],
+                "distance_km": round(float(d), 3),
+                "capacity_kw": float(self.capacity_kw[i]),
+                "annual_generation_kwh": (
+                    None if np.isnan(self.annual_generation_kwh[i]) else float(self.annual_generation_kwh[i])
+                ),
+                "install_date": self.install_dates[i],
+            }
+            for i, d in zip(idx.tolist(), dist.tolist())
+        ]
+
+    def stats(self):
+        return {"installations": len(self), "cell_deg": self.cell_deg}
@@ -0,0 +1,145 @@
+# LLM 呼叫的期限對沖（hedging）：
+# 在期限內等待 Gemini，逾時則立即回傳本地評分結果，
+# 待 Gemini 回應後再回填快取，下一次相同請求即可直接命中。
+# decide 以執行緒池等待（同步 worker），decide_async 在 asyncio 事件迴圈上等待，兩者共用快取。
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+PARSE_FAILED_TEXT = "解析失敗"
+# 等待 LLM 時檢查用戶端是否離開的間隔（秒）
+CANCEL_POLL_SECONDS = 0.25
+
+
+class HedgedLLM:
+    def __init__(self, llm_fn, fallback_fn, deadline_seconds=3.0, max_workers=8, cache_size=1024):
+        self.llm_fn = llm_fn
+        self.fallback_fn = fallback_fn
+        self.deadline_seconds = deadline_seconds
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._pending_async = {}
+        self._lock = threading.Lock()
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def is_cached(self, key):
+        """key 已有快取結果（decide 會直接回傳、不呼叫 LLM）"""
+        return self._cache_get(key) is not None
+
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _submit(self, key, prompt_input):
+        # 相同 key 的請求共用同一個進行中的 LLM 呼叫
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self.llm_fn, prompt_input)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._backfill(key, f, self._pending))
+        return future
+
+    def _backfill(self, key, future, pending):
+        with self._lock:
+            pending.pop(key, None)
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            print("LLM 背景呼叫失敗：", e)
+            return
+        if _is_valid(result):
+            self._cache_put(key, result)
+
+    def decide(self, key, prompt_input, fallback_input, deadline_seconds=None, is_cancelled=None):
+        """
+        回傳 (result, source)
+        source 為 "cache"、"llm" 或 "rule_based"
+        is_cancelled() 為 True（用戶端已離開）時不再等待，直接回傳本地評分；LLM 呼叫仍在背景完成並回填快取
+        """
+        cached = self._cache_get(key)
+        if cached is not None:
+            return dict(cached), "cache"
+
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        future = self._submit(key, prompt_input)
+        try:
+            result = self._wait(future, deadline_seconds, is_cancelled)
+        except FutureTimeout:
+            print(f"LLM 超過 {deadline_seconds} 秒未回應，改用本地評分")
+            result = None
+        except Exception as e:
+            print("LLM 呼叫失敗，改用本地評分：", e)
+            result = None
+
+        if result is not None and _is_valid(result):
+            return dict(result), "llm"
+        return self.fallback_fn(fallback_input), "rule_based"
+
+    @staticmethod
+    def _wait(future, timeout, is_cancelled):
+        """等待 future 至多 timeout 秒；用戶端已離開時回傳 None"""
+        if is_cancelled is None:
+            return future.result(timeout=timeout)
+        expires_at = time.monotonic() + timeout
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise FutureTimeout()
+            try:
+                return future.result(timeout=min(CANCEL_POLL_SECONDS, remaining))
+            except FutureTimeout:
+                if is_cancelled():
+                    print("用戶端已離開，不再等待 LLM")
+                    return None
+
+    async def decide_async(self, key, llm_coro_fn, prompt_input, fallback_input, deadline_seconds=None):
+        """
+        decide 的 asyncio 版本：llm_coro_fn(prompt_input) 為 coroutine function，等待期間不佔用執行緒
+        逾時後 LLM 呼叫在事件迴圈上繼續執行並回填快取
+        """
+        cached = self._cache_get(key)
+        if cached is not None:
+            return dict(cached), "cache"
+
+        if deadline_seconds is None:
+            deadline_seconds = self.deadline_seconds
+        # 同一事件迴圈上相同 key 的請求共用同一個進行中的 LLM 呼叫
+        task = self._pending_async.get(key)
+        if task is None:
+            task = asyncio.ensure_future(llm_coro_fn(prompt_input))
+            self._pending_async[key] = task
+            task.add_done_callback(lambda t: self._backfill(key, t, self._pending_async))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), deadline_seconds)
+        except asyncio.TimeoutError:
+            print(f"LLM 超過 {deadline_seconds} 秒未回應，改用本地評分")
+            result = None
+        except Exception as e:
+            print("LLM 呼叫失敗，改用本地評分：", e)
+            result = None
+
+        if result is not None and _is_valid(result):
+            return dict(result), "llm"
+        return self.fallback_fn(fallback_input), "rule_based"
+
+
+def _is_valid(result):
+    return isinstance(result, dict) and result.get("explanation_text") != PARSE_FAILED_TEXT
@@ -0,0 +1,402 @@
+# 推薦結果的封閉形式查表（縣市 × 模組 × 容量級距 × 欄位）
+# 由 formulas.json 的語法樹推導：有效面積 A = roof_area_m2 × coverage_rate，容量與 A 成正比，
+# 其餘數值欄位在每個躉購費率級距內為「斜率 × 容量 + 常數」，級距邊界取自 fit_rate_table.json。
+# 查詢時對所有模組一次以二分搜尋找出級距，再做一次乘加即得全部數值欄位，不需執行公式；
+# 文字欄位（例如 environmental_benefit）仍由呼叫端以公式計算。
+# 無法證明為分段線性的欄位（用到請求的其他欄位、函式或非線性運算等）與用到它的欄位改為請求時逐條計算；
+# 容量本身不與面積成正比時整個查表停用，所有請求逐條計算。
+# 建表時在每個級距取樣計算公式求出係數並核對，不符的級距（例如除以零）該級距的請求也逐條計算。
+# 只由四則運算組成的欄位（例如 capacity_kw * daily_kwh_per_kw * 365）不以斜率重組，而是以各模組的陣列
+# 依公式本身的運算順序計算：numpy float64 與 Python float 的四則運算相同，結果與逐條計算逐位元一致，
+# 取整數的欄位不會在浮點誤差的邊界上差 1；查表只提供分段常數（查表函式、縣市資料）的欄位。
+import ast
+import math
+
+import numpy as np
+
+# 容量欄位：費率級距依此判定；A 由這兩個欄位相乘而得
+CAPACITY_FIELD = "capacity_kw"
+AREA_FIELDS = ("roof_area_m2", "coverage_rate")
+# 分段常數的查表函式（第一個參數必須是容量欄位）與對縣市、模組為常數的名稱
+PIECEWISE_FUNCTIONS = ("get_fit_rate",)
+CONSTANT_NAMES = ("address", "city_to_kwh_day")
+REL_TOL = 1e-9
+# 取樣候選點 p ± p / 2^k 的 k 上限
+SAMPLE_HALVINGS = 6
+
+
+class NotPiecewiseLinear(Exception):
+    """公式無法證明為分段線性"""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# 運算式對有效面積 A 的形式（級距內）；EVALUATED 為無法判定、請求時逐條計算的欄位
+CONSTANT, PROPORTIONAL, AFFINE, TEXT, EVALUATED = "constant", "proportional", "affine", "text", "evaluated"
+
+
+class _Form(ast.NodeVisitor):
+    """
+    判定運算式在級距內的形式：CONSTANT（常數）、PROPORTIONAL（k × A）、AFFINE（k × A + b）或 TEXT（文字）；
+    無法判定時拋出 NotPiecewiseLinear
+    """
+
+    def __init__(self, names):
+        self.names = names
+
+    def fail(self, node, reason):
+        raise NotPiecewiseLinear(f"{reason}：{ast.unparse(node)}")
+
+    def number(self, node):
+        form = self.visit(node)
+        if form == TEXT:
+            self.fail(node, "文字不能參與數值運算")
+        return form
+
+    def constant(self, *nodes):
+        """各運算式需為常數（文字亦可，例如比較或查表的參數），結果為數值常數"""
+        for node in nodes:
+            if self.visit(node) not in (CONSTANT, TEXT):
+                self.fail(node, "需為常數")
+        return CONSTANT
+
+    def generic_visit(self, node):
+        self.fail(node, "不支援的運算")
+
+    def visit_Expression(self, node):
+        return self.visit(node.body)
+
+    def visit_Constant(self, node):
+        return TEXT if isinstance(node.value, str) else CONSTANT
+
+    def visit_JoinedStr(self, node):
+        return TEXT
+
+    def visit_Name(self, node):
+        if node.id in AREA_FIELDS:
+            self.fail(node, f"{node.id} 只能以 roof_area_m2 * coverage_rate 的形式出現")
+        if node.id not in self.names:
+            self.fail(node, "使用了請求中的其他欄位")
+        if self.names[node.id] == EVALUATED:
+            self.fail(node, "使用了逐條計算的欄位")
+        return self.names[node.id]
+
+    def visit_List(self, node):
+        return self.constant(*node.elts)
+
+    visit_Tuple = visit_Set = visit_List
+
+    def visit_BinOp(self, node):
+        names = {n.id for n in (node.left, node.right) if isinstance(n, ast.Name)}
+        if isinstance(node.op, ast.Mult) and names == set(AREA_FIELDS):
+            return PROPORTIONAL
+        left, right = self.visit(node.left), self.visit(node.right)
+        if TEXT in (left, right):
+            # 字串串接、格式化
+            if {left, right} <= {TEXT, CONSTANT}:
+                return TEXT
+            self.fail(node, "文字不能參與數值運算")
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            return left if left == right else AFFINE
+        if isinstance(node.op, ast.Mult) and CONSTANT in (left, right):
+            return right if left == CONSTANT else left
+        if isinstance(node.op, ast.Div) and right == CONSTANT:
+            return left
+        # 兩個與面積成正比的量相除為常數（例如回本年限 = 成本 / 年收入）
+        if isinstance(node.op, ast.Div) and left == right == PROPORTIONAL:
+            return CONSTANT
+        return self.constant(node.left, node.right)
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, (ast.UAdd, ast.USub)):
+            return self.number(node.operand)
+        return self.constant(node.operand)
+
+    def visit_Compare(self, node):
+        return self.constant(node.left, *node.comparators)
+
+    def visit_BoolOp(self, node):
+        return self.constant(*node.values)
+
+    def visit_IfExp(self, node):
+        self.constant(node.test)
+        body, orelse = self.visit(node.body), self.visit(node.orelse)
+        if TEXT in (body, orelse):
+            return TEXT if body == orelse else self.fail(node, "條件兩側型別不同")
+        return body if body == orelse else AFFINE
+
+    def visit_Attribute(self, node):
+        return self.constant(node.value)
+
+    def visit_Subscript(self, node):
+        return self.constant(node.value, node.slice)
+
+    def visit_Call(self, node):
+        if node.keywords:
+            self.fail(node, "不支援關鍵字參數")
+        if isinstance(node.func, ast.Name) and node.func.id in PIECEWISE_FUNCTIONS:
+            first, *rest = node.args
+            if not (isinstance(first, ast.Name) and first.id == CAPACITY_FIELD):
+                self.fail(node, f"{node.func.id} 需以 {CAPACITY_FIELD} 查表")
+            return self.constant(*rest)
+        if isinstance(node.func, ast.Name) and node.func.id not in self.names:
+            self.fail(node, "不支援的函式")
+        return self.constant(node.func, *node.args)
+
+
+# 依公式運算順序以陣列計算的運算
+ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+
+
+def is_arithmetic(tree, names):
+    """運算式是否只由四則運算、正負號、數值常數與 names 中的名稱組成"""
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Expression, ast.Load, *ARITHMETIC_OPS, ast.UAdd, ast.USub)):
+            continue
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if isinstance(node.op, (*ARITHMETIC_OPS, ast.UAdd, ast.USub)):
+                continue
+            return False
+        if isinstance(node, ast.Constant) and _is_number(node.value):
+            continue
+        if isinstance(node, ast.Name) and node.id in names:
+            continue
+        return False
+    return True
+
+
+def analyze_formulas(compiled_formulas, formulas, module_fields):
+    """
+    回傳 (各欄位在級距內的形式 {欄位: CONSTANT | PROPORTIONAL | AFFINE | TEXT | EVALUATED},
+    逐條計算的欄位與原因 {欄位: 原因})；容量不與面積成正比時拋出 NotPiecewiseLinear
+    無法判定的欄位（以及用到它的欄位）標為 EVALUATED，其餘欄位照常查表
+    """
+    names = {name: CONSTANT for name in (*module_fields, *CONSTANT_NAMES, *PIECEWISE_FUNCTIONS)}
+    forms, reasons = {}, {}
+    for field, _ in compiled_formulas:
+        try:
+            forms[field] = _Form(names).visit(ast.parse(formulas[field], mode="eval"))
+        except NotPiecewiseLinear as e:
+            forms[field], reasons[field] = EVALUATED, str(e)
+        names[field] = forms[field]
+    if forms.get(CAPACITY_FIELD) != PROPORTIONAL:
+        raise NotPiecewiseLinear(reasons.get(CAPACITY_FIELD, f"{CAPACITY_FIELD} 需與面積成正比"))
+    return forms, reasons
+
+
+def capacity_segments(fit_rate_table):
+    """費率表的級距邊界（kW，遞增）；相鄰邊界之間（以及 0 到第一個邊界、最後一個邊界之後）各為一段"""
+    bounds = {tier["min_kw"] for tier in fit_rate_table}
+    bounds.update(tier["max_kw"] for tier in fit_rate_table if tier["max_kw"] is not None)
+    return sorted(b for b in bounds if b > 0)
+
+
+def _segment_samples(lo, hi):
+    """
+    段內的取樣容量 (候選, 核對)：候選依序為 2 的次方 p 與 p ± q（q 亦為 2 的次方），
+    取兩個計算出的容量恰為候選值的點，斜率、截距的除法與減法即無誤差；核對點用來驗證推導出的形式
+    """
+    top = hi if hi != math.inf else lo * 4 + 4
+    check = lo + (top - lo) / 3
+    p = 2.0 ** math.floor(math.log2(top))
+    if p >= top:
+        p /= 2
+    if p < lo:
+        return [lo + 2 * (top - lo) / 3, lo + (top - lo) / 2], check
+    candidates = [p]
+    for k in range(1, SAMPLE_HALVINGS + 1):
+        q = p / 2 ** k
+        candidates.extend(c for c in (p - q, p + q) if lo <= c < top and c > 0 and c != check)
+    return candidates, check
+
+
+def _area_for(capacity, unit_capacity):
+    """使 面積 × unit_capacity 恰為 capacity 的面積；找不到時回傳最接近的值"""
+    area = capacity / unit_capacity
+    candidate = area
+    for _ in range(4):
+        if candidate * unit_capacity == capacity:
+            return candidate
+        candidate = math.nextafter(candidate, math.inf if candidate * unit_capacity < capacity else -math.inf)
+    return area
+
+
+class RecommendCube:
+    def __init__(self, evaluate, compiled_formulas, formulas, module_fields, fit_rate_table):
+        """
+        evaluate(module, city, roof_area_m2, coverage_rate) 逐條計算公式，回傳 {欄位: 值}，失敗時拋出例外
+        """
+        self.evaluate = evaluate
+        self.compiled_formulas = compiled_formulas
+        self.formulas = formulas
+        self.bounds = capacity_segments(fit_rate_table)
+        try:
+            self.forms, self.evaluated = analyze_formulas(compiled_formulas, formulas, module_fields)
+            self.disabled = None
+        except NotPiecewiseLinear as e:
+            self.forms, self.evaluated = {}, {}
+            self.disabled = str(e)
+        # 查表的數值欄位（不含容量本身）
+        self.fields = [
+            f for f, form in self.forms.items() if form not in (TEXT, EVALUATED) and f != CAPACITY_FIELD
+        ]
+        self._bounds = np.array(self.bounds, dtype=float)
+        self._cities = {}
+        # 依公式運算順序以陣列計算的欄位與各模組的數值屬性陣列，由 build 設定
+        self.arithmetic = ()
+        self._module_arrays = {}
+        self._codes = {}
+
+    def _segment(self, module, city, unit_capacity, i):
+        """第 i 段的 (斜率, 常數) 兩個向量；取樣結果不符時回傳 None"""
+        lo = self.bounds[i - 1] if i > 0 else 0.0
+        hi = self.bounds[i] if i < len(self.bounds) else math.inf
+        candidates, check = _segment_samples(lo, hi)
+        exact, approximate = [], []
+        for capacity in candidates:
+            values = self.evaluate(module, city, _area_for(capacity, unit_capacity), 1.0)
+            cap = values.get(CAPACITY_FIELD)
+            if _is_number(cap) and lo <= cap < hi:
+                (exact if cap == capacity else approximate).append(values)
+            if len(exact) == 2:
+                break
+        samples = (exact + approximate)[:2]
+        if len(samples) < 2:
+            return None
+        values = self.evaluate(module, city, _area_for(check, unit_capacity), 1.0)
+        if not (_is_number(values.get(CAPACITY_FIELD)) and lo <= values[CAPACITY_FIELD] < hi):
+            return None
+        samples.append(values)
+        caps = [values[CAPACITY_FIELD] for values in samples]
+        # 與面積成正比的欄位以容量為 2 的次方的取樣點（若有）求斜率
+        ref = next((j for j in (0, 1) if math.frexp(caps[j])[0] == 0.5), 0)
+        slope, intercept = [], []
+        for field in self.fields:
+            (a, b, c), form = [values.get(field) for values in samples], self.forms[field]
+            if not all(_is_number(v) for v in (a, b, c)):
+                return None
+            if form == CONSTANT:
+                k, b0 = 0.0, a
+            elif form == PROPORTIONAL:
+                k, b0 = samples[ref][field] / caps[ref], 0.0
+            else:
+                k = (b - a) / (caps[1] - caps[0])
+                b0 = a - k * caps[0]
+            # 以其餘取樣點核對推導出的形式
+            for cap, value in zip(caps[1:], (b, c)):
+                if not math.isclose(k * cap + b0, value, rel_tol=REL_TOL, abs_tol=REL_TOL * (abs(a) + abs(b))):
+                    return None
+            slope.append(k)
+            intercept.append(b0)
+        return slope, intercept
+
+    def _build_city(self, modules, city):
+        m, s, f = len(modules), len(self.bounds) + 1, len(self.fields)
+        unit = np.zeros(m)
+        slope, intercept = np.zeros((m, s, f)), np.zeros((m, s, f))
+        valid = np.zeros((m, s), dtype=bool)
+        for index, module in enumerate(modules):
+            try:
+                # 單位面積的容量；取 1.0 使查表的容量與公式計算完全一致
+                unit[index] = self.evaluate(module, city, 1.0, 1.0)[CAPACITY_FIELD]
+            except Exception:
+                continue
+            if not unit[index] > 0:
+                continue
+            for i in range(s):
+                try:
+                    segment = self._segment(module, city, unit[index], i)
+                except Exception:
+                    segment = None
+                if segment is not None:
+                    slope[index, i], intercept[index, i] = segment
+                    valid[index, i] = True
+        return unit, slope, intercept, valid
+
+    def build(self, modules, cities):
+        """建立所有縣市的查表（重新建立時整份替換），回傳統計"""
+        if self.disabled:
+            return {"disabled": self.disabled}
+        built = {city: self._build_city(modules, city) for city in cities}
+        module_arrays = {
+            name: np.array([module[name] for module in modules], dtype=float)
+            for name in (set.intersection(*(set(module) for module in modules)) if modules else ())
+            if all(_is_number(module[name]) for module in modules)
+        }
+        # 只用到面積、模組數值屬性與先前查表欄位的四則運算欄位，依公式順序以陣列計算
+        names = {*AREA_FIELDS, *module_arrays}
+        arithmetic = []
+        for field, code in self.compiled_formulas:
+            if field not in self.fields and field != CAPACITY_FIELD:
+                continue
+            if is_arithmetic(ast.parse(self.formulas[field], mode="eval"), names):
+                arithmetic.append(field)
+            names.add(field)
+        self._module_arrays, self.arithmetic = module_arrays, tuple(arithmetic)
+        self._codes = dict(self.compiled_formulas)
+        self._cities = built
+        valid = sum(int(table[3].sum()) for table in built.values())
+        return {
+            "cities": len(cities),
+            "modules": len(modules),
+            "segments": len(self.bounds) + 1,
+            "valid_cells": valid,
+            "cells": len(cities) * len(modules) * (len(self.bounds) + 1),
+        }
+
+    def lookup(self, city, roof_area_m2, coverage_rate):
+        """
+        各模組的數值欄位 [{欄位: 值} 或 None, ...]（順序同 modules，None 表示該模組需逐條計算）；
+        整個請求無法查表（縣市未建表、面積非正數或非數值）時回傳 None
+        """
+        table = self._cities.get(city)
+        if table is None or not (_is_number(roof_area_m2) and _is_number(coverage_rate)):
+            return None
+        area = roof_area_m2 * coverage_rate
+        if not (area > 0 and math.isfinite(area)):
+            return None
+        unit, slope, intercept, valid = table
+        codes = self._codes
+        namespace = {"roof_area_m2": roof_area_m2, "coverage_rate": coverage_rate, **self._module_arrays}
+        with np.errstate(all="ignore"):
+            if CAPACITY_FIELD in self.arithmetic:
+                capacity = self._column(eval(codes[CAPACITY_FIELD], {}, namespace), len(unit))
+            else:
+                capacity = area * unit
+            segment = np.searchsorted(self._bounds, capacity, side="right")
+            rows = np.arange(len(unit))
+            linear = slope[rows, segment] * capacity[:, None] + intercept[rows, segment]
+            columns = {CAPACITY_FIELD: capacity}
+            namespace[CAPACITY_FIELD] = capacity
+            for index, field in enumerate(self.fields):
+                if field in self.arithmetic:
+                    column = self._column(eval(codes[field], {}, namespace), len(unit))
+                else:
+                    column = linear[:, index]
+                columns[field] = namespace[field] = column
+        fields = [CAPACITY_FIELD, *self.fields]
+        matrix = np.empty((len(unit), len(fields)))
+        for index, field in enumerate(fields):
+            matrix[:, index] = columns[field]
+        # 除以零等逐條計算會拋出例外的情形在陣列中為非有限值，交由逐條計算
+        hits = valid[rows, segment] & np.isfinite(matrix).all(axis=1)
+        return [dict(zip(fields, row)) if hit else None for row, hit in zip(matrix.tolist(), hits.tolist())]
+
+    @staticmethod
+    def _column(value, size):
+        """公式結果為各模組的一欄；未用到模組屬性的公式結果為純量，展開成一欄"""
+        if isinstance(value, np.ndarray) and value.shape == (size,):
+            return value
+        return np.full(size, float(value))
+
+    def stats(self):
+        return {
+            "disabled": self.disabled,
+            "cities": len(self._cities),
+            "fields": self.forms,
+            "arithmetic": list(self.arithmetic),
+            "evaluated": self.evaluated,
+            "segment_bounds_kw": self.bounds,
+        }
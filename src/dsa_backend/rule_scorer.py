@@ -0,0 +1,85 @@
+# 本地規則式評分模型：Gemini 逾時或失敗時的備援
+# 輸出格式與 LLM 相同：{final_recommendation, score, explanation_text}
+
+# 各模組等級對應的效率分數
+EFFICIENCY_SCORES = {
+    "非常高效": 1.0,
+    "高效": 0.8,
+    "一般效率": 0.5,
+    "低效率": 0.3,
+}
+
+# 各項因子權重（總和為 1）
+WEIGHTS = {
+    "payback": 0.55,
+    "irradiance": 0.2,
+    "efficiency": 0.15,
+    "capacity": 0.1,
+}
+
+# 回本年限門檻：6 年內滿分，20 年以上 0 分
+PAYBACK_BEST_YEARS = 6.0
+PAYBACK_WORST_YEARS = 20.0
+# 日照門檻（kWh/kW/日），對應 city_to_kwh_day.json 的上下限
+IRRADIANCE_LOW = 2.3
+IRRADIANCE_HIGH = 3.4
+# 躉購費率最低級距為 1 kW，10 kW 以上視為規模充足
+CAPACITY_MIN_KW = 1.0
+CAPACITY_FULL_KW = 10.0
+
+RECOMMEND_THRESHOLD = 0.6
+DEFAULT_KWH_PER_DAY = 2.8
+
+
+def _clip(value, low=0.0, high=1.0):
+    return max(low, min(high, value))
+
+
+def _linear(value, worst, best):
+    """將 value 線性映射到 0~1，worst 得 0 分、best 得 1 分"""
+    return _clip((value - worst) / (best - worst))
+
+
+def score_locally(data, city_to_kwh_day):
+    """
+    依回本年限、裝置容量、縣市日照與模組等級計算推薦分數
+    data 需包含 /api/llm_decision 的必要欄位
+    """
+    payback_years = float(data["payback_years"])
+    capacity_kw = float(data["capacity_kw"])
+    kwh_day = city_to_kwh_day.get(data["address"], DEFAULT_KWH_PER_DAY)
+
+    factors = {
+        "payback": _linear(payback_years, PAYBACK_WORST_YEARS, PAYBACK_BEST_YEARS),
+        "irradiance": _linear(kwh_day, IRRADIANCE_LOW, IRRADIANCE_HIGH),
+        "efficiency": EFFICIENCY_SCORES.get(data["efficiency_level"], 0.5),
+        "capacity": _linear(capacity_kw, 0.0, CAPACITY_FULL_KW),
+    }
+    score = sum(WEIGHTS[name] * value for name, value in factors.items())
+    if capacity_kw < CAPACITY_MIN_KW:
+        # 未達躉購最低容量，無法售電
+        score *= 0.5
+    score = round(score, 2)
+
+    if score >= RECOMMEND_THRESHOLD:
+        final_recommendation = "推薦安裝"
+    else:
+        final_recommendation = "保守觀望"
+
+    return {
+        "final_recommendation": final_recommendation,
+        "score": score,
+        "explanation_text": _explain(payback_years, capacity_kw, kwh_day, factors),
+    }
+
+
+def _explain(payback_years, capacity_kw, kwh_day, factors):
+    if capacity_kw < CAPACITY_MIN_KW:
+        return f"裝置容量僅約 {capacity_kw:.2f} 瓩，未達躉購門檻，售電收益有限。"
+    if factors["payback"] >= 0.7:
+        return f"回本年限約 {payback_years:.1f} 年，投資回收快，具良好經濟效益。"
+    if factors["payback"] <= 0.3:
+        return f"回本年限約 {payback_years:.1f} 年，回收期偏長，建議保守評估投資風險。"
+    if factors["irradiance"] >= 0.7:
+        return f"當地日照充足（約 {kwh_day:.2f} 度/瓩/日），回本年限約 {payback_years:.1f} 年，整體條件尚佳。"
+    return f"回本年限約 {payback_years:.1f} 年，日照約 {kwh_day:.2f} 度/瓩/日，效益中等。"
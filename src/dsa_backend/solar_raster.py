@@ -0,0 +1,119 @@
+# 台灣日照/溫度網格（記憶體對應）
+# 網格以 .npy 存放，形狀為 (波段數, 列, 行)，啟動時以 mmap 開啟，
+# 查詢時只讀取需要的格點，多個 worker 共用作業系統的頁面快取
+# 後設資料（範圍、格距、波段名稱）存在同名 .json
+# 重建網格：python solar_raster.py
+import json
+import os
+
+import numpy as np
+
+# 台灣本島與澎湖的範圍（度）與格距
+DEFAULT_BOUNDS = {"south": 21.85, "west": 119.3, "north": 25.35, "east": 122.05}
+DEFAULT_STEP = 0.01
+BANDS = ("kwh_per_kw_day", "temperature")
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def build_raster(path, city_to_kwh_day, stations, bounds=None, step=DEFAULT_STEP, power=2.0):
+    """
+    以縣市測站（縣市政府所在地）的每日每 kW 發電量與年均溫，
+    反距離加權內插成規則網格並寫入 path（.npy）與後設資料（.json）
+    """
+    bounds = bounds or DEFAULT_BOUNDS
+    names = [name for name in city_to_kwh_day if name in stations]
+    station_lat = np.array([stations[n]["lat"] for n in names])
+    station_lng = np.array([stations[n]["lng"] for n in names])
+    values = np.array([[city_to_kwh_day[n] for n in names], [stations[n]["temperature"] for n in names]])
+
+    rows = int(round((bounds["north"] - bounds["south"]) / step)) + 1
+    cols = int(round((bounds["east"] - bounds["west"]) / step)) + 1
+    lats = bounds["south"] + np.arange(rows) * step
+    lngs = bounds["west"] + np.arange(cols) * step
+    grid_lat, grid_lng = np.meshgrid(lats, lngs, indexing="ij")
+
+    # 經度方向依緯度縮放後的平面距離
+    cos_lat = np.cos(np.radians(grid_lat))[..., None]
+    d2 = (grid_lat[..., None] - station_lat) ** 2 + ((grid_lng[..., None] - station_lng) * cos_lat) ** 2
+    weights = 1.0 / np.maximum(d2, 1e-12) ** (power / 2)
+    weights /= weights.sum(axis=-1, keepdims=True)
+    raster = np.einsum("rcs,bs->brc", weights, values).astype(np.float32)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, raster)
+    os.replace(tmp, path)
+    with open(_meta_path(path), "w", encoding="utf-8") as f:
+        json.dump({**bounds, "step": step, "rows": rows, "cols": cols, "bands": list(BANDS)}, f)
+
+
+class SolarRaster:
+    def __init__(self, path):
+        with open(_meta_path(path), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.south, self.west = meta["south"], meta["west"]
+        self.north, self.east = meta["north"], meta["east"]
+        self.step = meta["step"]
+        self.bands = meta["bands"]
+        # 唯讀記憶體對應，不會把整個網格讀進記憶體
+        self.data = np.load(path, mmap_mode="r")
+        _, self.rows, self.cols = self.data.shape
+
+    def contains(self, lats, lngs):
+        lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+        return (lats >= self.south) & (lats <= self.north) & (lngs >= self.west) & (lngs <= self.east)
+
+    def sample(self, lats, lngs):
+        """
+        雙線性內插；lats/lngs 可為純量或陣列
+        回傳 {波段名稱: 陣列}，範圍外的點為 NaN
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+        inside = self.contains(lats, lngs)
+
+        fy = np.clip((lats - self.south) / self.step, 0, self.rows - 1)
+        fx = np.clip((lngs - self.west) / self.step, 0, self.cols - 1)
+        r0 = np.minimum(fy.astype(int), self.rows - 2)
+        c0 = np.minimum(fx.astype(int), self.cols - 2)
+        ty, tx = fy - r0, fx - c0
+
+        # 花式索引只會觸及查詢點周圍的頁面
+        v00 = self.data[:, r0, c0]
+        v01 = self.data[:, r0, c0 + 1]
+        v10 = self.data[:, r0 + 1, c0]
+        v11 = self.data[:, r0 + 1, c0 + 1]
+        values = (v00 * (1 - tx) + v01 * tx) * (1 - ty) + (v10 * (1 - tx) + v11 * tx) * ty
+        values = np.where(inside, values, np.nan)
+        return {band: values[i] for i, band in enumerate(self.bands)}
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "shape": [len(self.bands), self.rows, self.cols],
+            "bands": self.bands,
+            "step": self.step,
+            "bytes": int(self.data.nbytes),
+        }
+
+
+def load_raster(path, city_to_kwh_day, stations):
+    """開啟網格；檔案不存在時先依縣市資料建立"""
+    if not (os.path.exists(path) and os.path.exists(_meta_path(path))):
+        build_raster(path, city_to_kwh_day, stations)
+    return SolarRaster(path)
+
+
+if __name__ == "__main__":
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "solar_config")
+    with open(os.path.join(config_path, "city_to_kwh_day.json"), encoding="utf-8") as f:
+        kwh = json.load(f)
+    with open(os.path.join(config_path, "city_stations.json"), encoding="utf-8") as f:
+        station_data = json.load(f)
+    out = os.environ.get("SOLAR_RASTER_PATH", os.path.join(config_path, "solar_raster.npy"))
+    build_raster(out, kwh, station_data)
+    print("已建立", out, SolarRaster(out).stats())
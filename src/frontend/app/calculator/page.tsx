@@ -1,7 +1,7 @@
 // SolarCalculatorPage.tsx
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useCallback } from "react"
 import { useRouter } from "next/navigation"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Button } from "@/components/ui/button"
@@ -20,6 +20,8 @@ const GoogleMap = dynamic(() => import("@/components/google-map"), { ssr: false
 interface SimulationData {
   location_city: string
   location_dist: string
+  location_lat?: number
+  location_lng?: number
   roofArea: number
   electricityUsage: number
   roofType: string
@@ -143,10 +145,17 @@ export default function SolarCalculatorPage() {
   }
 
   const handleInputChange = (field: keyof SimulationData, value: string | number) => {
+    if (field === "location_city") {
+      // 手動選擇縣市時不再以地圖座標判定縣市
+      setFormData(prev => ({ ...prev, location_city: value as string, location_lat: undefined, location_lng: undefined }))
+      return
+    }
     setFormData(prev => ({ ...prev, [field]: value }))
   }
 
   const handleMapLocationSelect = (lat: number, lng: number, address?: string) => {
+    // 後端以縣市界判定座標所在縣市，地址比對不到時仍能取得正確的日照與補助
+    setFormData(prev => ({ ...prev, location_lat: lat, location_lng: lng }))
     if (address) {
       const cityMatch = address.match(/(台北市|新北市|桃園市|台中市|台南市|高雄市|基隆市|新竹市|嘉義市|新竹縣|苗栗縣|彰化縣|南投縣|雲林縣|嘉義縣|屏東縣|宜蘭縣|花蓮縣|台東縣|澎湖縣|金門縣|連江縣)/)
       const city = cityMatch?.[0] ?? ""
@@ -184,6 +193,10 @@ export default function SolarCalculatorPage() {
     }
   }
 
+  const handleRoofAreaUpdate = useCallback((area: number) => {
+    setFormData(prev => ({ ...prev, roofArea: area }))
+  }, [])
+
   const handleInput = async () => {
     if (!isFormValid) {
       setErrorMessage("請完整填寫所有欄位")
@@ -206,6 +219,8 @@ export default function SolarCalculatorPage() {
           house_type: formData.houseType,
           roof_type: formData.roofType,
           address: formData.location_city,
+          lat: formData.location_lat,
+          lng: formData.location_lng,
           electricity_usage_kwh: formData.electricityUsage,
           risk_tolerance: formData.riskTolerance,
         }),
@@ -525,6 +540,7 @@ export default function SolarCalculatorPage() {
                       <GoogleMap
                         onLocationSelect={handleMapLocationSelect}
                         onRoofAreaDetect={handleRoofAreaDetect}
+                        onRoofAreaUpdate={handleRoofAreaUpdate}
                       />
                     </div>
                   </CardContent>
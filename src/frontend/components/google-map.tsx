@@ -10,6 +10,7 @@ interface GoogleMapProps {
   location?: string
   onLocationSelect?: (lat: number, lng: number, address?: string) => void
   onRoofAreaDetect?: (area: number, polygon?: { lat: number; lng: number }[]) => void
+  onRoofAreaUpdate?: (area: number) => void
 }
 
 // 動態載入 Google Maps JS API
@@ -32,11 +33,40 @@ function loadGoogleMapsApi(apiKey: string): Promise<void> {
   })
 }
 
-export default function GoogleMap({ location, onLocationSelect, onRoofAreaDetect }: GoogleMapProps) {
+// 以 WebSocket 將多邊形頂點的新增/移動/刪除傳給後端，由後端增量更新面積
+function streamPolygonEdits(polygon: any, onArea: (area: number) => void): () => void {
+  const protocol = window.location.protocol === "https:" ? "wss" : "ws"
+  const ws = new WebSocket(`${protocol}://${window.location.host}/api/roof-detect/ws`)
+  const path = polygon.getPath()
+  const toPoint = (latLng: any) => ({ lat: latLng.lat(), lng: latLng.lng() })
+  const send = (message: object) => {
+    if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify(message))
+  }
+
+  ws.onopen = () => send({ op: "reset", polygon: path.getArray().map(toPoint) })
+  ws.onmessage = (event) => {
+    const data = JSON.parse(event.data)
+    if (!data.error) onArea(data.area)
+  }
+
+  const events = window.google.maps.event
+  const listeners = [
+    events.addListener(path, "insert_at", (i: number) => send({ op: "insert", index: i, ...toPoint(path.getAt(i)) })),
+    events.addListener(path, "set_at", (i: number) => send({ op: "move", index: i, ...toPoint(path.getAt(i)) })),
+    events.addListener(path, "remove_at", (i: number) => send({ op: "delete", index: i })),
+  ]
+  return () => {
+    listeners.forEach((listener) => events.removeListener(listener))
+    ws.close()
+  }
+}
+
+export default function GoogleMap({ location, onLocationSelect, onRoofAreaDetect, onRoofAreaUpdate }: GoogleMapProps) {
   const mapRef = useRef<HTMLDivElement>(null)
   const markerRef = useRef<any>(null)
   const polygonRef = useRef<any>(null)
   const drawingManagerRef = useRef<any>(null)
+  const stopEditStreamRef = useRef<(() => void) | null>(null)
   const [mapInstance, setMapInstance] = useState<any>(null)
   const [markerPos, setMarkerPos] = useState<{ lat: number; lng: number } | null>(null)
   const [apiError, setApiError] = useState<string | null>(null)
@@ -117,7 +147,12 @@ export default function GoogleMap({ location, onLocationSelect, onRoofAreaDetect
               if (polygonRef.current) {
                 polygonRef.current.setMap(null)
               }
+              stopEditStreamRef.current?.()
               polygonRef.current = event.overlay
+              // 之後的頂點編輯改以增量方式更新面積
+              if (onRoofAreaUpdate) {
+                stopEditStreamRef.current = streamPolygonEdits(polygonRef.current, onRoofAreaUpdate)
+              }
               // 取得多邊形座標
               const path = polygonRef.current.getPath().getArray().map((latLng: any) => ({
                 lat: latLng.lat(),
@@ -134,7 +169,9 @@ export default function GoogleMap({ location, onLocationSelect, onRoofAreaDetect
         setApiError("Google Maps API 載入失敗，請檢查網路或 API 金鑰。")
       })
     // eslint-disable-next-line
-  }, [mapRef, mapInstance, onLocationSelect, onRoofAreaDetect])
+  }, [mapRef, mapInstance, onLocationSelect, onRoofAreaDetect, onRoofAreaUpdate])
+
+  useEffect(() => () => stopEditStreamRef.current?.(), [])
 
   useEffect(() => {
     if (mapInstance && markerPos) {
@@ -53,15 +53,23 @@ export function calculateDistance(lat1: number, lng1: number, lat2: number, lng2
 
 // 獲取附近的太陽能安裝案例
 export async function getNearbyInstallations(lat: number, lng: number, radius = 10) {
-  // 實際應用中會查詢資料庫或 API
-  return [
-    {
-      id: "1",
-      location: [lat + 0.001, lng + 0.001],
-      capacity: "5kW",
-      installDate: "2023-06-15",
-      annualGeneration: 6500,
-    },
-    // ... 更多安裝案例
-  ]
+  try {
+    const response = await fetch(`/api/installations/nearby?lat=${lat}&lng=${lng}&radius_km=${radius}`)
+    if (!response.ok) {
+      throw new Error(`nearby installations: ${response.status}`)
+    }
+    const data = await response.json()
+
+    return data.installations.map((item: any) => ({
+      id: item.id,
+      location: item.location,
+      capacity: `${item.capacity_kw}kW`,
+      installDate: item.install_date,
+      annualGeneration: item.annual_generation_kwh,
+      distanceKm: item.distance_km,
+    }))
+  } catch (error) {
+    console.error("Failed to fetch nearby installations:", error)
+    return []
+  }
 }
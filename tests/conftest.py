@@ -0,0 +1,17 @@
+# 測試以 src/backend、src/dsa_backend 各自的目錄為模組根目錄，與服務啟動時相同
+# src/backend 排在最前面：app 為 src/backend/app 套件（dsa_backend/app.py 以 dsa_backend.app 載入）
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+for path in (ROOT, os.path.join(ROOT, "dsa_backend"), os.path.join(ROOT, "backend")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# 服務模組在 import 時建立快取與共用狀態，測試時全部放在暫存目錄；准入預算各行程自行計算
+STATE_DIR = tempfile.mkdtemp(prefix="solar-tests-")
+os.environ.setdefault("IMAGERY_CACHE_DIR", os.path.join(STATE_DIR, "imagery"))
+os.environ.setdefault("ROOF_RESULT_CACHE_PATH", os.path.join(STATE_DIR, "roof_results.sqlite3"))
+os.environ.setdefault("ROOF_JOB_STORE_PATH", os.path.join(STATE_DIR, "roof_jobs.sqlite3"))
+os.environ.setdefault("ADMISSION_STORE_PATH", "")
@@ -0,0 +1,166 @@
+# 准入控制：token 回補、排隊、拒絕與 Retry-After、跨行程共用預算、用戶端識別
+import multiprocessing
+import time
+
+import pytest
+
+from common.admission import AdmissionController, BucketStore, Shed, TokenBucket, client_id, shed_body
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class NullMetrics:
+    def __init__(self):
+        self.counts = {}
+
+    def incr(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def gauge_set(self, *args, **kwargs):
+        pass
+
+
+def controller(clock, store=None, **overrides):
+    settings = dict(rate=2, burst=4, client_rate=1, client_burst=3, max_queue=2, max_wait=5)
+    settings.update(overrides)
+    return AdmissionController("test", metrics=NullMetrics(), clock=clock, store=store, **settings)
+
+
+def test_bucket_refill_is_capped_at_burst():
+    bucket = TokenBucket(rate=2, burst=4, now=0.0)
+    for _ in range(4):
+        assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) is None
+    # 0.5 秒回補 1 個
+    assert bucket.reserve(0.5) == 0.0
+    assert bucket.reserve(0.5) is None
+    # 很久之後最多回到 burst
+    bucket._refill(100.0)
+    assert bucket.tokens == 4
+
+
+def test_debt_becomes_wait_time():
+    bucket = TokenBucket(rate=2, burst=1, now=0.0)
+    assert bucket.reserve(0.0, max_debt=3) == 0.0
+    assert bucket.reserve(0.0, max_debt=3) == pytest.approx(0.5)
+    assert bucket.reserve(0.0, max_debt=3) == pytest.approx(1.0)
+    assert bucket.reserve(0.0, max_debt=3) == pytest.approx(1.5)
+    assert bucket.reserve(0.0, max_debt=3) is None
+    assert bucket.wait_for(1) == pytest.approx(2.0)
+
+
+def test_client_burst_then_retry_after():
+    clock = FakeClock()
+    admission = controller(clock, rate=100, burst=100)
+    for _ in range(3):
+        assert admission.reserve("a") == 0.0
+    with pytest.raises(Shed) as shed:
+        admission.reserve("a")
+    assert shed.value.reason == "client"
+    assert shed.value.retry_after == pytest.approx(1.0)
+    body, headers = shed_body(shed.value)
+    assert headers == {"Retry-After": "1"} and body["reason"] == "client" and body["retry_after"] == 1
+    # 其他用戶端不受影響；經過 Retry-After 秒後可再送出
+    assert admission.reserve("b") == 0.0
+    clock.advance(shed.value.retry_after)
+    assert admission.reserve("a") == 0.0
+
+
+def test_queue_full_and_deadline_shed_refund_tokens():
+    clock = FakeClock()
+    admission = controller(clock, client_burst=100, client_rate=100)
+    waits = [admission.reserve(f"c{i}") for i in range(6)]
+    assert waits == pytest.approx([0, 0, 0, 0, 0.5, 1.0])
+    with pytest.raises(Shed) as shed:
+        admission.reserve("c6")
+    assert shed.value.reason == "queue_full"
+    # 佇列已滿（預支 2 個）；回補 1 個 token（1 / rate 秒）後佇列才有空位
+    assert shed.value.retry_after == pytest.approx(0.5)
+    assert shed_body(shed.value)[1] == {"Retry-After": "1"}
+    clock.advance(0.5)
+    assert admission.reserve("c6") == pytest.approx(1.0)
+
+    clock.advance(10)
+    admission = controller(clock, client_burst=100, client_rate=100, burst=1, max_queue=10)
+    admission.reserve("x")
+    with pytest.raises(Shed) as shed:
+        admission.reserve("y", deadline_seconds=0.2)
+    assert shed.value.reason == "deadline"
+    # 被拒絕的請求不佔用名額
+    assert admission.reserve("z", deadline_seconds=0.6) == pytest.approx(0.5)
+
+
+def test_shared_store_splits_budget_between_controllers(tmp_path):
+    clock = FakeClock(time.time())
+    store = BucketStore(str(tmp_path / "admission.sqlite3"))
+    workers = [controller(clock, store=store, max_queue=0, client_burst=100) for _ in range(2)]
+    admitted = 0
+    for i in range(10):
+        try:
+            workers[i % 2].reserve(f"c{i}")
+            admitted += 1
+        except Shed:
+            pass
+    assert admitted == 4
+    clock.advance(1.0)
+    assert workers[1].reserve("late") == 0.0
+    assert workers[0].stats()["tokens"] == 1.0
+    assert workers[0].stats()["shared"] is True
+
+
+def _hammer(path, seconds, queue):
+    store = BucketStore(path)
+    admission = AdmissionController(
+        "test", rate=10, burst=5, client_rate=1000, client_burst=1000, max_queue=0, max_wait=0,
+        metrics=NullMetrics(), store=store,
+    )
+    admitted, stop = 0, time.monotonic() + seconds
+    while time.monotonic() < stop:
+        try:
+            admission.reserve("same")
+            admitted += 1
+        except Shed:
+            pass
+    queue.put(admitted)
+
+
+def test_processes_share_one_rate(tmp_path):
+    path = str(tmp_path / "admission.sqlite3")
+    BucketStore(path)
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    seconds = 1.0
+    start = time.time()
+    procs = [ctx.Process(target=_hammer, args=(path, seconds, queue)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    total = sum(queue.get(timeout=30) for _ in procs)
+    elapsed = time.time() - start
+    for p in procs:
+        p.join()
+    # burst 5 + rate 10 × 經過時間；各行程各自計算時會是 4 倍
+    assert 5 + 10 * seconds - 1 <= total <= 5 + 10 * elapsed + 1
+
+
+@pytest.mark.parametrize("headers, remote, expected", [
+    ({"X-Real-IP": "203.0.113.9"}, "127.0.0.1", "203.0.113.9"),
+    ({"X-Real-IP": "203.0.113.9"}, "198.51.100.7", "198.51.100.7"),
+    ({"X-Forwarded-For": "203.0.113.9, 198.51.100.7, 127.0.0.1"}, "127.0.0.1", "198.51.100.7"),
+    ({}, "::ffff:127.0.0.1", "::ffff:127.0.0.1"),
+    ({}, None, "unknown"),
+])
+def test_client_id_trusts_only_proxies(headers, remote, expected):
+    assert client_id(headers, remote) == expected
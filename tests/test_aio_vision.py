@@ -0,0 +1,102 @@
+# asyncio 服務送出 Gemini Vision 請求：串流本文（分段 base64）經 aiohttp 送到本機替身服務
+import asyncio
+import base64
+import io
+import json
+
+from aiohttp import payload, web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from common.aio_http import AsyncHTTPPool
+from vision_image import StreamingVisionBody
+
+
+def png_bytes(size=640):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), (120, 130, 140)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def standin_app(captured, image=None):
+    """替身服務：記錄收到的 generateContent 請求；/staticmap 回傳固定的衛星圖"""
+
+    async def generate(request):
+        captured.append({
+            "headers": dict(request.headers),
+            "body": await request.read(),
+            "chunked": request.headers.get("Transfer-Encoding", "").lower() == "chunked",
+        })
+        text = json.dumps({"area": 123.4, "polygon": [{"lat": 25.0, "lng": 121.5}]})
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+    async def staticmap(request):
+        return web.Response(body=image, content_type="image/png")
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/models/{model}", generate)
+    app.router.add_get("/staticmap", staticmap)
+    return app
+
+
+def decode_vision_request(captured):
+    data = json.loads(captured["body"])
+    part = data["contents"][0]["parts"][1]["inlineData"]
+    return data["contents"][0]["parts"][0]["text"], part["mimeType"], base64.b64decode(part["data"])
+
+
+def test_streaming_body_through_async_pool():
+    # 奇數長度的圖片，最後一段 base64 需補齊
+    image = bytes(range(256)) * 1000 + b"xy"
+    body = StreamingVisionBody("辨識屋頂", image, "image/png")
+    captured = []
+
+    async def run():
+        async with TestServer(standin_app(captured)) as server:
+            pool = AsyncHTTPPool()
+            try:
+                resp = await pool.post(
+                    str(server.make_url("/v1/models/m:generateContent")),
+                    headers={"Content-Type": "application/json", "Content-Length": str(len(body))},
+                    data=payload.AsyncIterablePayload(body, content_type="application/json"),
+                )
+            finally:
+                await pool.close()
+            return resp
+
+    resp = asyncio.run(run())
+    assert resp.status_code == 200
+    request = captured[0]
+    assert not request["chunked"]
+    assert int(request["headers"]["Content-Length"]) == len(request["body"]) == len(body)
+    assert decode_vision_request(request) == ("辨識屋頂", "image/png", image)
+
+
+def test_roof_detect_sends_vision_request_through_aio_app(monkeypatch):
+    import aio_app
+
+    roof = aio_app.roof
+    image = png_bytes()
+    captured = []
+
+    async def run():
+        async with TestServer(standin_app(captured, image)) as standin:
+            base = str(standin.make_url("")).rstrip("/")
+            monkeypatch.setattr(roof, "GEMINI_API_BASE", base)
+            monkeypatch.setattr(roof, "static_map_url", lambda params: f"{base}/staticmap")
+            async with TestClient(TestServer(aio_app.create_aio_app())) as client:
+                resp = await client.post("/api/roof-detect", json={"lat": 24.98731, "lng": 121.54412})
+                return resp.status, await resp.json()
+
+    status, result = asyncio.run(run())
+    assert status == 200, result
+    assert result["area"] == 123.4 and result["source"] == "gemini"
+    assert len(captured) == 1
+    request = captured[0]
+    assert not request["chunked"]
+    assert int(request["headers"]["Content-Length"]) == len(request["body"])
+    prompt, mime_type, sent = decode_vision_request(request)
+    assert prompt == roof.ROOF_PROMPT_AUTO
+    with Image.open(io.BytesIO(sent)) as sent_image:
+        assert sent_image.format.lower() == mime_type.split("/")[1]
+        assert max(sent_image.size) <= roof.VISION_MAX_PX
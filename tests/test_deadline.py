@@ -0,0 +1,127 @@
+# 請求期限：回應緩慢滴入時整個請求仍在期限內結束、用戶端離開時提早結束、期限已到時不送出請求
+import http.server
+import threading
+import time
+
+import pytest
+
+from common.deadline import Deadline, DeadlineExceeded, request_deadline
+from common.http_pool import HTTPPool
+
+
+class RecordingMetrics:
+    def __init__(self):
+        self.events = []
+
+    def incr(self, name, value=1, **labels):
+        self.events.append((name, labels))
+
+    def observe(self, *args, **kwargs):
+        pass
+
+    def gauge_set(self, *args, **kwargs):
+        pass
+
+    def count(self, name, **labels):
+        return sum(1 for n, l in self.events if n == name and all(l.get(k) == v for k, v in labels.items()))
+
+
+class TrickleHandler(http.server.BaseHTTPRequestHandler):
+    """/slow 每 0.1 秒送出 1 個位元組（每次讀取都不會逾時），/fast 立即回應"""
+
+    def do_GET(self):
+        self.server.hits += 1
+        body = b"x" * 50
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for i in range(len(body)):
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+                if self.path == "/slow":
+                    time.sleep(0.1)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TrickleHandler)
+    httpd.daemon_threads = True
+    httpd.hits = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_without_deadline_waits_for_response(server):
+    pool = HTTPPool(pool_size=2, metrics=RecordingMetrics())
+    assert pool.get(url(server, "/fast")).content == b"x" * 50
+
+
+def test_trickling_response_stops_at_deadline(server):
+    metrics = RecordingMetrics()
+    pool = HTTPPool(pool_size=2, metrics=metrics)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as exc:
+        pool.get(url(server, "/slow"), deadline=Deadline(1.0))
+    elapsed = time.monotonic() - start
+    assert exc.value.reason == "deadline"
+    # 回應需要 5 秒；呼叫端在期限（外加至多一次檢查間隔）內結束
+    assert 1.0 <= elapsed < 1.6
+    assert metrics.count("http_deadline_exceeded_total", reason="deadline") >= 1
+
+
+def test_client_leaving_stops_waiting(server):
+    metrics = RecordingMetrics()
+    pool = HTTPPool(pool_size=2, metrics=metrics)
+    gone_at = time.monotonic() + 0.5
+    deadline = Deadline(10.0, is_cancelled=lambda: time.monotonic() >= gone_at)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as exc:
+        pool.get(url(server, "/slow"), deadline=deadline)
+    assert exc.value.reason == "cancelled"
+    assert time.monotonic() - start < 1.0
+    assert metrics.count("http_deadline_exceeded_total", reason="cancelled") == 1
+
+
+def test_expired_deadline_is_not_sent(server):
+    pool = HTTPPool(pool_size=2, metrics=RecordingMetrics())
+    with pytest.raises(DeadlineExceeded):
+        pool.get(url(server, "/fast"), deadline=Deadline(0.0))
+    with pytest.raises(DeadlineExceeded) as exc:
+        pool.get(url(server, "/fast"), deadline=Deadline(5.0, is_cancelled=lambda: True))
+    assert exc.value.reason == "cancelled"
+    assert server.hits == 0
+
+
+def test_fast_response_within_deadline(server):
+    pool = HTTPPool(pool_size=2, metrics=RecordingMetrics())
+    assert pool.get(url(server, "/fast"), deadline=Deadline(5.0)).status_code == 200
+
+
+def test_deadline_timeouts_never_exceed_remaining():
+    clock = [100.0]
+    deadline = Deadline(2.0, clock=lambda: clock[0])
+    assert deadline.timeout(3.05, 30) == (2.0, 2.0)
+    clock[0] += 1.5
+    assert deadline.timeout(0.2, 30) == (0.2, 0.5)
+    clock[0] += 1.0
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(3.05, 30)
+
+
+@pytest.mark.parametrize("value, expected", [(None, 30.0), ("1500", 1.5), ("999999", 30.0), ("abc", 30.0), ("-5", 0.0)])
+def test_request_deadline_header_only_shortens(value, expected):
+    headers = {} if value is None else {"X-Request-Timeout-Ms": value}
+    assert request_deadline(headers, 30.0).seconds == expected
@@ -0,0 +1,120 @@
+# 衛星圖快取：多個行程共用索引與容量上限、並行寫入、mmap 讀取
+import multiprocessing
+import os
+
+import pytest
+
+from imagery_cache import ImageryCache
+
+
+def blob(i, size=1000):
+    return bytes([i % 256]) * size
+
+
+def disk_bytes(root):
+    total = 0
+    for dirpath, _, names in os.walk(os.path.join(root, "blobs")):
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in names)
+    return total
+
+
+def test_get_put_and_mapped_view(tmp_path):
+    cache = ImageryCache(str(tmp_path), 10_000)
+    assert cache.get("a") is None
+    cache.put("a", blob(1))
+    assert cache.get("a") == blob(1)
+    with cache.mapped("a") as view:
+        assert isinstance(view, memoryview)
+        assert view.readonly
+        assert view[:3].tobytes() == blob(1)[:3]
+    with pytest.raises(ValueError):
+        view.tobytes()
+    with cache.mapped("missing") as view:
+        assert view is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_same_content_shares_blob(tmp_path):
+    cache = ImageryCache(str(tmp_path), 10_000)
+    cache.put("a", blob(1))
+    cache.put("b", blob(1))
+    stats = cache.stats()
+    assert (stats["entries"], stats["blobs"], stats["bytes"]) == (2, 1, 1000)
+
+
+def test_capacity_is_shared_between_workers(tmp_path):
+    # 兩個 worker（各自的 ImageryCache 物件）共用同一份索引，總容量不超過 max_bytes
+    workers = [ImageryCache(str(tmp_path), 3000) for _ in range(2)]
+    for i in range(10):
+        workers[i % 2].put(f"k{i}", blob(i))
+    assert disk_bytes(str(tmp_path)) <= 3000
+    for worker in workers:
+        stats = worker.stats()
+        assert stats["bytes"] <= 3000 and stats["entries"] == 3
+    # 最近寫入的三張仍可由任一 worker 讀到
+    for i in (7, 8, 9):
+        assert workers[0].get(f"k{i}") == blob(i)
+        assert workers[1].get(f"k{i}") == blob(i)
+
+
+def test_evicted_by_other_worker_is_a_miss(tmp_path):
+    first, second = ImageryCache(str(tmp_path), 2000), ImageryCache(str(tmp_path), 2000)
+    first.put("old", blob(1))
+    second.put("k1", blob(2))
+    second.put("k2", blob(3))
+    assert first.get("old") is None
+    assert first.get("k2") == blob(3)
+
+
+def test_missing_blob_is_removed_from_index(tmp_path):
+    cache = ImageryCache(str(tmp_path), 10_000)
+    cache.put("a", blob(1))
+    os.remove(cache._blob_path(cache._conn().execute("SELECT digest FROM imagery_entries").fetchone()[0]))
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def _put_many(root, worker, count, queue):
+    cache = ImageryCache(root, 20_000)
+    for i in range(count):
+        # 所有行程寫入相同的 key 與內容，模擬多個 worker 同時取得同一張圖
+        cache.put(f"shared{i % 5}", blob(i % 5, 4000))
+        cache.put(f"w{worker}-{i}", blob(worker * 100 + i, 500))
+    queue.put(worker)
+
+
+def test_concurrent_processes(tmp_path):
+    root = str(tmp_path)
+    ImageryCache(root, 20_000)
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_put_many, args=(root, w, 40, queue)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert sorted(queue.get(timeout=5) for _ in procs) == [0, 1, 2, 3]
+    cache = ImageryCache(root, 20_000)
+    assert disk_bytes(root) <= 20_000
+    assert cache.stats()["bytes"] == disk_bytes(root)
+    # 沒有殘留的暫存檔，每個索引中的 key 都讀得到正確內容
+    leftovers = [n for _, _, names in os.walk(os.path.join(root, "blobs")) for n in names if n.startswith(".tmp")]
+    assert leftovers == []
+    for key, in cache._conn().execute("SELECT key FROM imagery_entries").fetchall():
+        content = cache.get(key)
+        assert content is not None
+        if key.startswith("shared"):
+            assert content == blob(int(key[len("shared"):]), 4000)
+
+
+def test_imports_legacy_key_files(tmp_path):
+    cache = ImageryCache(str(tmp_path), 10_000)
+    cache.put("a", blob(1))
+    digest = cache._conn().execute("SELECT digest FROM imagery_entries").fetchone()[0]
+    cache._conn().execute("DELETE FROM imagery_entries")
+    cache._conn().execute("DELETE FROM imagery_blobs")
+    os.makedirs(tmp_path / "keys")
+    (tmp_path / "keys" / "a").write_text(digest, encoding="utf-8")
+    reopened = ImageryCache(str(tmp_path), 10_000)
+    assert reopened.get("a") == blob(1)
+    assert not (tmp_path / "keys").exists()
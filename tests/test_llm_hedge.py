@@ -0,0 +1,124 @@
+# LLM 期限對沖：逾時改用本地評分、背景完成後回填快取、用戶端離開時不再等待
+import asyncio
+import threading
+import time
+
+from llm_hedge import PARSE_FAILED_TEXT, HedgedLLM
+
+
+def fallback(data):
+    return {"final_recommendation": "本地評分", "input": data}
+
+
+class SlowLLM:
+    """呼叫後等待 release 才回傳；記錄呼叫次數"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result or {"final_recommendation": "推薦安裝", "explanation_text": "ok"}
+        self.error = error
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self, prompt):
+        self.calls += 1
+        self.release.wait(10)
+        if self.error:
+            raise self.error
+        return dict(self.result, prompt=prompt)
+
+
+def wait_until(predicate, timeout=5.0):
+    stop = time.monotonic() + timeout
+    while time.monotonic() < stop:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_fast_llm_then_cache():
+    llm = SlowLLM()
+    llm.release.set()
+    hedge = HedgedLLM(llm, fallback, deadline_seconds=2.0)
+    result, source = hedge.decide("k", "p", "f")
+    assert source == "llm" and result["prompt"] == "p"
+    assert wait_until(lambda: hedge.is_cached("k"))
+    assert hedge.decide("k", "p", "f")[1] == "cache"
+    assert llm.calls == 1
+
+
+def test_slow_llm_falls_back_then_backfills():
+    llm = SlowLLM()
+    hedge = HedgedLLM(llm, fallback, deadline_seconds=0.2)
+    start = time.monotonic()
+    result, source = hedge.decide("k", "p", "f")
+    assert source == "rule_based" and result == fallback("f")
+    assert time.monotonic() - start < 1.0
+    llm.release.set()
+    assert wait_until(lambda: hedge.is_cached("k"))
+    result, source = hedge.decide("k", "p", "f")
+    assert source == "cache" and result["final_recommendation"] == "推薦安裝"
+
+
+def test_concurrent_requests_share_one_call():
+    llm = SlowLLM()
+    hedge = HedgedLLM(llm, fallback, deadline_seconds=0.2)
+    sources = []
+    threads = [threading.Thread(target=lambda: sources.append(hedge.decide("k", "p", "f")[1])) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sources == ["rule_based"] * 5
+    llm.release.set()
+    assert wait_until(lambda: hedge.is_cached("k"))
+    assert llm.calls == 1
+
+
+def test_errors_and_parse_failures_are_not_cached():
+    failing = SlowLLM(error=RuntimeError("boom"))
+    failing.release.set()
+    hedge = HedgedLLM(failing, fallback, deadline_seconds=1.0)
+    assert hedge.decide("k", "p", "f")[1] == "rule_based"
+    unparsed = SlowLLM(result={"explanation_text": PARSE_FAILED_TEXT})
+    unparsed.release.set()
+    hedge = HedgedLLM(unparsed, fallback, deadline_seconds=1.0)
+    assert hedge.decide("k", "p", "f")[1] == "rule_based"
+    time.sleep(0.1)
+    assert not hedge.is_cached("k")
+
+
+def test_client_leaving_stops_waiting_but_backfills():
+    llm = SlowLLM()
+    hedge = HedgedLLM(llm, fallback, deadline_seconds=10.0)
+    gone_at = time.monotonic() + 0.3
+    start = time.monotonic()
+    result, source = hedge.decide("k", "p", "f", is_cancelled=lambda: time.monotonic() >= gone_at)
+    assert source == "rule_based"
+    assert time.monotonic() - start < 1.0
+    llm.release.set()
+    assert wait_until(lambda: hedge.is_cached("k"))
+
+
+def test_decide_async_falls_back_then_backfills():
+    async def run():
+        gate = asyncio.Event()
+        calls = []
+
+        async def llm(prompt):
+            calls.append(prompt)
+            await gate.wait()
+            return {"final_recommendation": "推薦安裝", "explanation_text": "ok"}
+
+        hedge = HedgedLLM(None, fallback, deadline_seconds=0.1)
+        first = await hedge.decide_async("k", llm, "p", "f")
+        second = await hedge.decide_async("k", llm, "p", "f")
+        gate.set()
+        for _ in range(100):
+            if hedge.is_cached("k"):
+                break
+            await asyncio.sleep(0.01)
+        third = await hedge.decide_async("k", llm, "p", "f")
+        return first[1], second[1], third[1], len(calls)
+
+    assert asyncio.run(run()) == ("rule_based", "rule_based", "cache", 1)
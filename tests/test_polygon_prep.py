@@ -0,0 +1,110 @@
+# 自相交偵測：掃描線與逐對檢查的結果一致（含整數格點上的退化情況）
+import random
+
+import numpy as np
+import pytest
+
+from polygon_prep import PolygonError, _folds_back, _segments_intersect, find_self_intersection, prepare_polygon
+
+
+def edges_intersect(pts, i, j):
+    """逐對檢查的定義：非相鄰的邊有任何接觸、相鄰的邊共線往回折都算相交"""
+    n = len(pts)
+    a, b = pts[i], pts[(i + 1) % n]
+    c, d = pts[j], pts[(j + 1) % n]
+    if (j - i) % n == 1:
+        return _folds_back(a, b, d)
+    if (i - j) % n == 1:
+        return _folds_back(c, d, b)
+    return _segments_intersect(a, b, c, d)
+
+
+def brute_force(xy):
+    pts = [tuple(p) for p in xy.tolist()]
+    n = len(pts)
+    return any(edges_intersect(pts, i, j) for i in range(n) for j in range(i + 1, n))
+
+
+def random_ring(rng, n, grid):
+    """整數格點上不含連續重複點（含頭尾）的隨機環"""
+    while True:
+        pts = [(rng.randrange(grid), rng.randrange(grid)) for _ in range(n)]
+        if all(pts[i] != pts[i - 1] for i in range(n)):
+            return np.array(pts, dtype=float)
+
+
+def assert_matches(xy):
+    hit = find_self_intersection(xy)
+    assert (hit is not None) == brute_force(xy), xy.tolist()
+    if hit is not None:
+        pts = [tuple(p) for p in xy.tolist()]
+        assert edges_intersect(pts, *hit), (xy.tolist(), hit)
+
+
+@pytest.mark.parametrize("grid", [3, 4, 6, 10])
+def test_integer_grid_matches_brute_force(grid):
+    rng = random.Random(grid)
+    for _ in range(5000):
+        assert_matches(random_ring(rng, rng.randrange(3, 10), grid))
+
+
+def test_random_float_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        assert_matches(rng.random((int(rng.integers(3, 16)), 2)) * 100)
+
+
+@pytest.mark.parametrize("ring", [
+    # 頂點碰到非相鄰的邊（T 形接觸）
+    [(0, 0), (4, 0), (4, 4), (2, 0.0 + 0), (0, 4)],
+    [(0, 0), (4, 0), (4, 4), (2, 4), (2, 0)],
+    # 頂點碰到垂直邊
+    [(0, 0), (2, 0), (2, 4), (0, 4), (2, 2), (-1, 2)],
+    # 相鄰的邊共線往回折
+    [(0, 0), (4, 0), (2, 0), (2, 3)],
+    [(0, 0), (0, 4), (0, 2), (3, 2)],
+    # 非相鄰的邊共線重疊
+    [(0, 0), (4, 0), (4, 2), (3, 0), (1, 0), (0, 2)],
+    # 共線的退化三角形
+    [(0, 0), (2, 0), (1, 0)],
+])
+def test_degenerate_contacts_are_intersections(ring):
+    xy = np.array(ring, dtype=float)
+    assert brute_force(xy)
+    assert_matches(xy)
+
+
+@pytest.mark.parametrize("ring", [
+    [(0, 0), (4, 0), (4, 4), (0, 4)],
+    # 凹多邊形，頂點與其他邊同一條鉛直線上但不接觸
+    [(0, 0), (4, 0), (4, 4), (2, 1), (0, 4)],
+    [(0, 0), (2, 0), (2, 3), (1, 1), (1, 3), (0, 3)],
+    # 相鄰的邊共線但不往回折（直線上的中間點）
+    [(0, 0), (2, 0), (4, 0), (4, 4), (0, 4)],
+])
+def test_simple_rings(ring):
+    xy = np.array(ring, dtype=float)
+    assert find_self_intersection(xy) is None
+    assert not brute_force(xy)
+
+
+def test_large_ring_is_fast_and_simple():
+    # 星形多邊形（依角度排序的頂點）不自相交
+    rng = np.random.default_rng(1)
+    angles = np.sort(rng.random(20000) * 2 * np.pi)
+    radii = 50 + rng.random(20000) * 10
+    xy = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+    assert find_self_intersection(xy) is None
+    xy[[100, 10100]] = xy[[10100, 100]]
+    assert find_self_intersection(xy) is not None
+
+
+def test_prepare_polygon_rejects_touching_vertex():
+    # 第 3 個頂點回到第 1 個頂點：多邊形在該點自我接觸
+    d = 1e-5
+    polygon = [
+        {"lat": 25.0, "lng": 121.5}, {"lat": 25.0, "lng": 121.5 + 4 * d}, {"lat": 25.0 + 4 * d, "lng": 121.5 + 4 * d},
+        {"lat": 25.0, "lng": 121.5 + 4 * d}, {"lat": 25.0 + 4 * d, "lng": 121.5},
+    ]
+    with pytest.raises(PolygonError):
+        prepare_polygon(polygon)
@@ -0,0 +1,70 @@
+# 推薦查表與逐條公式計算的一致性：查表命中的每個欄位都必須與逐條計算完全相同
+import random
+
+import pytest
+
+from dsa_backend import app as recommend
+from recommend_cube import capacity_segments
+
+config = recommend.recommend_config
+
+
+@pytest.fixture(scope="module")
+def cube_table():
+    config.warm()
+    assert config.cube._cities, "查表未建立"
+    return config.cube._cities
+
+
+def assert_same_as_formulas(monkeypatch, table, inputs):
+    for data in inputs:
+        monkeypatch.setattr(config.cube, "_cities", table)
+        cached, status = recommend.recommend_payload(data)
+        assert status == 200
+        # 清空查表即每個模組都逐條計算
+        monkeypatch.setattr(config.cube, "_cities", {})
+        evaluated, _ = recommend.recommend_payload(data)
+        assert cached == evaluated, data
+
+
+def test_cube_has_arithmetic_fields(cube_table):
+    # 算術欄位依公式順序以陣列計算，其餘為分段線性查表；兩者都要有才測得到兩條路徑
+    assert config.cube.stats()["arithmetic"]
+
+
+def test_cube_matches_formulas_on_grid(monkeypatch, cube_table):
+    inputs = [
+        {"roof_area_m2": area, "coverage_rate": coverage, "address": city}
+        for city in cube_table
+        for area in range(1, 1001, 7)
+        for coverage in (0.75, 1)
+    ]
+    assert_same_as_formulas(monkeypatch, cube_table, inputs)
+
+
+def test_cube_matches_formulas_at_tier_bounds(monkeypatch, cube_table):
+    # 容量恰在費率級距邊界與其兩側：面積 = 邊界 / 每平方公尺容量；縣市輪流取用，控制測試時間
+    cities = sorted(cube_table)
+    inputs = []
+    for bound in capacity_segments(config.fit_rate_table):
+        for per_m2 in sorted(set(cube_table[cities[0]][0].tolist())):
+            if per_m2 > 0:
+                for scale in (1 - 1e-9, 1, 1 + 1e-9):
+                    city = cities[len(inputs) % len(cities)]
+                    inputs.append({"roof_area_m2": bound / per_m2 * scale, "coverage_rate": 1, "address": city})
+    assert inputs
+    assert_same_as_formulas(monkeypatch, cube_table, inputs)
+
+
+def test_cube_matches_formulas_on_random_inputs(monkeypatch, cube_table):
+    rng = random.Random(11)
+    cities = sorted(cube_table)
+    inputs = [
+        {
+            "roof_area_m2": rng.choice([rng.uniform(0.1, 5000), rng.uniform(1, 50)]),
+            "coverage_rate": rng.choice([rng.random(), 0.8, 0.5]),
+            "address": rng.choice(cities),
+        }
+        for _ in range(2000)
+    ]
+    assert_same_as_formulas(monkeypatch, cube_table, inputs)
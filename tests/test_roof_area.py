@@ -0,0 +1,77 @@
+# 面積引擎與橢球面積參考值比較：經緯度矩形的解析解、geographiclib 的測地線多邊形
+import math
+
+import numpy as np
+import pytest
+
+from roof_area import polygon_area, signed_ring_area, signed_ring_areas_batch
+
+A = 6378137.0
+F = 1 / 298.257223563
+E2 = F * (2 - F)
+E = math.sqrt(E2)
+
+
+def zone_area(lat1, lat2, dlng_deg):
+    """WGS84 橢球上兩條緯線與兩條經線圍成的面積（解析解）"""
+    def q(lat):
+        s = math.sin(math.radians(lat))
+        return s / (1 - E2 * s * s) + math.log((1 + E * s) / (1 - E * s)) / (2 * E)
+
+    return A * A * (1 - E2) / 2 * math.radians(dlng_deg) * (q(lat2) - q(lat1))
+
+
+def rectangle(lat, lng, dlat, dlng):
+    return np.array([(lat, lng), (lat, lng + dlng), (lat + dlat, lng + dlng), (lat + dlat, lng)])
+
+
+@pytest.mark.parametrize("lat", [0.0, 22.6, 25.03, 45.0, 60.0])
+@pytest.mark.parametrize("size", [1e-4, 1e-3, 5e-3])
+def test_rectangle_matches_ellipsoid_zone(lat, size):
+    # 小範圍內緯線與投影平面上的直線幾乎重合，差異遠小於 1e-8
+    expected = zone_area(lat, lat + size, size)
+    assert polygon_area(rectangle(lat, 121.5, size, size)) == pytest.approx(expected, rel=1e-8)
+
+
+def test_matches_geodesic_polygons():
+    geodesic = pytest.importorskip("geographiclib.geodesic").Geodesic.WGS84
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        lat0, lng0 = rng.uniform(21.5, 25.5), rng.uniform(119.5, 122.5)
+        n = int(rng.integers(3, 12))
+        angles = np.sort(rng.random(n) * 2 * np.pi)
+        radii = rng.uniform(5, 300) * (0.6 + 0.4 * rng.random(n))
+        lats = lat0 + radii * np.sin(angles) / 111000
+        lngs = lng0 + radii * np.cos(angles) / (111000 * math.cos(math.radians(lat0)))
+        reference = geodesic.Polygon()
+        for lat, lng in zip(lats, lngs):
+            reference.AddPoint(lat, lng)
+        expected = abs(reference.Compute()[2])
+        # 屋頂尺度（數十至數萬平方米）誤差在公分平方等級
+        assert polygon_area(np.column_stack([lats, lngs])) == pytest.approx(expected, rel=1e-6, abs=0.01)
+
+
+def test_orientation_closing_point_and_holes():
+    outer = rectangle(25.0, 121.5, 1e-3, 1e-3)
+    hole = rectangle(25.0002, 121.5002, 2e-4, 2e-4)
+    area = polygon_area(outer)
+    assert signed_ring_area(outer[:, 0], outer[:, 1]) == pytest.approx(area)
+    assert signed_ring_area(outer[::-1, 0], outer[::-1, 1]) == pytest.approx(-area)
+    closed = np.vstack([outer, outer[:1]])
+    assert polygon_area(closed) == pytest.approx(area)
+    expected = zone_area(25.0, 25.001, 1e-3) - zone_area(25.0002, 25.0004, 2e-4)
+    assert polygon_area(outer, [hole[::-1]]) == pytest.approx(expected, rel=1e-8)
+
+
+def test_batch_matches_single_rings():
+    rng = np.random.default_rng(1)
+    rings = []
+    for _ in range(50):
+        n = int(rng.integers(3, 9))
+        angles = np.sort(rng.random(n) * 2 * np.pi)
+        lat0, lng0 = rng.uniform(21.5, 25.5), rng.uniform(119.5, 122.5)
+        rings.append(np.column_stack([lat0 + 1e-3 * np.sin(angles), lng0 + 1e-3 * np.cos(angles)]))
+    starts = np.cumsum([0] + [len(r) for r in rings[:-1]])
+    batch = signed_ring_areas_batch(np.vstack(rings), starts)
+    single = [signed_ring_area(r[:, 0], r[:, 1]) for r in rings]
+    assert batch == pytest.approx(single, rel=1e-9)
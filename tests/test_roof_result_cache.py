@@ -0,0 +1,60 @@
+# 屋頂辨識結果快取 key：同一屋頂重畫命中，相鄰的同形屋頂互不命中
+import math
+
+import pytest
+
+from roof_result_cache import RoofResultCache
+
+
+def square(lat, lng, side_m=6.0):
+    dlat = side_m / 111320
+    dlng = side_m / (111320 * math.cos(math.radians(lat)))
+    return [
+        {"lat": lat, "lng": lng},
+        {"lat": lat, "lng": lng + dlng},
+        {"lat": lat + dlat, "lng": lng + dlng},
+        {"lat": lat + dlat, "lng": lng},
+    ]
+
+
+def east(lat, meters):
+    return meters / (111320 * math.cos(math.radians(lat)))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return RoofResultCache(str(tmp_path / "roof_results.sqlite3"))
+
+
+def test_redrawn_polygon_shares_key(cache):
+    polygon = square(25.0331, 121.5654)
+    # 起點不同、頂點抖動數公分
+    redrawn = polygon[2:] + polygon[:2]
+    redrawn = [{"lat": p["lat"] + 2e-7, "lng": p["lng"] - 2e-7} for p in redrawn]
+    assert cache.make_key("v", polygon)[0] == cache.make_key("v", redrawn)[0]
+
+
+@pytest.mark.parametrize("offset_m", [3.0, 7.0, 12.0])
+def test_translated_copy_misses(cache, offset_m):
+    lat, lng = 25.0331, 121.5654
+    left = square(lat, lng)
+    right = square(lat, lng + east(lat, offset_m))
+    left_key, geohash, key_lat, key_lng = cache.make_key("v", left)
+    cache.put(left_key, geohash, key_lat, key_lng, "v", {"area": 36.0, "polygon": left})
+    right_key = cache.make_key("v", right)[0]
+    assert right_key != left_key
+    assert cache.get(right_key) is None
+    assert cache.get(left_key)["polygon"] == left
+
+
+def test_row_houses_in_same_geohash_cell(cache):
+    # 連棟透天厝：同一個 geohash-8 格內的多棟同形屋頂各自一個 key
+    lat, lng = 25.0331, 121.5654
+    keys = [cache.make_key("v", square(lat, lng + east(lat, 6.5 * i)))[0] for i in range(4)]
+    assert len({key.split(":")[0] for key in keys}) < len(keys)
+    assert len(set(keys)) == len(keys)
+
+
+def test_version_separates_keys(cache):
+    polygon = square(25.0331, 121.5654)
+    assert cache.make_key("gemini", polygon)[0] != cache.make_key("local", polygon)[0]